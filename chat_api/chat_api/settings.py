@@ -55,6 +55,7 @@ MIDDLEWARE = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_EXPOSE_HEADERS = ['X-Next-Since']
 
 ROOT_URLCONF = 'chat_api.urls'
 
@@ -132,4 +133,26 @@ config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "../confi
 with open(config_path, "r") as f:
     config = json.load(f)
 
-API_TOKEN = config.get("api_token")
\ No newline at end of file
+API_TOKEN = config.get("api_token")
+
+# Fuente de /api/messages, /api/stats y el stream: "file" (messages.json de
+# server_weak) o "sqlite" (BD replicada de server_tls, solo lectura)
+MESSAGES_BACKEND = config.get("messages_backend", "file")
+
+# Archivo de mensajes (relativo a la raíz del repo, como en server_weak)
+MESSAGES_FILE = os.path.join(BASE_DIR.parent, config.get("message_file", "messages.json"))
+
+# Réplica de server_tls que lee el backend "sqlite"
+REPLICA_DB = os.path.join(BASE_DIR.parent, config.get("replica_db", "server_tls/messages_a.db"))
+
+# SSE (/api/messages/stream): cada cuánto se revisa el archivo y cada cuánto
+# se envía un comentario para mantener viva la conexión (segundos)
+SSE_POLL_INTERVAL = float(config.get("sse_poll_interval", 0.5))
+SSE_KEEPALIVE = float(config.get("sse_keepalive", 15))
+
+# Página de /api/messages sin ?limit= y tope de ?limit=
+MESSAGES_DEFAULT_LIMIT = int(config.get("messages_default_limit", 100))
+MESSAGES_MAX_LIMIT = int(config.get("messages_max_limit", 10000))
+
+# Entradas de la caché LRU de respuestas serializadas (/api/messages, /api/stats)
+RESPONSE_CACHE_SIZE = int(config.get("response_cache_size", 128))
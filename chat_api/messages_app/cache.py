@@ -0,0 +1,30 @@
+"""
+Caché LRU acotada de respuestas ya serializadas.
+
+Cada entrada guarda la versión del store con la que se generó: si la
+versión actual es otra, la entrada no sirve y se vuelve a consultar.
+"""
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._data[key] = (version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
@@ -0,0 +1,131 @@
+"""
+Backend de solo lectura sobre la BD replicada de server_tls (messages_X.db).
+
+Misma interfaz que store.MessageStore, pero el cursor es el id de la fila
+(orden de inserción en esa réplica) y las consultas van a SQLite por una
+única conexión de lectura compartida. Los conteos por usuario se cachean
+y se actualizan solo con las filas nuevas: /api/stats sale de ahí y el
+filtro por subcadena se resuelve contra esos nombres y luego se consulta
+por el índice (user, id).
+Los mensajes privados de server_tls (/msg) nunca se exponen.
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from .store import normalize_user
+
+
+def row_json(row):
+    _id, user, message, timestamp, lamport, server_id = row
+    return json.dumps({
+        "timestamp": timestamp,
+        "user": user,
+        "message": message,
+        "lamport": lamport,
+        "server_id": server_id,
+    }).encode("utf-8")
+
+
+class SQLiteMessageStore:
+    COLUMNS = "id, user, message, timestamp, lamport, server_id"
+
+    def __init__(self, db_path):
+        self.path = db_path
+        self._lock = threading.Lock()
+        uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA query_only=ON;")
+        self.offset = 0          # id máximo visto
+        self.generation = 0
+        self.user_counts = {}    # usuario -> mensajes públicos
+        self._users_id = 0       # hasta qué id están contados
+        self.public = self._public_filter()
+
+    def _public_filter(self):
+        """Condición que excluye los privados (si la réplica ya tiene la columna)."""
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(messages)")]
+        return " AND recipient IS NULL" if "recipient" in columns else ""
+
+    def version(self):
+        """Versión de la réplica (id máximo) sin leer mensajes."""
+        with self._lock:
+            (max_id,) = self.conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM messages"
+            ).fetchone()
+        return f"{self.generation}-{max_id}"
+
+    def refresh(self):
+        """
+        Actualiza el id máximo y los conteos por usuario con las filas nuevas.
+        Retorna True si la BD fue reemplazada (el id máximo retrocedió).
+        """
+        with self._lock:
+            cur = self.conn.cursor()
+            (max_id,) = cur.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()
+            rotated = max_id < self.offset
+            if rotated:
+                self.generation += 1
+                self.user_counts = {}
+                self._users_id = 0
+            if rotated or not self.public:
+                # server_tls agrega la columna al migrar una réplica anterior
+                self.public = self._public_filter()
+            if max_id > self._users_id:
+                cur.execute(
+                    f"SELECT user, COUNT(*) FROM messages WHERE id > ? AND id <= ?{self.public} GROUP BY user",
+                    (self._users_id, max_id)
+                )
+                for user, count in cur.fetchall():
+                    self.user_counts[user] = self.user_counts.get(user, 0) + count
+                self._users_id = max_id
+            self.offset = max_id
+            cur.close()
+            return rotated
+
+    def query(self, user_filter=None, since=None, offset=0, limit=None, tail=False):
+        """Igual que MessageStore.query; `since` es un id de fila."""
+        sql = f"SELECT {self.COLUMNS} FROM messages WHERE id > ?{self.public}"
+        params = [since or 0]
+        if user_filter:
+            needle = normalize_user(user_filter)
+            # refresh() modifica los conteos bajo el lock: se recorre una copia
+            with self._lock:
+                users = list(self.user_counts)
+            names = [u for u in users if needle in normalize_user(u)]
+            if not names:
+                return b"[]", since or 0
+            sql += " AND user IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(names))
+        sql += f" ORDER BY id{' DESC' if tail else ''} LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+
+        with self._lock:
+            cur = self.conn.cursor()
+            rows = cur.execute(sql, params).fetchall()
+            cur.close()
+        if tail:
+            rows.reverse()
+        body = b"[" + b", ".join(row_json(r) for r in rows) + b"]"
+        cursor = rows[-1][0] if rows else (since or 0)
+        return body, cursor
+
+    def stats(self):
+        with self._lock:
+            return {
+                "total_messages": sum(self.user_counts.values()),
+                "unique_users": len(self.user_counts),
+                "user_counts": dict(self.user_counts),
+            }
+
+    def entries_after(self, offset, end=None):
+        """[(id, usuario, json)] de las filas con offset < id <= end."""
+        with self._lock:
+            cur = self.conn.cursor()
+            rows = cur.execute(
+                f"SELECT {self.COLUMNS} FROM messages WHERE id > ? AND id <= ?{self.public} ORDER BY id",
+                (offset, self.offset if end is None else end)
+            ).fetchall()
+            cur.close()
+        return [(r[0], r[1], row_json(r)) for r in rows]
@@ -0,0 +1,196 @@
+"""
+Índice en memoria de messages.json, compartido por todo el proceso.
+
+MessageStore sigue el archivo desde el último offset leído: cada request
+solo hace un stat() y parsea las líneas nuevas. Por mensaje guarda el
+JSON tal como está en el archivo (bytes), el usuario y el offset donde
+termina la línea; las respuestas se arman uniendo esos bytes, sin volver
+a serializar. Los conteos por usuario y el índice nombre normalizado ->
+posiciones se mantienen al agregar: buscar por usuario recorre solo los
+nombres distintos y luego las posiciones de los que coinciden.
+
+Si el archivo se reemplaza (otro inodo) o se trunca, se descarta el
+índice y se vuelve a leer desde el inicio.
+"""
+import heapq
+import json
+import os
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from django.conf import settings
+
+
+def normalize_user(user):
+    return (user or "").strip().lower()
+
+
+def _iter_from(positions, start):
+    """Recorre positions desde el primer valor >= start."""
+    for i in range(bisect_left(positions, start), len(positions)):
+        yield positions[i]
+
+
+class MessageStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0          # bytes del archivo ya indexados
+        self.inode = None
+        self.raw = []            # JSON de cada mensaje (bytes)
+        self.users = []          # usuario de cada mensaje
+        self.ends = array("q")   # offset donde termina cada línea
+        self.user_counts = {}
+        self.user_index = {}     # usuario normalizado -> posiciones (crecientes)
+        # Cambia con cada rotación: los cursores anteriores dejan de valer
+        self.generation = getattr(self, "generation", -1) + 1
+
+    def version(self):
+        """Versión del archivo (inodo, tamaño, mtime) sin leerlo."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return "0"
+        return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+    def refresh(self):
+        """
+        Indexa lo agregado desde la última llamada.
+        Retorna True si el archivo fue rotado o truncado.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+
+        with self._lock:
+            rotated = False
+            if self.inode is not None and (st.st_ino != self.inode or st.st_size < self.offset):
+                self._reset()
+                rotated = True
+            self.inode = st.st_ino
+            if st.st_size > self.offset:
+                self._read_from(self.offset)
+            return rotated
+
+    def _read_from(self, offset):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        # Una línea a medio escribir se deja para la próxima lectura
+        last = data.rfind(b"\n")
+        if last < 0:
+            return
+
+        pos = offset
+        for line in data[:last].split(b"\n"):
+            pos += len(line) + 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            user = message.get("user", "") if isinstance(message, dict) else ""
+            self.raw.append(line)
+            self.users.append(user)
+            self.ends.append(pos)
+            self.user_counts[user] = self.user_counts.get(user, 0) + 1
+            key = normalize_user(user)
+            positions = self.user_index.get(key)
+            if positions is None:
+                positions = self.user_index[key] = array("q")
+            positions.append(len(self.raw) - 1)
+        self.offset = offset + last + 1
+
+    # --- Lecturas ---
+    def _positions(self, user_filter, start, offset, stop):
+        """
+        Posiciones >= start de los mensajes cuyo usuario contiene
+        user_filter, de la número offset a la stop (sin recorrer las previas
+        a start).
+        """
+        needle = normalize_user(user_filter)
+        lists = [
+            positions for name, positions in self.user_index.items()
+            if needle in name
+        ]
+        if len(lists) == 1:
+            positions = lists[0]
+            lo = bisect_left(positions, start)
+            return positions[lo + offset:None if stop is None else lo + stop]
+        tails = [_iter_from(positions, start) for positions in lists]
+        return list(islice(heapq.merge(*tails), offset, stop))
+
+    def query(self, user_filter=None, since=None, offset=0, limit=None, tail=False):
+        """
+        Arreglo JSON (bytes) de los mensajes que terminan después del offset
+        de bytes `since`, filtrados por usuario (subcadena, sin mayúsculas),
+        salteando `offset` y hasta `limit`. Con tail=True la página se cuenta
+        desde el final (los últimos `limit`). Retorna (json, cursor) donde
+        cursor es el `since` para pedir lo que sigue.
+        """
+        with self._lock:
+            start = bisect_right(self.ends, since) if since else 0
+            stop = None if limit is None else offset + limit
+            if tail:
+                if user_filter:
+                    selected = self._positions(user_filter, start, 0, None)
+                else:
+                    selected = range(start, len(self.raw))
+                hi = len(selected) - offset
+                lo = 0 if limit is None else hi - limit
+                selected = selected[max(0, lo):max(0, hi)]
+            elif user_filter:
+                selected = self._positions(user_filter, start, offset, stop)
+            else:
+                selected = range(len(self.raw))[start + offset:None if stop is None else start + stop]
+            body = b"[" + b", ".join(self.raw[i] for i in selected) + b"]"
+            cursor = self.ends[selected[-1]] if len(selected) else (since or 0)
+            return body, cursor
+
+    def stats(self):
+        with self._lock:
+            return {
+                "total_messages": len(self.raw),
+                "unique_users": len(self.user_counts),
+                "user_counts": dict(self.user_counts),
+            }
+
+    def entries_after(self, offset, end=None):
+        """[(offset_fin, usuario, json)] de las líneas que terminan en (offset, end]."""
+        with self._lock:
+            lo = bisect_right(self.ends, offset)
+            hi = len(self.ends) if end is None else bisect_right(self.ends, end)
+            return [(self.ends[i], self.users[i], self.raw[i]) for i in range(lo, hi)]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(refresh=True):
+    """
+    Store del proceso, al día con su fuente: messages.json (backend "file")
+    o la BD replicada de server_tls (backend "sqlite"). Con refresh=False
+    no se lee nada nuevo (para consultar solo version()).
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.MESSAGES_BACKEND == "sqlite":
+                    from .sqlite_store import SQLiteMessageStore
+                    _store = SQLiteMessageStore(settings.REPLICA_DB)
+                else:
+                    _store = MessageStore(settings.MESSAGES_FILE)
+    if refresh:
+        _store.refresh()
+    return _store
@@ -0,0 +1,122 @@
+"""
+Server-Sent Events sobre messages.json.
+
+Un solo MessageTail por event loop revisa el MessageStore del proceso y
+reparte cada mensaje nuevo a las colas de los suscriptores: con cientos de
+pestañas abiertas el archivo se lee una vez, no una vez por pestaña.
+El id de cada evento es el offset donde termina su línea, así el
+navegador reanuda con Last-Event-ID (o ?since=) sin perder ni repetir.
+"""
+import asyncio
+import weakref
+
+SUBSCRIBER_QUEUE = 1000
+
+
+class MessageTail:
+    def __init__(self, store, poll_interval=0.5):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.offset = store.offset
+        self.generation = store.generation
+        self.subscribers = set()
+        self._task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE)
+        self.subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self.offset = self.store.offset
+            self.generation = self.store.generation
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    async def _run(self):
+        # Termina solo cuando no queda nadie escuchando
+        while self.subscribers:
+            await asyncio.to_thread(self.store.refresh)
+            if self.store.generation != self.generation:
+                # Archivo rotado o truncado: se sigue desde el inicio
+                # y los suscriptores reinician su cursor (mensaje None)
+                self.generation = self.store.generation
+                self.offset = 0
+                self._publish((0, None, None))
+            entries = await asyncio.to_thread(self.store.entries_after, self.offset)
+            if entries:
+                self.offset = entries[-1][0]
+                for entry in entries:
+                    self._publish(entry)
+            await asyncio.sleep(self.poll_interval)
+
+    def _publish(self, entry):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                # Suscriptor lento: se le corta el stream y al reconectar
+                # con Last-Event-ID se pone al día desde el store
+                self.subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+
+_tails = weakref.WeakKeyDictionary()
+
+
+def get_tail(store, poll_interval):
+    """MessageTail del event loop actual (uno por loop)."""
+    loop = asyncio.get_running_loop()
+    tail = _tails.get(loop)
+    if tail is None or tail.store is not store:
+        tail = _tails[loop] = MessageTail(store, poll_interval)
+    return tail
+
+
+def sse_event(offset, raw):
+    return f"id: {offset}\ndata: {raw.decode('utf-8')}\n\n"
+
+
+async def event_stream(store, since, match, poll_interval=0.5, keepalive=15):
+    """
+    Eventos SSE desde el offset `since` (None: solo lo nuevo): primero lo
+    que el store ya tiene y luego lo que publique el MessageTail.
+    `match` recibe el usuario de cada mensaje.
+    """
+    tail = get_tail(store, poll_interval)
+    queue = tail.subscribe()
+    try:
+        yield "retry: 3000\n\n"
+        last = tail.offset if since is None else since
+        if last > store.offset:
+            # Cursor de un archivo anterior (rotado o truncado)
+            last = 0
+
+        # Con since=0 puede ser todo el historial: se lee fuera del event loop
+        backlog = await asyncio.to_thread(store.entries_after, last, tail.offset)
+        for offset, user, raw in backlog:
+            if match(user):
+                yield sse_event(offset, raw)
+            last = offset
+
+        while True:
+            try:
+                entry = await asyncio.wait_for(queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if entry is None:
+                return
+            offset, user, raw = entry
+            if raw is None:
+                last = offset
+                continue
+            if offset <= last:
+                continue
+            last = offset
+            if match(user):
+                yield sse_event(offset, raw)
+    finally:
+        tail.unsubscribe(queue)
@@ -1,3 +1,175 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .sqlite_store import SQLiteMessageStore
+from .store import MessageStore
+from .stream import event_stream
+
+
+def write_messages(path, messages, mode="w"):
+    with open(path, mode) as f:
+        for m in messages:
+            f.write(json.dumps(m) + "\n")
+
+
+def texts(body):
+    return [m["message"] for m in json.loads(body)]
+
+
+class MessageStoreTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        self.path = os.path.join(tmp, "messages.json")
+        write_messages(self.path, [{"user": "ana", "message": "uno"},
+                                   {"user": "bob", "message": "dos"}])
+        self.store = MessageStore(self.path)
+        self.assertFalse(self.store.refresh())
+
+    def test_sigue_lo_agregado(self):
+        body, cursor = self.store.query()
+        self.assertEqual(texts(body), ["uno", "dos"])
+
+        write_messages(self.path, [{"user": "ana", "message": "tres"}], mode="a")
+        self.assertFalse(self.store.refresh())
+        body, _ = self.store.query(since=cursor)
+        self.assertEqual(texts(body), ["tres"])
+        self.assertEqual(self.store.user_counts, {"ana": 2, "bob": 1})
+
+    def test_linea_a_medio_escribir_espera(self):
+        with open(self.path, "a") as f:
+            f.write('{"user": "ana", "mess')
+        self.store.refresh()
+        self.assertEqual(self.store.stats()["total_messages"], 2)
+
+        with open(self.path, "a") as f:
+            f.write('age": "tres"}\n')
+        self.store.refresh()
+        self.assertEqual(texts(self.store.query()[0]), ["uno", "dos", "tres"])
+
+    def test_archivo_reemplazado_reindexa(self):
+        generation = self.store.generation
+        rotated = self.path + ".new"
+        write_messages(rotated, [{"user": "eva", "message": "nuevo"}])
+        os.replace(rotated, self.path)
+
+        self.assertTrue(self.store.refresh())
+        self.assertEqual(self.store.generation, generation + 1)
+        self.assertEqual(texts(self.store.query()[0]), ["nuevo"])
+        self.assertEqual(self.store.user_counts, {"eva": 1})
+        self.assertEqual(texts(self.store.query("ana")[0]), [])
+
+    def test_archivo_truncado_reindexa(self):
+        generation = self.store.generation
+        write_messages(self.path, [{"user": "eva", "message": "x"}])
+
+        self.assertTrue(self.store.refresh())
+        self.assertEqual(self.store.generation, generation + 1)
+        self.assertEqual(texts(self.store.query()[0]), ["x"])
+
+    def test_busqueda_por_usuario(self):
+        write_messages(self.path, [{"user": "Juana", "message": "tres"},
+                                   {"user": "bob", "message": "cuatro"},
+                                   {"user": " ANA ", "message": "cinco"}], mode="a")
+        self.store.refresh()
+
+        # Subcadena sin mayúsculas, mezclando los índices de varios nombres
+        self.assertEqual(texts(self.store.query("an")[0]), ["uno", "tres", "cinco"])
+        self.assertEqual(texts(self.store.query("BOB")[0]), ["dos", "cuatro"])
+        self.assertEqual(texts(self.store.query("nadie")[0]), [])
+
+    def test_paginas_con_cursor(self):
+        write_messages(self.path, [{"user": "ana", "message": str(i)} for i in range(5)], mode="a")
+        self.store.refresh()
+
+        body, cursor = self.store.query(limit=2)
+        self.assertEqual(texts(body), ["uno", "dos"])
+        body, cursor = self.store.query(since=cursor, limit=2)
+        self.assertEqual(texts(body), ["0", "1"])
+        body, _ = self.store.query("ana", since=cursor, offset=1, limit=2)
+        self.assertEqual(texts(body), ["3", "4"])
+
+    def test_tail_devuelve_los_ultimos(self):
+        write_messages(self.path, [{"user": "ana", "message": str(i)} for i in range(5)], mode="a")
+        self.store.refresh()
+
+        body, cursor = self.store.query("an", limit=2, tail=True)
+        self.assertEqual(texts(body), ["3", "4"])
+        self.assertEqual(cursor, self.store.offset)
+        self.assertEqual(texts(self.store.query(since=cursor)[0]), [])
+
+    def test_stream_entrega_historial_y_lo_nuevo(self):
+        async def collect():
+            events = event_stream(self.store, 0, lambda user: True, poll_interval=0.01)
+            received = [await anext(events) for _ in range(3)]
+            write_messages(self.path, [{"user": "ana", "message": "tres"}], mode="a")
+            received.append(await asyncio.wait_for(anext(events), 5))
+            await events.aclose()
+            return received
+
+        events = asyncio.run(collect())
+        self.assertEqual(events[0], "retry: 3000\n\n")
+        self.assertEqual([json.loads(e.split("data: ")[1])["message"] for e in events[1:]],
+                         ["uno", "dos", "tres"])
+
+    def test_estadisticas_por_usuario(self):
+        write_messages(self.path, [{"user": "ana", "message": "tres"}], mode="a")
+        self.store.refresh()
+        self.assertEqual(self.store.stats(), {
+            "total_messages": 3,
+            "unique_users": 2,
+            "user_counts": {"ana": 2, "bob": 1},
+        })
+
+
+class SQLiteMessageStoreTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        self.path = os.path.join(tmp, "messages.db")
+        self.db = sqlite3.connect(self.path)
+        self.addCleanup(self.db.close)
+        self.db.execute("""
+            CREATE TABLE messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT, message TEXT,
+                lamport INTEGER, server_id TEXT, timestamp TEXT, recipient TEXT
+            )
+        """)
+        self.add(("ana", "uno", None), ("bob", "psst", "ana"), ("bob", "dos", None))
+        self.store = SQLiteMessageStore(self.path)
+        self.addCleanup(self.store.conn.close)
+        self.store.refresh()
+
+    def add(self, *rows):
+        self.db.executemany(
+            "INSERT INTO messages (user, message, lamport, server_id, timestamp, recipient)"
+            " VALUES (?, ?, 1, 'A', '', ?)", rows)
+        self.db.commit()
+
+    def test_estadisticas_sin_privados_e_incrementales(self):
+        self.assertEqual(self.store.stats()["user_counts"], {"ana": 1, "bob": 1})
+
+        self.add(("ana", "tres", None), ("eva", "secreto", "bob"))
+        self.store.refresh()
+        self.assertEqual(self.store.stats(), {
+            "total_messages": 3,
+            "unique_users": 2,
+            "user_counts": {"ana": 2, "bob": 1},
+        })
+
+    def test_busqueda_por_usuario_sin_privados(self):
+        self.assertEqual(texts(self.store.query("BO")[0]), ["dos"])
+
+    def test_tail_sin_privados(self):
+        self.add(("ana", "tres", None), ("eva", "secreto", "ana"))
+        self.store.refresh()
+
+        body, cursor = self.store.query(limit=2, tail=True)
+        self.assertEqual(texts(body), ["dos", "tres"])
+        self.assertEqual(texts(self.store.query(since=cursor)[0]), [])
@@ -3,5 +3,6 @@ from . import views
 
 urlpatterns = [
     path('messages', views.get_messages),
+    path('messages/stream', views.stream_messages),
     path('stats', views.get_stats),
 ]
@@ -1,8 +1,62 @@
+import asyncio
 import json
-from django.http import JsonResponse
+from django.http import (
+    HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+)
 from django.conf import settings
 from django.views.decorators.http import require_GET
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.http import parse_etags, quote_etag
+
+from .cache import ResponseCache
+from .store import get_store, normalize_user
+from .stream import event_stream
+
+# Cuerpos ya serializados por filtro, válidos mientras no cambie la versión del store
+response_cache = ResponseCache(settings.RESPONSE_CACHE_SIZE)
+
+
+def not_modified(request, etag):
+    """True si el cliente ya tiene esta versión (If-None-Match)."""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return "*" in etags or etag in etags
+
+
+def cached_response(request, key, build, content_type="application/json"):
+    """
+    Responde 304 si el cliente tiene la versión actual del store; si no,
+    sirve el cuerpo desde la caché o lo arma con build(store) -> (cuerpo,
+    cabeceras). La versión se calcula sin leer ni serializar mensajes.
+    """
+    version = get_store(refresh=False).version()
+    etag = quote_etag(version)
+    if not_modified(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        entry = response_cache.get(key, version)
+        if entry is None:
+            entry = build(get_store())
+            response_cache.put(key, version, entry)
+        body, headers = entry
+        response = HttpResponse(body, content_type=content_type)
+        for name, value in headers.items():
+            response[name] = value
+    response["ETag"] = etag
+    # Revalidar siempre: con el ETag la respuesta repetida es un 304 vacío
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def user_matcher(user_filter):
+    """Filtro por usuario (subcadena, sin mayúsculas) o None si no hay filtro."""
+    if not user_filter:
+        return None
+    user_filter = normalize_user(user_filter)
+    return lambda user: user_filter in normalize_user(user)
+
 
 @csrf_exempt
 @require_GET
@@ -10,30 +64,67 @@ def get_messages(request):
     if not check_token(request):
         return JsonResponse({"error": "Unauthorized"}, status=401)
     
-    user_filter = request.GET.get('user')
-    with open('../messages.json', 'r', encoding='utf-8') as f:
-        messages = [json.loads(line) for line in f if line.strip()]
-
-    if user_filter:
-        user_filter = user_filter.strip().lower()
-        messages = [
-            m for m in messages
-            if user_filter in m.get('user', '').strip().lower()
-        ]
-    return JsonResponse(messages, safe=False)
+    try:
+        since = int(request.GET['since']) if request.GET.get('since') else None
+        offset = max(0, int(request.GET.get('offset') or 0))
+        limit = int(request.GET.get('limit') or settings.MESSAGES_DEFAULT_LIMIT)
+    except ValueError:
+        return JsonResponse({"error": "Invalid since/offset/limit"}, status=400)
+    # Siempre paginado: para seguir, ?since= con el X-Next-Since de la respuesta
+    limit = max(1, min(limit, settings.MESSAGES_MAX_LIMIT))
+
+    user = request.GET.get('user')
+    # ?tail=1: los últimos `limit` mensajes (p. ej. antes de abrir el stream)
+    tail = request.GET.get('tail') in ('1', 'true')
+
+    def build(store):
+        body, cursor = store.query(user, since, offset, limit, tail)
+        # Cursor para la página siguiente (?since=), igual que los ids del stream
+        return body, {"X-Next-Since": str(cursor)}
+
+    return cached_response(request, ("messages", user, since, offset, limit, tail), build)
 
 def check_token(request):
     expected_token = getattr(settings, "API_TOKEN", None)
     provided_token = request.headers.get("Authorization", "")
+    # EventSource no permite cabeceras: se acepta también ?token=
+    if not provided_token and "token" in request.GET:
+        provided_token = f"Token {request.GET['token']}"
     return provided_token == f"Token {expected_token}"
 
 @csrf_exempt
 @require_GET
-def get_stats(request):
-    with open('../messages.json', 'r', encoding='utf-8') as f:
-        messages = [json.loads(line) for line in f if line.strip()]
+async def stream_messages(request):
+    """
+    SSE con los mensajes que se agregan a messages.json. `since` (o la
+    cabecera Last-Event-ID al reconectar) es el offset desde donde seguir:
+    0 repite todo el archivo, sin cursor solo llegan los nuevos.
+    """
+    if not check_token(request):
+        return JsonResponse({"error": "Unauthorized"}, status=401)
 
-    total = len(messages)
-    users = len(set(m['user'] for m in messages))
-    stats = {'total_messages': total, 'unique_users': users}
-    return JsonResponse(stats)
+    cursor = request.headers.get("Last-Event-ID") or request.GET.get("since")
+    try:
+        since = max(0, int(cursor)) if cursor not in (None, "") else None
+    except ValueError:
+        return JsonResponse({"error": "Invalid since"}, status=400)
+
+    match = user_matcher(request.GET.get('user')) or (lambda user: True)
+    store = await asyncio.to_thread(get_store)
+    response = StreamingHttpResponse(
+        event_stream(store, since, match,
+                     poll_interval=settings.SSE_POLL_INTERVAL,
+                     keepalive=settings.SSE_KEEPALIVE),
+        content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+@csrf_exempt
+@require_GET
+def get_stats(request):
+    return cached_response(
+        request, ("stats",),
+        lambda store: (json.dumps(store.stats()).encode("utf-8"), {})
+    )
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+bench_framing.py - Micro-benchmark de la lectura de líneas
+
+Compara el bucle anterior de handle_client (decodificar cada chunk a str,
+concatenar y hacer split("\\n", 1)) con framing.LineReader, alimentando
+ambos con chunks de 4096 bytes como los entrega recv().
+
+Escenarios:
+  small   muchas líneas cortas (tráfico normal de chat en ráfaga)
+  paste   pocas líneas largas (pegar un texto grande)
+
+USO: python bench_framing.py [--mb 8] [--paste-kb 512] [--repeat 3]
+"""
+import argparse
+import time
+
+from framing import LineReader
+
+CHUNK = 4096
+
+
+def old_loop(chunks):
+    buffer = ""
+    count = 0
+    for data in chunks:
+        buffer += data.decode("utf-8", errors="replace")
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            count += 1
+    return count
+
+
+def line_reader(chunks, max_line):
+    reader = LineReader(max_line)
+    count = 0
+    for data in chunks:
+        reader.feed(data)
+        for _ in reader:
+            count += 1
+    return count
+
+
+def make_chunks(payload):
+    return [payload[i:i + CHUNK] for i in range(0, len(payload), CHUNK)]
+
+
+def best_of(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de lectura de líneas")
+    parser.add_argument("--mb", type=float, default=8, help="MB de datos por escenario")
+    parser.add_argument("--paste-kb", type=int, default=512, help="tamaño de cada línea larga")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    total = int(args.mb * 1024 * 1024)
+    small_line = "hola, ¿cómo va todo? mensaje de chat típico\n".encode("utf-8")
+    paste_line = ("x" * (args.paste_kb * 1024 - 1) + "\n").encode("utf-8")
+    scenarios = {
+        "small": small_line * (total // len(small_line)),
+        "paste": paste_line * max(1, total // len(paste_line)),
+    }
+
+    print(f"{'escenario':<10} {'MB':>6} {'líneas':>9} {'anterior (s)':>13} {'LineReader (s)':>15} {'x':>7}")
+    for name, payload in scenarios.items():
+        chunks = make_chunks(payload)
+        t_old, n_old = best_of(lambda: old_loop(chunks), args.repeat)
+        t_new, n_new = best_of(lambda: line_reader(chunks, len(paste_line)), args.repeat)
+        assert n_old == n_new, (n_old, n_new)
+        print(f"{name:<10} {len(payload) / 2**20:>6.1f} {n_new:>9} "
+              f"{t_old:>13.3f} {t_new:>15.3f} {t_old / t_new:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
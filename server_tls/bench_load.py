@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+bench_load.py - Generador de carga y medición de latencia para server_tls
+
+Abre N clientes TLS simulados (asyncio) contra el servidor, cada uno hace
+el handshake de nickname (opcionalmente "/proto bin") y S de ellos envían
+mensajes a un ritmo fijo. Cada mensaje lleva el instante de envío, así
+los receptores miden la latencia de fan-out de punta a punta.
+
+Mide:
+  - tiempo de conexión (TCP + TLS + handshake) p50/p99/p999
+  - latencia de fan-out p50/p99/p999 (en los --measure-clients receptores)
+  - mensajes/s enviados y entregas/s (mensajes recibidos por todos)
+  - RSS del servidor (pico y final, de /proc/<pid>/status)
+
+El servidor puede ser uno ya corriendo (--pid para leer su RSS) o uno que
+lanza el propio benchmark con --spawn config.json (usa el certificado
+autofirmado de la config).
+
+USO:
+  python bench_load.py --spawn config_bench.json --clients 1000 --senders 50 --rate 2
+  python bench_load.py --port 9000 --pid 1234 --clients 200 --output resultados.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import ssl
+import subprocess
+import sys
+import time
+
+import wire
+from framing import LineReader
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TAG = "bench"
+
+
+# --- Utilidades ---
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    n = len(values)
+
+    def pick(p):
+        return values[min(n - 1, int(p * n))]
+
+    return {
+        "count": n,
+        "min": values[0],
+        "p50": pick(0.50),
+        "p99": pick(0.99),
+        "p999": pick(0.999),
+        "max": values[-1],
+        "mean": sum(values) / n,
+    }
+
+
+def read_rss_kb(pid):
+    """VmRSS de un proceso en KiB (None si no existe o no es Linux)."""
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ImportError, ValueError, OSError):
+        return None
+
+
+def wait_port(host, port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+# --- Cliente simulado ---
+class BenchClient:
+    def __init__(self, idx, binary, measure):
+        self.idx = idx
+        self.binary = binary
+        self.measure = measure
+        self.reader = None
+        self.writer = None
+        self.connect_time = None
+        self.received = 0
+        self.latencies = []
+
+    async def connect(self, host, port, context):
+        t0 = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(
+            host, port, ssl=context, server_hostname="localhost"
+        )
+        await self.reader.readline()  # "Ingresa tu nickname:"
+        if self.binary:
+            self.writer.write(f"{wire.PROTO_COMMAND} {wire.BINARY}\n".encode("utf-8"))
+            await self.writer.drain()
+            await self.reader.readline()  # "PROTO bin"
+        self.writer.write(f"{TAG}{self.idx}\n".encode("utf-8"))
+        await self.writer.drain()
+        self.connect_time = time.perf_counter() - t0
+
+    def _record(self, message, now):
+        # message = "bench <idx> <seq> <t_ns>"
+        parts = message.split(" ")
+        if len(parts) == 4 and parts[0] == TAG:
+            self.latencies.append((now - int(parts[3])) / 1e6)
+
+    async def receive(self):
+        lines = LineReader(max_line=1 << 20)
+        frames = wire.FrameReader()
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    return
+                if not self.measure:
+                    # Solo drenar: contar líneas o frames sin decodificar
+                    # (durante el envío solo se difunden mensajes de chat)
+                    if self.binary:
+                        self.received += len(frames.feed(data))
+                    else:
+                        self.received += data.count(b"\n")
+                    continue
+                now = time.perf_counter_ns()
+                if self.binary:
+                    for body in frames.feed(data):
+                        payload = wire.decode_binary(body)
+                        if payload.get("type") == "message":
+                            self.received += 1
+                            self._record(payload.get("message", ""), now)
+                else:
+                    lines.feed(data)
+                    for line in lines:
+                        try:
+                            payload = json.loads(line)
+                        except ValueError:
+                            continue
+                        if payload.get("type") == "message":
+                            self.received += 1
+                            self._record(payload.get("message", ""), now)
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            return
+
+    async def send_loop(self, rate, stop_at, counter):
+        interval = 1.0 / rate
+        seq = 0
+        next_at = time.perf_counter()
+        while time.perf_counter() < stop_at:
+            text = f"{TAG} {self.idx} {seq} {time.perf_counter_ns()}\n"
+            self.writer.write(text.encode("utf-8"))
+            await self.writer.drain()
+            counter[0] += 1
+            seq += 1
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def close(self):
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except Exception:
+                pass
+
+
+# --- Benchmark ---
+async def run(args, server_pid):
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    # Los primeros --senders envían; los --measure-clients siguientes miden
+    clients = [
+        BenchClient(i, args.binary,
+                    measure=args.senders <= i < args.senders + args.measure_clients)
+        for i in range(args.clients)
+    ]
+
+    rss_samples = []
+    stop_sampling = asyncio.Event()
+
+    async def sample_rss():
+        while not stop_sampling.is_set():
+            if server_pid:
+                rss = read_rss_kb(server_pid)
+                if rss is not None:
+                    rss_samples.append(rss)
+            try:
+                await asyncio.wait_for(stop_sampling.wait(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+
+    sampler = asyncio.create_task(sample_rss())
+    rss_start = read_rss_kb(server_pid) if server_pid else None
+
+    # Conexión con concurrencia acotada
+    sem = asyncio.Semaphore(args.connect_concurrency)
+    errors = []
+
+    async def connect(c):
+        async with sem:
+            try:
+                await c.connect(args.host, args.port, context)
+            except Exception as e:
+                errors.append(repr(e)[:120])
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(connect(c) for c in clients))
+    connect_wall = time.perf_counter() - t0
+    connected = [c for c in clients if c.connect_time is not None]
+    print(f"[BENCH] {len(connected)}/{args.clients} conectados en {connect_wall:.2f}s"
+          f" ({len(errors)} errores)")
+
+    receivers = [asyncio.create_task(c.receive()) for c in connected]
+    await asyncio.sleep(args.warmup)
+
+    # Descartar lo recibido durante el calentamiento (anuncios de join)
+    for c in connected:
+        c.received = 0
+        c.latencies = []
+
+    senders = [c for c in connected if c.idx < args.senders]
+    sent = [0]
+    t_start = time.perf_counter()
+    stop_at = t_start + args.duration
+    await asyncio.gather(*(c.send_loop(args.rate, stop_at, sent) for c in senders))
+    send_elapsed = time.perf_counter() - t_start
+
+    # Dar tiempo a que lleguen los últimos mensajes
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - t_start
+
+    stop_sampling.set()
+    await sampler
+    for c in connected:
+        c.close()
+    for t in receivers:
+        t.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+
+    measuring = [c for c in connected if c.measure]
+    latencies = [lat for c in measuring for lat in c.latencies]
+    measured_received = sum(c.received for c in measuring)
+    delivered = sum(c.received for c in connected)
+
+    return {
+        "params": {
+            "host": args.host,
+            "port": args.port,
+            "clients": args.clients,
+            "senders": len(senders),
+            "rate_per_sender": args.rate,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "drain_s": args.drain,
+            "protocol": wire.BINARY if args.binary else wire.JSON,
+            "measure_clients": len(measuring),
+        },
+        "connect": {
+            "connected": len(connected),
+            "errors": len(errors),
+            "error_samples": errors[:5],
+            "wall_s": connect_wall,
+            "time_ms": percentiles([c.connect_time * 1000 for c in connected]),
+        },
+        "throughput": {
+            "sent": sent[0],
+            "sent_per_s": sent[0] / send_elapsed if send_elapsed else 0,
+            "deliveries": int(delivered),
+            "deliveries_per_s": delivered / elapsed if elapsed else 0,
+            "delivery_ratio": (
+                measured_received / (sent[0] * len(measuring)) if sent[0] and measuring else None
+            ),
+        },
+        "latency_ms": percentiles(latencies),
+        "server_rss_kb": {
+            "pid": server_pid,
+            "start": rss_start,
+            "peak": max(rss_samples) if rss_samples else None,
+            "end": rss_samples[-1] if rss_samples else None,
+        },
+    }
+
+
+def print_summary(result):
+    c = result["connect"]
+    t = result["throughput"]
+    lat = result["latency_ms"]
+    rss = result["server_rss_kb"]
+    ct = c["time_ms"]
+    print("[BENCH] ----------------------------------------")
+    print(f"[BENCH] Conexión: {c['connected']} ok, {c['errors']} errores, "
+          f"p50={ct.get('p50', 0):.1f}ms p99={ct.get('p99', 0):.1f}ms p999={ct.get('p999', 0):.1f}ms")
+    print(f"[BENCH] Enviados: {t['sent']} ({t['sent_per_s']:.0f}/s) "
+          f"Entregas: {t['deliveries']} ({t['deliveries_per_s']:.0f}/s)")
+    if t["delivery_ratio"] is not None:
+        print(f"[BENCH] Entregado a los receptores medidos: {t['delivery_ratio'] * 100:.1f}%")
+    if lat["count"]:
+        print(f"[BENCH] Latencia fan-out: p50={lat['p50']:.2f}ms p99={lat['p99']:.2f}ms "
+              f"p999={lat['p999']:.2f}ms max={lat['max']:.2f}ms (n={lat['count']})")
+    if rss["peak"] is not None:
+        print(f"[BENCH] RSS servidor: inicio={rss['start']}KiB pico={rss['peak']}KiB fin={rss['end']}KiB")
+    print("[BENCH] ----------------------------------------")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga del servidor TLS")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--spawn", metavar="CONFIG",
+                        help="lanzar server_tls.py con esta config (host/port de la config)")
+    parser.add_argument("--pid", type=int, help="pid del servidor para medir su RSS")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--senders", type=int, default=10, help="clientes que envían")
+    parser.add_argument("--rate", type=float, default=5, help="mensajes/s por emisor")
+    parser.add_argument("--duration", type=float, default=10, help="segundos enviando")
+    parser.add_argument("--warmup", type=float, default=2, help="segundos tras conectar")
+    parser.add_argument("--drain", type=float, default=2, help="segundos de espera al final")
+    parser.add_argument("--measure-clients", type=int, default=50,
+                        help="receptores que decodifican y miden latencia")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--binary", action="store_true", help="usar /proto bin")
+    parser.add_argument("--output", help="archivo JSON de resultados")
+    args = parser.parse_args()
+    args.senders = min(args.senders, args.clients)
+
+    fd_limit = raise_fd_limit()
+    if fd_limit is not None and fd_limit < args.clients + 100:
+        print(f"[BENCH] ⚠️  Límite de descriptores {fd_limit} < clientes + 100")
+
+    proc = None
+    server_pid = args.pid
+    config_name = None
+    if args.spawn:
+        with open(args.spawn, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+        args.host = cfg.get("host", args.host)
+        args.port = int(cfg.get("port", args.port))
+        config_name = os.path.basename(args.spawn)
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(BASE_DIR, "server_tls.py"), "--config", args.spawn],
+            cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        server_pid = proc.pid
+        if not wait_port(args.host, args.port):
+            proc.terminate()
+            print("[BENCH] ✗ El servidor no arrancó")
+            return 1
+
+    try:
+        result = asyncio.run(run(args, server_pid))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    result["meta"] = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "spawned_config": config_name,
+    }
+    print_summary(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"[BENCH] Resultados en {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
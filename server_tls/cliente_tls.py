@@ -3,16 +3,30 @@ import ssl
 import threading
 import sys
 import os
+import json
+
+import wire
+from framing import LineReader
+from recent import SINCE_COMMAND
 
 HOST = "127.0.0.1"
 PORT = 9000
 
+# "--bin": pedir frames binarios con prefijo de longitud (ver wire.py)
+BINARY = "--bin" in sys.argv
+
+# "--since L:S": al reconectar, reponer solo lo posterior a ese cursor
+# (sin él, el servidor repone sus últimos mensajes)
+SINCE = sys.argv[sys.argv.index("--since") + 1] if "--since" in sys.argv[:-1] else None
+
 def receive_messages(sock):
     """
     Hilo que escucha mensajes del servidor.
     Sale automáticamente cuando la conexión se cierra.
     """
-    buffer = ""
+    lines = LineReader(max_line=1 << 20)
+    frames = None  # FrameReader una vez que el servidor confirma "PROTO bin"
+    ack = wire.proto_ack(wire.BINARY).decode("utf-8").strip()
     try:
         while True:
             data = sock.recv(4096)
@@ -20,13 +34,26 @@ def receive_messages(sock):
                 print("🔌 Servidor cerró la conexión.")
                 break
 
-            text = data.decode("utf-8", errors="replace")
-            buffer += text
+            if frames is not None:
+                for body in frames.feed(data):
+                    print(json.dumps(wire.decode_binary(body), ensure_ascii=False))
+                continue
+
+            lines.feed(data)
 
             # Procesado por líneas (server_tls.py envía JSON + \n)
-            while "\n" in buffer:
-                line, buffer = buffer.split("\n", 1)
+            # readline() y no iteración: tras el ack el resto son frames binarios
+            while True:
+                line = lines.readline()
+                if line is None:
+                    break
                 line = line.strip()
+                if BINARY and line == ack:
+                    # Lo que sigue al ack ya son frames
+                    frames = wire.FrameReader()
+                    for body in frames.feed(lines.detach()):
+                        print(json.dumps(wire.decode_binary(body), ensure_ascii=False))
+                    break
                 if line:
                     print(line)
 
@@ -42,7 +69,9 @@ def receive_messages(sock):
 
 def main():
     print("🔐 Cliente TLS conectado a", HOST, PORT)
-    print("Escribe tu nickname y luego mensajes. Usa /salir para desconectar.\n")
+    print("Escribe tu nickname y luego mensajes. Usa /salir para desconectar.")
+    print("Salas: /join <sala>, /leave [sala], /rooms y /users (usuarios de la sala actual).")
+    print("Privados: /msg <nick> <texto>.\n")
 
     # Contexto TLS (modo desarrollo)
     context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
@@ -59,6 +88,11 @@ def main():
         print("❌ No se pudo conectar al servidor TLS:", e)
         return
 
+    if BINARY:
+        conn.sendall(f"{wire.PROTO_COMMAND} {wire.BINARY}\n".encode("utf-8"))
+    if SINCE:
+        conn.sendall(f"{SINCE_COMMAND} {SINCE}\n".encode("utf-8"))
+
     # Hilo receptor
     recv_thread = threading.Thread(target=receive_messages, args=(conn,), daemon=True)
     recv_thread.start()
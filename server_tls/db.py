@@ -1,84 +1,523 @@
+import hashlib
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from threading import Lock
+from pathlib import Path
 
-# Lock global único para toda la aplicación
-DB_LOCK = Lock()
+import metrics
+from logs import get_logger
 
-def init_db(db_path):
+log = get_logger("db")
+
+# PRAGMAs comunes a todas las conexiones
+MMAP_SIZE = 256 * 1024 * 1024   # bytes mapeados en memoria
+CACHE_KB = 16 * 1024            # caché de páginas por conexión (KiB)
+
+# Sala de los mensajes sin sala (BDs anteriores, peers sin salas)
+DEFAULT_ROOM = "general"
+
+# Columnas de cada fila de mensaje que devuelven las consultas.
+# recipient es el nick destinatario de un mensaje privado (/msg) y NULL en
+# los de sala; los privados se replican entre nodos pero /history no los muestra
+MESSAGE_COLUMNS = "user, message, lamport, server_id, timestamp, room, recipient"
+
+# Ancho (en lamports) de cada bucket de digest para anti-entropía.
+# Es parte del formato en disco: todos los nodos deben usar el mismo.
+DIGEST_BUCKET = 1024
+# Digests de todos los mensajes y solo de los públicos
+BUCKETS_TABLE = "replication_buckets"
+PUBLIC_BUCKETS_TABLE = "replication_buckets_public"
+
+# --- Métricas del escritor ---
+DB_BATCH_SIZE = metrics.histogram(
+    "chat_db_batch_size", "Mensajes por lote del group commit",
+    buckets=metrics.SIZE_BUCKETS + (2500, 5000))
+DB_COMMIT_SECONDS = metrics.histogram(
+    "chat_db_commit_seconds", "Duración de cada lote (INSERTs más COMMIT)")
+DB_INSERT_SECONDS = metrics.histogram(
+    "chat_db_insert_seconds", "Desde que se encola un mensaje hasta que es durable")
+DB_INSERTED = metrics.counter("chat_db_inserted_total", "Mensajes insertados")
+DB_DUPLICATES = metrics.counter("chat_db_duplicates_total", "Mensajes descartados por duplicados")
+DB_ERRORS = metrics.counter("chat_db_errors_total", "Mensajes que no se pudieron insertar")
+
+
+def _apply_pragmas(conn, mmap_size, cache_kb):
+    conn.execute("PRAGMA busy_timeout=30000;")
+    conn.execute(f"PRAGMA mmap_size={int(mmap_size)};")
+    conn.execute(f"PRAGMA cache_size=-{int(cache_kb)};")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+
+
+class Database:
     """
-    Inicializa la BD y retorna una conexión global.
+    Acceso a la BD: una conexión de escritura, usada solo por el
+    MessageWriter, y un pool de conexiones de solo lectura para que
+    /history, /sync y el resto de lecturas no se serialicen entre sí.
     """
-    conn = sqlite3.connect(
-        db_path,
-        check_same_thread=False,
-        timeout=30
-    )
 
-    try:
-        conn.execute("PRAGMA journal_mode=WAL;")
-    except Exception:
-        pass
+    def __init__(self, db_path, batch_size=256, flush_ms=10, readers=4,
+                 mmap_size=MMAP_SIZE, cache_kb=CACHE_KB):
+        self.path = db_path
+
+        # Conexión de escritura: crea el esquema y activa WAL
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL;")
+        except Exception:
+            pass
+        # Con WAL, NORMAL sigue siendo seguro ante caídas del proceso
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        _apply_pragmas(conn, mmap_size, cache_kb)
 
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user TEXT,
+                message TEXT,
+                lamport INTEGER,
+                server_id TEXT,
+                timestamp TEXT,
+                room TEXT NOT NULL DEFAULT 'general',
+                recipient TEXT,
+                UNIQUE(lamport, server_id)
+            )
+        """)
+        _add_columns(conn)
+        # Índice que cubre todas las columnas de /sync y /history: el recorrido
+        # por (lamport, server_id) se resuelve sin tocar la tabla
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_order
+            ON messages(lamport, server_id, user, message, timestamp, room, recipient)
+        """)
+        # Historial de una sala, en orden (lamport, server_id)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_room
+            ON messages(room, lamport, server_id)
+        """)
+        # Recorridos por origen (cursor vectorial de replicación)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_origin
+            ON messages(server_id, lamport)
+        """)
+        # Filtro por usuario de chat_api (backend "sqlite"), paginado por id
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_user
+            ON messages(user, id)
+        """)
+        # Estado de replicación que mantiene el escritor en la misma transacción:
+        # lamport máximo por origen y (count, hash XOR) por bucket de lamports
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS replication_watermarks (
+                origin TEXT PRIMARY KEY,
+                lamport INTEGER NOT NULL
+            )
+        """)
+        # Los buckets se llevan dos veces: con todos los mensajes (para peers
+        # con peer_token) y solo con los públicos, que es lo que /range
+        # entrega a quien no lo tiene
+        for table in (BUCKETS_TABLE, PUBLIC_BUCKETS_TABLE):
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket INTEGER PRIMARY KEY,
+                    count INTEGER NOT NULL,
+                    hash INTEGER NOT NULL
+                )
+            """)
+        _backfill_replication_state(conn)
+        # Búsqueda de texto (/search); False si este SQLite no trae FTS5
+        self.fts = _create_fts(conn)
+        conn.commit()
+        cur.close()
+        self.writer = MessageWriter(conn, batch_size, flush_ms)
+
+        # Pool de lectores (solo lectura, compartibles entre threads de a uno)
+        uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        self._readers = queue.Queue()
+        for _ in range(max(1, int(readers))):
+            rconn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=30)
+            _apply_pragmas(rconn, mmap_size, cache_kb)
+            rconn.execute("PRAGMA query_only=ON;")
+            self._readers.put(rconn)
+
+    @contextmanager
+    def reader(self):
+        """Presta una conexión de lectura del pool."""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+
+def _add_columns(conn):
+    """
+    Migra BDs anteriores a las salas y a los mensajes privados: agrega las
+    columnas (instantáneo; lo existente queda en DEFAULT_ROOM y público) y
+    descarta el índice de orden viejo, que ya no cubría las columnas
+    consultadas, para que se vuelva a crear completo.
+    """
     cur = conn.cursor()
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(messages)")]
+    if "room" not in columns:
+        cur.execute(f"ALTER TABLE messages ADD COLUMN room TEXT NOT NULL DEFAULT '{DEFAULT_ROOM}'")
+    if "recipient" not in columns:
+        cur.execute("ALTER TABLE messages ADD COLUMN recipient TEXT")
+    indexed = [row[2] for row in cur.execute("PRAGMA index_info(idx_messages_order)")]
+    if indexed and ("room" not in indexed or "recipient" not in indexed):
+        cur.execute("DROP INDEX idx_messages_order")
+    cur.close()
+
+
+def _row_hash(lamport, server_id):
+    """Hash de 63 bits de la identidad de un mensaje (cabe en un INTEGER)."""
+    digest = hashlib.blake2b(f"{lamport}:{server_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") >> 1
+
+
+def _add_to_buckets(cur, table, keys):
+    """Suma pares (lamport, server_id) a los digests de `table`."""
+    buckets = {}
+    for lamport, server_id in keys:
+        bucket = lamport // DIGEST_BUCKET
+        count, h = buckets.get(bucket, (0, 0))
+        buckets[bucket] = (count + 1, h ^ _row_hash(lamport, server_id))
+    # SQLite no tiene operador XOR: a ^ b = (a | b) - (a & b)
+    cur.executemany(f"""
+        INSERT INTO {table} (bucket, count, hash) VALUES (?, ?, ?)
+        ON CONFLICT(bucket) DO UPDATE SET
+            count = count + excluded.count,
+            hash = (hash | excluded.hash) - (hash & excluded.hash)
+    """, [(b, c, h) for b, (c, h) in buckets.items()])
+
+
+def _update_replication_state(cur, rows):
+    """
+    Suma al estado de replicación los mensajes recién insertados, dados
+    como (lamport, server_id, recipient). XOR y conteo son incrementales,
+    así que el digest de un bucket nunca se recalcula desde la tabla.
+    """
+    watermarks = {}
+    for lamport, server_id, _ in rows:
+        watermarks[server_id] = max(watermarks.get(server_id, 0), lamport)
+
+    cur.executemany("""
+        INSERT INTO replication_watermarks (origin, lamport) VALUES (?, ?)
+        ON CONFLICT(origin) DO UPDATE SET lamport = MAX(lamport, excluded.lamport)
+    """, watermarks.items())
+    _add_to_buckets(cur, BUCKETS_TABLE, [(l, s) for l, s, _ in rows])
+    _add_to_buckets(cur, PUBLIC_BUCKETS_TABLE, [(l, s) for l, s, r in rows if r is None])
+
+
+def _backfill_replication_state(conn):
+    """
+    Calcula watermarks y buckets una única vez para BDs anteriores; en las
+    que ya tenían buckets, solo los de mensajes públicos (tabla posterior).
+    """
+    cur = conn.cursor()
+    if not cur.execute(f"SELECT 1 FROM {BUCKETS_TABLE} LIMIT 1").fetchone():
+        select = "SELECT lamport, server_id, recipient FROM messages"
+        update = _update_replication_state
+    elif not cur.execute(f"SELECT 1 FROM {PUBLIC_BUCKETS_TABLE} LIMIT 1").fetchone():
+        select = "SELECT lamport, server_id FROM messages WHERE recipient IS NULL"
+        update = lambda c, keys: _add_to_buckets(c, PUBLIC_BUCKETS_TABLE, keys)
+    else:
+        cur.close()
+        return
+    read = conn.cursor()
+    read.execute(select)
+    while True:
+        keys = read.fetchmany(10000)
+        if not keys:
+            break
+        update(cur, keys)
+    read.close()
+    cur.close()
+
+
+def _create_fts(conn):
+    """
+    Índice FTS5 de messages.message como tabla de contenido externo (no
+    duplica el texto), al día por triggers. Si el índice es nuevo se llena
+    con 'rebuild' desde las filas existentes.
+    """
+    cur = conn.cursor()
+    existed = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+    ).fetchone()
+    try:
+        cur.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                message,
+                content='messages',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        log.warning("⚠️  FTS5 no disponible, /search desactivado: %s", e)
+        cur.close()
+        return False
+
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, message)
+            VALUES ('delete', old.id, old.message);
+        END
+    """)
     cur.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user TEXT,
-            message TEXT,
-            lamport INTEGER,
-            server_id TEXT,
-            timestamp TEXT,
-            UNIQUE(lamport, server_id)
-        )
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, message)
+            VALUES ('delete', old.id, old.message);
+            INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+        END
     """)
-    conn.commit()
+    if not existed:
+        cur.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
     cur.close()
-    return conn
+    return True
 
 
-def insert_message(conn, user, message, lamport, server_id, ts=None):
-    """Inserta un mensaje si no existe ya."""
-    if ts is None:
-        ts = datetime.now(timezone.utc).isoformat()
+def init_db(db_path, batch_size=256, flush_ms=10, readers=4,
+            mmap_size=MMAP_SIZE, cache_kb=CACHE_KB):
+    """
+    Inicializa la BD y retorna el objeto Database que reciben las demás
+    funciones de este módulo (escritor con group commit + pool de lectores).
+    """
+    return Database(db_path, batch_size, flush_ms, readers, mmap_size, cache_kb)
+
 
-    with DB_LOCK:
+_INSERT = """
+    INSERT OR IGNORE INTO messages
+        (user, message, lamport, server_id, timestamp, room, recipient)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class MessageWriter:
+    """
+    Escritor único con group commit: los mensajes se encolan y un thread
+    los persiste en una sola transacción (un solo fsync) cada `batch_size`
+    mensajes o cuando pasan `flush_ms` ms desde el primero del lote.
+    Cada mensaje encolado tiene un Future que se resuelve con True si se
+    insertó, False si era duplicado o con la excepción si no se pudo
+    insertar. Un Future cancelado (un await cancelado del lado asyncio) no
+    recibe resultado, pero su fila se escribe igual.
+    """
+
+    def __init__(self, conn, batch_size=256, flush_ms=10):
+        self.conn = conn
+        self.batch_size = max(1, int(batch_size))
+        self.flush_s = max(0.0, float(flush_ms) / 1000.0)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="db-writer")
+        self.thread.start()
+
+    def submit(self, row):
+        fut = Future()
+        self.queue.put((row, fut, time.monotonic()))
+        return fut
+
+    def barrier(self):
+        """Future que se resuelve cuando todo lo encolado antes ya es durable."""
+        return self.submit(None)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_s
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self.queue.get(timeout=remaining))
+                    else:
+                        batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Los Futures cancelados se descartan acá: nadie espera su resultado
+            batch = [(row, fut if fut.set_running_or_notify_cancel() else None, queued)
+                     for row, fut, queued in batch]
+            try:
+                self._flush(batch)
+            except Exception as e:
+                # El thread no puede morir: lo que quedó sin resolver falla y se sigue
+                log.exception("El escritor falló con un lote")
+                for _, fut, _ in batch:
+                    if fut is not None and not fut.done():
+                        fut.set_exception(e)
+
+    def _insert_each(self, cur, rows):
+        """
+        Reintento de un lote que falló: cada fila en su propio SAVEPOINT
+        dentro de una única transacción, así una fila inválida no arrastra
+        a las demás. Retorna True/False o la excepción de cada fila.
+        """
+        results = []
+        self.conn.execute("BEGIN")
+        for row, _ in rows:
+            cur.execute("SAVEPOINT fila")
+            try:
+                cur.execute(_INSERT, row)
+                results.append(cur.rowcount > 0)
+            except Exception as e:
+                cur.execute("ROLLBACK TO fila")
+                results.append(e)
+            cur.execute("RELEASE fila")
+        return results
+
+    def _flush(self, batch):
+        rows = [(row, fut) for row, fut, _ in batch if row is not None]
+        started = time.monotonic()
+        cur = self.conn.cursor()
         try:
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT OR IGNORE INTO messages (user, message, lamport, server_id, timestamp)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user, message, lamport, server_id, ts))
-            conn.commit()
-            # Retorna True si insertó, False si era duplicado
-            return cur.rowcount > 0
+            try:
+                # Un INSERT por fila para conocer cuáles eran duplicadas,
+                # pero un único COMMIT para todo el lote
+                results = []
+                for row, _ in rows:
+                    cur.execute(_INSERT, row)
+                    results.append(cur.rowcount > 0)
+            except Exception as e:
+                log.warning("Lote con filas inválidas, reintentando fila por fila: %s", e,
+                            extra={"batch": len(rows)})
+                self.conn.rollback()
+                results = self._insert_each(cur, rows)
+            inserted = [(row[2], row[3], row[6]) for (row, _), ok in zip(rows, results) if ok is True]
+            failed = sum(isinstance(ok, Exception) for ok in results)
+            _update_replication_state(cur, inserted)
+            self.conn.commit()
+            DB_INSERTED.inc(len(inserted))
+            DB_DUPLICATES.inc(len(rows) - len(inserted) - failed)
+            DB_ERRORS.inc(failed)
         except Exception as e:
-            print("[DB ERROR insert_message]:", e)
-            return False
-        finally:
+            log.error("insert_message falló, lote revertido: %s", e, extra={"batch": len(rows)})
+            DB_ERRORS.inc(len(rows))
             try:
-                cur.close()
-            except:
+                self.conn.rollback()
+            except Exception:
                 pass
+            results = [e] * len(rows)
+        finally:
+            cur.close()
+
+        done = time.monotonic()
+        if rows:
+            DB_BATCH_SIZE.observe(len(rows))
+            DB_COMMIT_SECONDS.observe(done - started)
+        for row, fut, queued in batch:
+            if row is not None:
+                DB_INSERT_SECONDS.observe(done - queued)
+
+        for (_, fut), result in zip(rows, results):
+            if fut is None:
+                continue
+            if isinstance(result, Exception):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+        for row, fut, _ in batch:
+            if row is None and fut is not None:
+                fut.set_result(True)
+
+
+def submit_message(db, user, message, lamport, server_id, ts=None, room=DEFAULT_ROOM,
+                   recipient=None):
+    """
+    Encola un mensaje para el escritor y retorna un Future[bool] sin esperar.
+    Quien necesite durabilidad puede hacer fut.result() o, desde asyncio,
+    await asyncio.wrap_future(fut); si la fila no se pudo insertar, eso
+    lanza la excepción. Con `recipient` es un mensaje privado
+    y no pertenece a ninguna sala.
+    """
+    if ts is None:
+        ts = datetime.now(timezone.utc).isoformat()
+    room = "" if recipient else (room or DEFAULT_ROOM)
+    return db.writer.submit((user, message, lamport, server_id, ts, room, recipient or None))
 
 
-def get_full_history(conn):
-    """Obtiene todos los mensajes ordenados globalmente."""
-    with DB_LOCK:
+def insert_message(db, user, message, lamport, server_id, ts=None, room=DEFAULT_ROOM,
+                   recipient=None):
+    """Inserta un mensaje si no existe ya y espera a que sea durable."""
+    # Retorna True si insertó, False si era duplicado (lanza si falló)
+    return submit_message(db, user, message, lamport, server_id, ts, room, recipient).result()
+
+
+def flush(db, timeout=None):
+    """Espera a que todos los mensajes encolados hasta ahora estén en disco."""
+    return db.writer.barrier().result(timeout)
+
+
+def _room_filter(room, params, private=True):
+    """
+    Condición extra para filtrar por sala (ninguna si room es None) y, con
+    private=False, para excluir los mensajes privados.
+    """
+    where = "" if private else "AND recipient IS NULL"
+    if room is None:
+        return where
+    params.append(room)
+    return where + " AND room = ?"
+
+
+def get_full_history(db, limit=None, room=None, private=True):
+    """
+    Obtiene todos los mensajes (o los primeros `limit`) ordenados
+    globalmente; con `room`, solo los de esa sala; con private=False,
+    sin los mensajes privados.
+    """
+    params = []
+    where = _room_filter(room, params, private)
+    params.append(-1 if limit is None else int(limit))
+    with db.reader() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT user, message, lamport, server_id, timestamp
+        cur.execute(f"""
+            SELECT {MESSAGE_COLUMNS}
             FROM messages
+            WHERE 1 {where}
             ORDER BY lamport ASC, server_id ASC
-        """)
+            LIMIT ?
+        """, params)
         rows = cur.fetchall()
         cur.close()
         return rows
 
 
-def get_max_lamport(conn):
+def get_recent_messages(db, limit, room=None):
+    """
+    Los últimos `limit` mensajes públicos (de `room` si se indica), en
+    orden ascendente.
+    """
+    params = []
+    where = _room_filter(room, params, private=False)
+    params.append(int(limit))
+    with db.reader() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE 1 {where}
+            ORDER BY lamport DESC, server_id DESC
+            LIMIT ?
+        """, params)
+        rows = cur.fetchall()
+        cur.close()
+        rows.reverse()
+        return rows
+
+
+def get_max_lamport(db):
     """Retorna lamport máximo existente en la BD."""
-    with DB_LOCK:
+    with db.reader() as conn:
         cur = conn.cursor()
         cur.execute("SELECT COALESCE(MAX(lamport), 0) FROM messages")
         val = cur.fetchone()[0]
@@ -86,12 +525,12 @@ def get_max_lamport(conn):
         return val
 
 
-def get_last_message_position(conn):
+def get_last_message_position(db):
     """
     Retorna (lamport, server_id) del último mensaje en la BD.
     Útil para saber desde dónde sincronizar.
     """
-    with DB_LOCK:
+    with db.reader() as conn:
         cur = conn.cursor()
         cur.execute("""
             SELECT lamport, server_id
@@ -106,19 +545,256 @@ def get_last_message_position(conn):
         return (0, "")
 
 
-def get_messages_after(conn, lamport_value, server_id_value):
+def get_max_message_id(db):
+    """Id de la última fila insertada (0 con la BD vacía)."""
+    with db.reader() as conn:
+        (max_id,) = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()
+        return max_id
+
+
+def get_private_messages_after_id(db, last_id, max_id, limit=500):
+    """
+    Mensajes privados con last_id < id <= max_id en orden de inserción,
+    como (id, columnas de MESSAGE_COLUMNS). Sirve para seguir lo que otro
+    proceso guarda en la misma BD: un solo escritor a la vez, así que los
+    ids se vuelven visibles en orden.
+    """
+    with db.reader() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT id, {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE id > ? AND id <= ? AND recipient IS NOT NULL
+            ORDER BY id
+            LIMIT ?
+        """, (last_id, max_id, int(limit)))
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+
+def get_messages_after(db, lamport_value, server_id_value, limit=None, room=None,
+                       private=True):
     """
     Obtiene mensajes posteriores a una posición (lamport, server_id).
+    Paginación por keyset: la comparación de row values es un rango
+    sobre idx_messages_order (o idx_messages_room con `room`).
+    limit=None devuelve todo lo posterior.
     """
-    with DB_LOCK:
+    params = [lamport_value, server_id_value]
+    where = _room_filter(room, params, private)
+    params.append(-1 if limit is None else int(limit))
+    with db.reader() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT user, message, lamport, server_id, timestamp
+        cur.execute(f"""
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE (lamport, server_id) > (?, ?) {where}
+            ORDER BY lamport ASC, server_id ASC
+            LIMIT ?
+        """, params)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+
+def iter_messages_after(db, lamport_value, server_id_value, chunk_size=500, room=None,
+                        private=True):
+    """
+    Generador de mensajes posteriores a (lamport, server_id) en memoria
+    constante: lee por páginas de keyset y devuelve la conexión al pool
+    entre página y página, así un consumidor lento no retiene un lector.
+    """
+    while True:
+        rows = get_messages_after(db, lamport_value, server_id_value, chunk_size, room, private)
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        lamport_value, server_id_value = rows[-1][2], rows[-1][3]
+
+
+def get_origin_messages_after(db, origin, lamport_value, limit, private=True):
+    """
+    Mensajes de un solo origen con lamport > lamport_value, en orden
+    (rango sobre idx_messages_origin: dentro de un origen el lamport es único).
+    """
+    params = [origin, lamport_value]
+    where = _room_filter(None, params, private)
+    params.append(int(limit))
+    with db.reader() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE server_id = ? AND lamport > ? {where}
+            ORDER BY lamport ASC
+            LIMIT ?
+        """, params)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+
+def get_origin_positions(db):
+    """
+    Cursor vectorial: {server_id: lamport máximo} por cada origen en la BD,
+    leído de replication_watermarks (una fila por origen).
+    Los mensajes de un mismo origen llevan lamports crecientes, así que esto
+    indica qué se tiene ya de cada nodo, sin importar de quién se recibió.
+    Los huecos por debajo del watermark los repara la anti-entropía.
+    """
+    with db.reader() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT origin, lamport FROM replication_watermarks")
+        rows = cur.fetchall()
+        cur.close()
+        return {server_id: lamport for server_id, lamport in rows}
+
+
+def get_messages_after_vector(db, vector, limit, room=None, private=True):
+    """
+    Mensajes de cada origen posteriores a vector[origen] (0 si no figura),
+    en orden (lamport, server_id). Devuelve hasta limit + 1 filas para que
+    el llamador sepa si hay más; cada origen llega como prefijo ordenado.
+    Con `room`, solo los de esa sala.
+    Los orígenes salen de replication_watermarks (una fila por origen) y se
+    consultan solo los que tienen algo posterior al vector, cada uno por
+    idx_messages_origin.
+    """
+    with db.reader() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT origin, lamport FROM replication_watermarks")
+        origins = [origin for origin, lamport in cur.fetchall() if lamport > vector.get(origin, 0)]
+        rows = []
+        for origin in origins:
+            params = [origin, vector.get(origin, 0)]
+            where = _room_filter(room, params, private)
+            params.append(limit + 1)
+            cur.execute(f"""
+                SELECT {MESSAGE_COLUMNS}
+                FROM messages
+                WHERE server_id = ? AND lamport > ? {where}
+                ORDER BY lamport ASC
+                LIMIT ?
+            """, params)
+            rows.extend(cur.fetchall())
+        cur.close()
+    rows.sort(key=lambda r: (r[2], r[3]))
+    return rows[:limit + 1]
+
+
+def iter_messages_after_vector(db, vector, chunk_size=500, room=None, private=True):
+    """Como iter_messages_after pero con cursor vectorial por origen."""
+    vector = dict(vector)
+    while True:
+        rows = get_messages_after_vector(db, vector, chunk_size, room, private)
+        for row in rows[:chunk_size]:
+            vector[row[3]] = max(vector.get(row[3], 0), row[2])
+            yield row
+        if len(rows) <= chunk_size:
+            return
+
+
+def get_bucket_digests(db, group=1, lo_bucket=None, hi_bucket=None, private=True):
+    """
+    Digests para anti-entropía: {clave: (count, hash)} donde clave es
+    bucket // group (group=1: buckets individuales). lo_bucket/hi_bucket
+    acotan el rango de buckets [lo, hi). Con private=False solo cuentan
+    los mensajes públicos, igual que get_messages_in_range.
+    """
+    table = BUCKETS_TABLE if private else PUBLIC_BUCKETS_TABLE
+    with db.reader() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT bucket, count, hash FROM {table}
+            WHERE bucket >= ? AND bucket < ?
+        """, (lo_bucket if lo_bucket is not None else -1,
+              hi_bucket if hi_bucket is not None else 2 ** 62))
+        rows = cur.fetchall()
+        cur.close()
+    result = {}
+    for bucket, count, h in rows:
+        key = bucket // group
+        c, acc = result.get(key, (0, 0))
+        result[key] = (c + count, acc ^ h)
+    return result
+
+
+def get_messages_in_range(db, lo_lamport, hi_lamport, private=True):
+    """Mensajes con lo_lamport <= lamport < hi_lamport (un bucket de digest)."""
+    params = [lo_lamport, hi_lamport]
+    where = _room_filter(None, params, private)
+    with db.reader() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {MESSAGE_COLUMNS}
             FROM messages
-            WHERE lamport > ?
-               OR (lamport = ? AND server_id > ?)
+            WHERE lamport >= ? AND lamport < ? {where}
             ORDER BY lamport ASC, server_id ASC
-        """, (lamport_value, lamport_value, server_id_value))
+        """, params)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+
+def fts_query(text):
+    """
+    Texto libre -> expresión FTS5: cada palabra como frase entre comillas
+    (sin operadores ni errores de sintaxis), todas requeridas; "hol*"
+    busca por prefijo. None si no queda ninguna palabra.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms) or None
+
+
+def search_messages(db, query, limit=20, offset=0, window=2000, bounds=None):
+    """
+    Mensajes públicos que coinciden con `query` (expresión de fts_query),
+    ordenados por relevancia (bm25). Retorna (filas, (min_id, max_id));
+    cada fila es (user, message, lamport, server_id, timestamp, room,
+    recipient, score), score más bajo = más relevante.
+
+    bm25 puntúa cada coincidencia: con términos muy comunes serían millones.
+    Con `window` solo se ordenan las `window` coincidencias públicas más
+    recientes (FTS5 recorre su lista por rowid descendente y corta ahí);
+    los términos poco frecuentes se ordenan siempre sobre todo el historial.
+
+    La ventana queda fijada por (min_id, max_id): pasando esos `bounds` en
+    las páginas siguientes, los mensajes nuevos no corren el `offset`.
+    """
+    with db.reader() as conn:
+        cur = conn.cursor()
+        if bounds is None:
+            max_id = cur.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+            min_id = 0
+            if window:
+                row = cur.execute("""
+                    SELECT f.rowid FROM messages_fts AS f
+                    JOIN messages AS m ON m.id = f.rowid
+                    WHERE messages_fts MATCH ? AND f.rowid <= ? AND m.recipient IS NULL
+                    ORDER BY f.rowid DESC
+                    LIMIT 1 OFFSET ?
+                """, (query, max_id, int(window) - 1)).fetchone()
+                if row:
+                    min_id = row[0]
+        else:
+            min_id, max_id = bounds
+        cur.execute("""
+            SELECT m.user, m.message, m.lamport, m.server_id, m.timestamp, m.room,
+                   m.recipient, bm25(messages_fts) AS score
+            FROM messages_fts AS f
+            JOIN messages AS m ON m.id = f.rowid
+            WHERE messages_fts MATCH ? AND f.rowid BETWEEN ? AND ?
+              AND m.recipient IS NULL
+            ORDER BY score
+            LIMIT ? OFFSET ?
+        """, (query, min_id, max_id, limit, offset))
         rows = cur.fetchall()
         cur.close()
-        return rows
\ No newline at end of file
+        return rows, (min_id, max_id)
@@ -3,78 +3,100 @@
 distributed_api.py - API REST para replicación distribuida (CORREGIDO)
 """
 
+import asyncio
+import hmac
 import json
-import os
-import sys
+import time
 from datetime import datetime, timezone
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import uvicorn
-from threading import Lock
-import traceback
+from typing import Optional
 
-# Importar DB_LOCK del módulo db (lock compartido)
+import metrics
+from logs import get_logger
+from peers import PEER_TOKEN_HEADER
 from db import (
-    init_db, insert_message, get_messages_after, 
-    get_full_history, get_max_lamport, get_last_message_position,
-    DB_LOCK  # ✅ Usar el mismo lock compartido
+    submit_message, get_messages_after, get_full_history, flush,
+    iter_messages_after, get_messages_after_vector, iter_messages_after_vector,
+    get_origin_messages_after,
+    get_bucket_digests, get_messages_in_range, DIGEST_BUCKET,
+    fts_query, search_messages, get_origin_positions, DEFAULT_ROOM
+)
+from node_state import (
+    config, db_conn, db_path, clock, notify_message
 )
 
-# ------------------------------------------------
-# CARGA CONFIG
-# ------------------------------------------------
-def load_config():
-    if len(sys.argv) < 2:
-        print("USO: python distributed_api.py config.json")
-        sys.exit(1)
-
-    config_path = sys.argv[1]
-    if not os.path.exists(config_path):
-        print(f"No existe config: {config_path}")
-        sys.exit(1)
+SERVER_ID = config.get("server_id", "A")
+REST_HOST = config.get("rest_host", "0.0.0.0")
+REST_PORT = int(config.get("rest_port", 5000))
+DEBUG = config.get("debug", False)  # logs de uvicorn y access log
+log = get_logger("api")
 
-    with open(config_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+# Tamaño de página por defecto de /sync y máximo aceptado en /sync y /history
+SYNC_PAGE_SIZE = int(config.get("sync_page_size", 1000))
+MAX_PAGE_SIZE = int(config.get("max_page_size", 10000))
 
-config = load_config()
+# /search: tamaño de página por defecto y cuántas coincidencias recientes
+# se ordenan por relevancia como máximo (0 = todas)
+SEARCH_PAGE_SIZE = int(config.get("search_page_size", 20))
+SEARCH_WINDOW = int(config.get("search_window", 2000))
 
-BASE_DIR = os.path.dirname(__file__)
-db_path = os.path.join(BASE_DIR, config.get("db_file", "messages.db"))
-db_conn = init_db(db_path)
+# Canal de replicación /replicate: cada cuánto se buscan filas nuevas,
+# tamaño de lote y cada cuánto se manda un keepalive si no hay novedades
+REPLICATION_POLL = float(config.get("replication_poll_ms", 100)) / 1000.0
+REPLICATION_BATCH = int(config.get("replication_batch", 500))
+REPLICATION_KEEPALIVE = float(config.get("replication_keepalive", 5))
 
-SERVER_ID = config.get("server_id", "A")
-REST_HOST = config.get("rest_host", "0.0.0.0")
-REST_PORT = int(config.get("rest_port", 5000))
-DEBUG = config.get("debug", False)
+# Secreto compartido del clúster: /sync, /replicate y /range solo devuelven
+# mensajes privados a quien lo presente (sin token nadie los recibe y los
+# privados viajan solo por push)
+PEER_TOKEN = config.get("peer_token") or ""
 
 # ------------------------------------------------
 # ESTADO LOCAL
 # ------------------------------------------------
 app = FastAPI()
 
-lamport_lock = Lock()
+PUSH_RECEIVED = metrics.counter(
+    "chat_api_push_received_total", "Mensajes recibidos por /push y /push_batch")
+PUSH_STORED = metrics.counter(
+    "chat_api_push_stored_total", "Mensajes de /push y /push_batch que eran nuevos")
 
-# ✅ Inicializar lamport con el máximo de la BD
-lamport = get_max_lamport(db_conn)
-if DEBUG:
-    print(f"[REST] Lamport inicial: {lamport}")
+log.debug("Lamport inicial: %d", clock.value)
 
 # ------------------------------------------------
-# FUNCIONES LAMPORT
+# FUNCIONES LAMPORT (reloj compartido vía node_state)
 # ------------------------------------------------
 def update_lamport(received_lamport: int):
     """Ajusta lamport = max(local, remoto) + 1."""
-    global lamport
-    with lamport_lock:
-        lamport = max(lamport, int(received_lamport)) + 1
-        return lamport
+    return clock.update(received_lamport)
 
 def increment_lamport():
     """Incrementa y retorna lamport local."""
-    global lamport
-    with lamport_lock:
-        lamport += 1
-        return lamport
+    return clock.tick()
+
+
+def message_payload(user, message, lamport, server_id, ts, room=DEFAULT_ROOM, recipient=None):
+    if recipient:
+        return {
+            "type": "private",
+            "user": user,
+            "to": recipient,
+            "message": message,
+            "lamport": lamport,
+            "server_id": server_id,
+            "timestamp": ts
+        }
+    return {
+        "type": "message",
+        "user": user,
+        "message": message,
+        "lamport": lamport,
+        "server_id": server_id,
+        "timestamp": ts,
+        "room": room
+    }
 
 # ------------------------------------------------
 # ENDPOINTS
@@ -83,85 +105,348 @@ def increment_lamport():
 @app.on_event("startup")
 async def startup_event():
     """Se ejecuta cuando el servidor arranca."""
-    print(f"[REST] ✓ API lista. Esperando conexiones...")
+    log.info("✓ API lista. Esperando conexiones...")
 
 
 @app.get("/heartbeat")
 def heartbeat():
-    """Health check."""
-    return {"status": "alive", "server_id": SERVER_ID}
+    """
+    Health check. Incluye el watermark de nuestro propio origen para que el
+    peer calcule cuánto le falta replicar.
+    """
+    return {
+        "status": "alive",
+        "server_id": SERVER_ID,
+        "lamport": clock.value,
+        "origin_lamport": get_origin_positions(db_conn).get(SERVER_ID, 0)
+    }
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Métricas del proceso en formato de texto de Prometheus."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def from_peer(request: Request):
+    """True si la petición trae el peer_token del clúster."""
+    token = request.headers.get(PEER_TOKEN_HEADER, "")
+    return bool(PEER_TOKEN) and hmac.compare_digest(token.encode(), PEER_TOKEN.encode())
+
+
+def row_to_dict(m):
+    item = {
+        "user": m[0],
+        "message": m[1],
+        "lamport": m[2],
+        "server_id": m[3],
+        "timestamp": m[4],
+        "room": m[5]
+    }
+    if m[6]:
+        # Privado: solo viaja entre nodos autenticados (/sync, /replicate, /range)
+        item["to"] = m[6]
+    return item
+
+
+def parse_cursor(cursor):
+    """Cursor opaco "lamport:server_id" -> (lamport, server_id)."""
+    lamport_str, _, server = cursor.partition(":")
+    return int(lamport_str), server
+
+
+def parse_vector(vector):
+    """Cursor vectorial "A:12,B:7" -> {"A": 12, "B": 7}."""
+    result = {}
+    for part in vector.split(","):
+        if not part:
+            continue
+        origin, _, lamport_str = part.rpartition(":")
+        result[origin] = int(lamport_str)
+    return result
+
+
+def make_cursor(m):
+    return f"{m[2]}:{m[3]}"
+
+
+def clamp_limit(limit):
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+NDJSON = "application/x-ndjson"
+
+
+def wants_stream(request: Request, stream: bool):
+    return stream or NDJSON in request.headers.get("accept", "")
+
+
+def ndjson_response(since_lamport, since_server, limit=None, vector=None, room=None,
+                    private=True):
+    """
+    Respuesta NDJSON (un mensaje por línea) generada fila a fila desde la BD,
+    sin materializar el historial en memoria.
+    """
+    def generate():
+        if vector is not None:
+            rows = iter_messages_after_vector(db_conn, vector, room=room, private=private)
+        else:
+            rows = iter_messages_after(db_conn, since_lamport, since_server, room=room,
+                                       private=private)
+        for i, m in enumerate(rows):
+            if limit is not None and i >= limit:
+                break
+            yield json.dumps(row_to_dict(m)) + "\n"
+
+    return StreamingResponse(generate(), media_type=NDJSON)
 
 
 @app.get("/history")
-def history():
-    """Devuelve el historial completo."""
-    # DB_LOCK ya está dentro de get_full_history
-    msgs = get_full_history(db_conn)
-
-    return {"messages": [
-        {
-            "user": m[0],
-            "message": m[1],
-            "lamport": m[2],
-            "server_id": m[3],
-            "timestamp": m[4]
-        }
-        for m in msgs
-    ]}
+def history(request: Request, limit: Optional[int] = None, cursor: Optional[str] = None,
+            stream: bool = False, room: Optional[str] = None):
+    """
+    Devuelve el historial ordenado por (lamport, server_id).
+    Sin `limit` devuelve todo. Con `limit` pagina por keyset: la respuesta
+    trae `next_cursor` para pedir la página siguiente (null al final).
+    Con `room` solo los mensajes de esa sala. Los mensajes privados
+    (/msg) nunca aparecen acá.
+    Con ?stream=1 o Accept: application/x-ndjson responde en NDJSON.
+    """
+    try:
+        since = parse_cursor(cursor) if cursor else None
+    except ValueError:
+        return JSONResponse({"error": "cursor inválido"}, status_code=400)
+
+    if wants_stream(request, stream):
+        lamport_value, server_value = since or (0, "")
+        return ndjson_response(lamport_value, server_value, limit, room=room, private=False)
+
+    page = clamp_limit(limit) if limit is not None else None
+    fetch = page + 1 if page is not None else None
+    if since:
+        msgs = get_messages_after(db_conn, since[0], since[1], fetch, room, private=False)
+    else:
+        msgs = get_full_history(db_conn, fetch, room, private=False)
+
+    next_cursor = None
+    if page is not None and len(msgs) > page:
+        msgs = msgs[:page]
+        next_cursor = make_cursor(msgs[-1])
+
+    return {"messages": [row_to_dict(m) for m in msgs], "next_cursor": next_cursor}
 
 
 @app.get("/sync")
-def sync(since_lamport: int = 0, since_server: str = ""):
+def sync(request: Request, since_lamport: int = 0, since_server: str = "",
+         limit: Optional[int] = None, stream: bool = False, vector: Optional[str] = None,
+         room: Optional[str] = None):
     """
-    Devuelve mensajes posteriores a (since_lamport, since_server).
-    Si no se proporciona since_server, asume string vacío.
+    Devuelve mensajes posteriores a (since_lamport, since_server), como máximo
+    `limit` (por defecto sync_page_size). Si `has_more` es true, la siguiente
+    página empieza después del último mensaje devuelto.
+    Con `vector` ("A:12,B:7") el cursor es por origen: devuelve lo de cada
+    server_id posterior a su lamport en el vector (orígenes ausentes: todo).
+    Con `room` solo los mensajes de esa sala (los peers replican todas).
+    Los mensajes privados (con "to") solo se incluyen para los peers
+    autenticados con peer_token: cada nodo los entrega a las sesiones
+    locales del destinatario.
+    En modo stream (NDJSON) devuelve todo lo posterior salvo que haya `limit`.
     """
     try:
-        # Si no especifican posición, retornar todo
-        if since_lamport == 0 and not since_server:
-            msgs = get_full_history(db_conn)
+        origin_vector = parse_vector(vector) if vector is not None else None
+    except ValueError:
+        return JSONResponse({"error": "vector inválido"}, status_code=400)
+
+    private = from_peer(request)
+    if wants_stream(request, stream):
+        return ndjson_response(since_lamport, since_server, limit, origin_vector, room, private)
+
+    try:
+        page = clamp_limit(limit if limit is not None else SYNC_PAGE_SIZE)
+        if origin_vector is not None:
+            msgs = get_messages_after_vector(db_conn, origin_vector, page, room, private)
         else:
-            msgs = get_messages_after(db_conn, since_lamport, since_server)
+            msgs = get_messages_after(db_conn, since_lamport, since_server, page + 1, room,
+                                      private)
+        has_more = len(msgs) > page
 
         return {
-            "messages": [
-                {
-                    "user": m[0],
-                    "message": m[1],
-                    "lamport": m[2],
-                    "server_id": m[3],
-                    "timestamp": m[4]
-                }
-                for m in msgs
-            ]
+            "messages": [row_to_dict(m) for m in msgs[:page]],
+            "has_more": has_more
         }
     except Exception:
-        traceback.print_exc()
+        log.exception("/sync falló")
         return JSONResponse({"error": "sync failed"}, status_code=500)
 
 
+@app.get("/search")
+def search(q: str, limit: Optional[int] = None, cursor: Optional[str] = None):
+    """
+    Búsqueda de texto en el historial, ordenada por relevancia (bm25).
+    Todas las palabras de `q` son requeridas; "hol*" busca por prefijo.
+    Pagina con `next_cursor` (null al final).
+    """
+    if not db_conn.fts:
+        return JSONResponse({"error": "búsqueda no disponible (sin FTS5)"}, status_code=501)
+
+    query = fts_query(q)
+    if query is None:
+        return JSONResponse({"error": "q vacío"}, status_code=400)
+    # cursor = "offset:min_id:max_id" (ventana fijada en la primera página);
+    # un entero solo es un offset sobre la ventana actual
+    try:
+        parts = [int(p) for p in cursor.split(":")] if cursor else [0]
+        if len(parts) not in (1, 3) or min(parts) < 0:
+            raise ValueError(cursor)
+    except ValueError:
+        return JSONResponse({"error": "cursor inválido"}, status_code=400)
+    offset = parts[0]
+    bounds = tuple(parts[1:]) or None
+
+    page = clamp_limit(limit if limit is not None else SEARCH_PAGE_SIZE)
+    msgs, (min_id, max_id) = search_messages(db_conn, query, page + 1, offset,
+                                             SEARCH_WINDOW, bounds)
+
+    next_cursor = None
+    if len(msgs) > page:
+        msgs = msgs[:page]
+        next_cursor = f"{offset + page}:{min_id}:{max_id}"
+
+    results = []
+    for m in msgs:
+        item = row_to_dict(m)
+        item["score"] = m[7]
+        results.append(item)
+    return {"messages": results, "next_cursor": next_cursor}
+
+
+@app.get("/digest")
+def digest(request: Request, group: int = 64, lo_bucket: Optional[int] = None,
+           hi_bucket: Optional[int] = None):
+    """
+    Digests de anti-entropía: por cada grupo de `group` buckets de
+    DIGEST_BUCKET lamports, [count, hash XOR de sus mensajes]. Un peer
+    compara con los suyos, baja a group=1 solo en los grupos distintos y
+    pide por /range únicamente los buckets que difieren. Cubren lo mismo
+    que /range le entregará a quien pregunta: sin peer_token, solo los
+    públicos ("private": false, y el peer compara sus digests públicos).
+    """
+    group = max(1, int(group))
+    private = from_peer(request)
+    digests = get_bucket_digests(db_conn, group, lo_bucket, hi_bucket, private)
+    return {
+        "bucket_size": DIGEST_BUCKET,
+        "group": group,
+        "private": private,
+        "digests": {str(k): [c, h] for k, (c, h) in digests.items()}
+    }
+
+
+@app.get("/range")
+def lamport_range(request: Request, lo: int, hi: int):
+    """
+    Mensajes con lo <= lamport < hi (un bucket o grupo de buckets); los
+    privados solo para peers autenticados.
+    """
+    msgs = get_messages_in_range(db_conn, lo, hi, from_peer(request))
+    return {"messages": [row_to_dict(m) for m in msgs]}
+
+
+@app.get("/replicate")
+async def replicate(request: Request, since_lamport: int = 0, since_server: str = "",
+                    origin: str = ""):
+    """
+    Canal de replicación de larga duración (NDJSON sobre HTTP chunked).
+    Envía en lotes todo lo posterior a (since_lamport, since_server) y sigue
+    abierto enviando las filas nuevas a medida que aparecen. Cada línea es
+    {"messages": [...], "cursor": "lamport:server_id"}; sin novedades se
+    manda un lote vacío cada replication_keepalive segundos.
+    `origin` envía solo los de ese origen (en clúster, los del propio nodo),
+    leídos directo por idx_messages_origin a partir de since_lamport.
+    Los privados solo para peers autenticados.
+    """
+    private = from_peer(request)
+
+    async def generate():
+        cursor = (since_lamport, since_server)
+        last_sent = time.monotonic()
+        while not await request.is_disconnected():
+            if origin:
+                rows = await asyncio.to_thread(
+                    get_origin_messages_after, db_conn, origin, cursor[0], REPLICATION_BATCH,
+                    private
+                )
+            else:
+                rows = await asyncio.to_thread(
+                    get_messages_after, db_conn, cursor[0], cursor[1], REPLICATION_BATCH,
+                    None, private
+                )
+            if rows:
+                cursor = (rows[-1][2], rows[-1][3])
+                batch = [row_to_dict(m) for m in rows]
+                if batch:
+                    yield json.dumps({"messages": batch, "cursor": make_cursor(rows[-1])}) + "\n"
+                    last_sent = time.monotonic()
+                if len(rows) == REPLICATION_BATCH:
+                    # Hay más pendientes: seguir sin esperar
+                    continue
+            if time.monotonic() - last_sent >= REPLICATION_KEEPALIVE:
+                yield json.dumps({"messages": [], "cursor": f"{cursor[0]}:{cursor[1]}"}) + "\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(REPLICATION_POLL)
+
+    return StreamingResponse(generate(), media_type=NDJSON)
+
+
+def parse_push_message(m):
+    """
+    Valida un mensaje de /push o /push_batch y retorna la fila para
+    submit_message. ValueError si falta un campo o tiene otro tipo.
+    """
+    if not isinstance(m, dict):
+        raise ValueError("el mensaje no es un objeto")
+    for field in ("user", "message", "server_id"):
+        if not isinstance(m.get(field), str):
+            raise ValueError(f"'{field}' debe ser texto")
+    lamport = m.get("lamport")
+    if not isinstance(lamport, int) or isinstance(lamport, bool) or lamport < 0:
+        raise ValueError("'lamport' debe ser un entero no negativo")
+    for field in ("timestamp", "room", "to"):
+        if m.get(field) is not None and not isinstance(m[field], str):
+            raise ValueError(f"'{field}' debe ser texto")
+    ts = m.get("timestamp") or datetime.now(timezone.utc).isoformat()
+    return (m["user"], m["message"], lamport, m["server_id"], ts,
+            m.get("room") or DEFAULT_ROOM, m.get("to") or None)
+
+
 @app.post("/push")
 async def push_message(request: Request):
     """
-    Recibe un mensaje remoto y lo almacena.
+    Recibe un mensaje remoto y lo almacena. 400 si el mensaje es inválido
+    y 500 si no se pudo guardar (el peer lo reintenta). Con node.py
+    notify_message lo entrega a los clientes TLS; con server_tls.py en otro
+    proceso, este toma los privados de la BD (follow_private_messages).
     """
     try:
-        payload = await request.json()
+        row = parse_push_message(await request.json())
+    except ValueError as e:
+        return JSONResponse({"error": f"mensaje inválido: {e}"}, status_code=400)
 
-        remote_l = int(payload["lamport"])
-        user = payload["user"]
-        msg = payload["message"]
-        remote_server = payload["server_id"]
-        ts = payload.get("timestamp") or datetime.now(timezone.utc).isoformat()
+    try:
+        remote_l, remote_server = row[2], row[3]
 
         # Actualizar Lamport local
         local_l = update_lamport(remote_l)
 
-        # Insertar en DB
-        was_inserted = insert_message(db_conn, user, msg, remote_l, remote_server, ts)
+        # Insertar en DB (espera el group commit sin bloquear el event loop)
+        was_inserted = await asyncio.wrap_future(submit_message(db_conn, *row))
+
+        PUSH_RECEIVED.inc()
+        if was_inserted:
+            PUSH_STORED.inc()
+            notify_message(message_payload(*row))
 
-        if DEBUG:
-            print(f"[REST /push] ({remote_l},{remote_server}) inserted={was_inserted}")
+        log.debug("/push (%s,%s) inserted=%s", remote_l, remote_server, was_inserted)
 
         return {
             "status": "stored" if was_inserted else "duplicate",
@@ -170,8 +455,68 @@ async def push_message(request: Request):
             "inserted": was_inserted
         }
     except Exception:
-        if DEBUG:
-            traceback.print_exc()
+        log.debug("/push falló", exc_info=True)
+        return JSONResponse({"error": "push failed"}, status_code=500)
+
+@app.post("/push_batch")
+async def push_batch(request: Request):
+    """
+    Recibe un lote {"messages": [...]} de mensajes remotos y lo almacena
+    con un solo group commit. Se valida entero antes de guardar nada: con
+    un mensaje inválido responde 400. Si alguna fila no se pudo guardar
+    responde 500 para que el peer reintente (lo ya guardado vuelve como
+    duplicado).
+    """
+    try:
+        payload = await request.json()
+        msgs = payload.get("messages") if isinstance(payload, dict) else None
+        if not isinstance(msgs, list):
+            raise ValueError("falta la lista 'messages'")
+        rows = []
+        for i, m in enumerate(msgs):
+            try:
+                rows.append(parse_push_message(m))
+            except ValueError as e:
+                raise ValueError(f"messages[{i}]: {e}")
+    except ValueError as e:
+        return JSONResponse({"error": f"lote inválido: {e}"}, status_code=400)
+
+    try:
+        futures = [submit_message(db_conn, *row) for row in rows]
+
+        # Actualizar Lamport local una vez con el máximo del lote
+        local_l = update_lamport(max((row[2] for row in rows), default=0))
+
+        results = await asyncio.gather(
+            *(asyncio.wrap_future(f) for f in futures), return_exceptions=True
+        )
+        stored = failed = 0
+        for row, inserted in zip(rows, results):
+            if isinstance(inserted, BaseException):
+                failed += 1
+            elif inserted:
+                stored += 1
+                notify_message(message_payload(*row))
+        PUSH_RECEIVED.inc(len(rows))
+        PUSH_STORED.inc(stored)
+
+        log.debug("/push_batch recibidos=%d nuevos=%d fallidos=%d", len(rows), stored, failed)
+
+        if failed:
+            return JSONResponse({
+                "error": "push failed",
+                "stored": stored,
+                "failed": failed
+            }, status_code=500)
+        return {
+            "status": "stored",
+            "server_id": SERVER_ID,
+            "lamport_local": local_l,
+            "stored": stored,
+            "duplicates": len(rows) - stored
+        }
+    except Exception:
+        log.debug("/push_batch falló", exc_info=True)
         return JSONResponse({"error": "push failed"}, status_code=500)
 
 # ------------------------------------------------
@@ -179,17 +524,13 @@ async def push_message(request: Request):
 # ------------------------------------------------
 
 if __name__ == "__main__":
-    print(f"[REST] ========================================")
-    print(f"[REST] Iniciando distributed_api")
-    print(f"[REST] Server ID: {SERVER_ID}")
-    print(f"[REST] Base de datos: {db_path}")
-    print(f"[REST] Escuchando en {REST_HOST}:{REST_PORT}")
-    print(f"[REST] Debug: {DEBUG}")
-    print(f"[REST] ========================================")
-    
+    log.info("Iniciando distributed_api", extra={
+        "server_id": SERVER_ID,
+        "db": db_path,
+        "listen": f"{REST_HOST}:{REST_PORT}",
+    })
+
     # Configurar uvicorn con logs apropiados
-    import logging
-    
     log_level = "debug" if DEBUG else "info"
     
     uvicorn.run(
@@ -197,5 +538,8 @@ if __name__ == "__main__":
         host=REST_HOST, 
         port=REST_PORT,
         log_level=log_level,
-        access_log=DEBUG  # Solo mostrar access logs si está en debug
-    )
\ No newline at end of file
+        access_log=DEBUG,  # Solo mostrar access logs si está en debug
+        timeout_graceful_shutdown=3  # no esperar a los canales /replicate
+    )
+    # Persistir lo que quede en la cola del escritor
+    flush(db_conn, timeout=5)
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""
+framing.py - Lectura de líneas a nivel de bytes
+
+LineReader acumula lo que llega del socket en un bytearray y busca "\\n"
+desde donde terminó la búsqueda anterior: cada byte se examina una sola
+vez y solo se decodifican líneas completas. Una línea que supere
+max_line lanza LineTooLong (el llamador corta la conexión), así un
+cliente no puede hacer crecer el buffer sin límite.
+"""
+
+
+class LineTooLong(Exception):
+    pass
+
+
+class LineReader:
+    def __init__(self, max_line=65536, encoding="utf-8"):
+        self.max_line = max_line
+        self.encoding = encoding
+        self._buf = bytearray()
+        self._start = 0  # inicio de la línea en curso
+        self._scan = 0   # hasta dónde ya se buscó "\n"
+
+    def feed(self, data):
+        if self._start:
+            # Borrar del frente de un bytearray no mueve el resto en CPython
+            del self._buf[:self._start]
+            self._scan -= self._start
+            self._start = 0
+        self._buf += data
+
+    def readline(self):
+        """Siguiente línea completa (sin "\\n") o None si aún no llegó."""
+        i = self._buf.find(b"\n", self._scan)
+        if i < 0:
+            self._scan = len(self._buf)
+            if self._scan - self._start > self.max_line:
+                raise LineTooLong(f"línea de más de {self.max_line} bytes")
+            return None
+        if i - self._start > self.max_line:
+            raise LineTooLong(f"línea de más de {self.max_line} bytes")
+        view = memoryview(self._buf)
+        try:
+            line = str(view[self._start:i], self.encoding, "replace")
+        finally:
+            view.release()
+        self._start = self._scan = i + 1
+        return line
+
+    def __iter__(self):
+        """
+        Todas las líneas completas disponibles. Corta en bloque hasta el
+        último "\n" (un split en C en vez de una búsqueda por línea).
+        """
+        while True:
+            end = self._buf.rfind(b"\n", self._scan)
+            if end < 0:
+                # Sin líneas completas: readline() valida el tamaño
+                self.readline()
+                return
+            view = memoryview(self._buf)
+            try:
+                parts = view[self._start:end].tobytes().split(b"\n")
+            finally:
+                view.release()
+            if max(map(len, parts)) > self.max_line:
+                raise LineTooLong(f"línea de más de {self.max_line} bytes")
+            self._start = self._scan = end + 1
+            for part in parts:
+                yield part.decode(self.encoding, "replace")
+
+    def detach(self):
+        """
+        Retorna y descarta los bytes aún no consumidos (cambio de protocolo).
+        Usar con readline(): la iteración ya consumió su bloque entero.
+        """
+        rest = bytes(self._buf[self._start:])
+        self._buf = bytearray()
+        self._start = self._scan = 0
+        return rest
+
+    def lines_from(self, sock, bufsize=4096):
+        """Genera las líneas de un socket bloqueante hasta que se cierre."""
+        while True:
+            yield from self
+            data = sock.recv(bufsize)
+            if not data:
+                return
+            self.feed(data)
@@ -0,0 +1,168 @@
+"""
+logs.py - Logging asíncrono y estructurado del nodo
+
+Cada módulo escribe con su logger (get_logger("sync"), "push", "hb", ...).
+El QueueHandler solo encola el registro: formatearlo y escribirlo en
+stdout lo hace un QueueListener en su propio thread, así un pipe lleno no
+frena a los threads de clientes ni al event loop. La cola es acotada: si
+se llena, el registro se descarta y se cuenta en chat_log_dropped_total.
+
+Salida: una línea JSON por registro (log_format "json", con los campos
+pasados en `extra`) o texto con el prefijo [COMPONENTE] ("text").
+Los niveles van por componente en log_levels y reemplazan a debug y
+verbose_*, que se siguen aceptando. Las líneas por mensaje (logger
+"messages") pasan por un límite de tasa; cuántas se omitieron se informa
+en la siguiente que pasa.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import metrics
+
+ROOT = "chat"
+
+# Atributos propios de LogRecord: el resto son campos de `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+# Flags anteriores -> componentes que pasan a DEBUG
+_LEGACY_FLAGS = {
+    "verbose_sync": ("sync", "ae"),
+    "verbose_push": ("push",),
+    "verbose_heartbeat": ("hb",),
+}
+
+LOG_DROPPED = metrics.counter(
+    "chat_log_dropped_total", "Registros de log descartados por cola llena")
+LOG_SUPPRESSED = metrics.counter(
+    "chat_log_suppressed_total", "Líneas por mensaje omitidas por el límite de tasa")
+
+
+def get_logger(component):
+    return logging.getLogger(f"{ROOT}.{component}")
+
+
+def _component(record):
+    return record.name.rpartition(".")[2]
+
+
+# --- Formatos ---
+def _extra(record):
+    return {k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "component": _component(record),
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"[{_component(record).upper()}] {record.getMessage()}"
+        extra = _extra(record)
+        if extra:
+            line += " (" + " ".join(f"{k}={v}" for k, v in extra.items()) + ")"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+# --- Límite de tasa ---
+class RateLimitFilter(logging.Filter):
+    """Token bucket: hasta `rate` registros por segundo con ráfagas de `burst`."""
+
+    def __init__(self, rate, burst=None):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                LOG_SUPPRESSED.inc()
+                return False
+            self.tokens -= 1
+            if self.suppressed:
+                record.suppressed = self.suppressed
+                self.suppressed = 0
+        return True
+
+
+# --- Cola ---
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Mismo proceso: el listener formatea, acá no se copia ni se serializa
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Con la cola llena, esperar a que el listener haga lugar
+        self.queue.put(self._sentinel, timeout=5)
+
+
+_listener = None
+
+
+def setup(config):
+    """Configura los loggers "chat.*" según config (una sola vez por proceso)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    root = logging.getLogger(ROOT)
+    root.setLevel("DEBUG" if config.get("debug") else str(config.get("log_level", "info")).upper())
+    root.propagate = False
+
+    levels = {}
+    for flag, components in _LEGACY_FLAGS.items():
+        if config.get(flag):
+            levels.update(dict.fromkeys(components, "debug"))
+    levels.update(config.get("log_levels") or {})
+    for component, level in levels.items():
+        get_logger(component).setLevel(str(level).upper())
+
+    get_logger("messages").addFilter(RateLimitFilter(
+        config.get("log_message_rate", 20), config.get("log_message_burst")
+    ))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if config.get("log_format") == "text" else JsonFormatter())
+    log_queue = queue.Queue(int(config.get("log_queue_size", 10000)))
+    root.handlers[:] = [_QueueHandler(log_queue)]
+
+    _listener = _QueueListener(log_queue, output)
+    _listener.start()
+    # Al salir se escribe lo que quede en la cola
+    atexit.register(_listener.stop)
@@ -0,0 +1,262 @@
+"""
+metrics.py - Métricas del nodo en el formato de texto de Prometheus
+
+Registro mínimo sin dependencias: Counter, Gauge e Histogram, con
+etiquetas opcionales. Registrar un valor es un lock y una suma (más un
+bisect en los histogramas), así que se puede dejar activo en producción.
+Los valores que ya viven en otro lado (clientes conectados, reloj de
+Lamport, colas de push) no se copian: se leen de una función al momento
+del scrape con set_function().
+
+distributed_api expone render() en GET /metrics; server_tls puede además
+servirlo en un puerto propio con start_http_server().
+"""
+import math
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Límites por defecto de los histogramas
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # segundos
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)             # elementos
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if value.is_integer():
+            return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+# --- Valores (uno por combinación de etiquetas) ---
+class _Value:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+        self._fn = None
+
+    def inc(self, n=1):
+        with self._lock:
+            self._value += n
+
+    def dec(self, n=1):
+        with self._lock:
+            self._value -= n
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def set_function(self, fn):
+        """El valor se lee llamando a fn() en cada scrape."""
+        self._fn = fn
+
+    def get(self):
+        if self._fn is not None:
+            return self._fn()
+        with self._lock:
+            return self._value
+
+
+class _HistogramValue:
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # el último es +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+# --- Métricas ---
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._children = {}
+        # Sin etiquetas hay un único valor y se usa directo (camino rápido)
+        self._value = None
+        if not self.labelnames:
+            self._value = self._children[()] = self._new_value()
+
+    def _new_value(self):
+        return _Value()
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name}: se esperaban etiquetas {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_value())
+        return child
+
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def _default(self):
+        if self._value is None:
+            raise ValueError(f"{self.name}: usar labels({', '.join(self.labelnames)})")
+        return self._value
+
+    def _samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            try:
+                value = child.get()
+            except Exception:
+                # Una función de scrape que falla no tumba el resto
+                continue
+            yield f"{self.name}{_label_str(self.labelnames, key)} {_fmt(value)}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, n=1):
+        self._default().inc(n)
+
+    def set_function(self, fn):
+        self._default().set_function(fn)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, n=1):
+        self._default().inc(n)
+
+    def dec(self, n=1):
+        self._default().dec(n)
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, fn):
+        self._default().set_function(fn)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def _new_value(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def _samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), counts):
+                cumulative += count
+                labels = _label_str(self.labelnames, key, [("le", _fmt(float(bound)))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _label_str(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_fmt(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+# --- Registro ---
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name, help, labels, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help, labels, **kwargs)
+        elif not isinstance(metric, cls) or metric.labelnames != tuple(labels):
+            raise ValueError(f"La métrica {name} ya existe con otro tipo o etiquetas")
+        return metric
+
+
+def counter(name, help, labels=()):
+    return _get_or_create(Counter, name, help, labels)
+
+
+def gauge(name, help, labels=()):
+    return _get_or_create(Gauge, name, help, labels)
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return _get_or_create(Histogram, name, help, labels, buckets=buckets)
+
+
+def render():
+    """Todas las métricas registradas en formato de texto de Prometheus."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(m.render() for m in metrics) + "\n"
+
+
+# --- Servidor HTTP propio (para server_tls sin distributed_api) ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="0.0.0.0"):
+    """Sirve GET /metrics en host:port desde un thread propio."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http")
+    thread.start()
+    return server
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+node.py - Nodo completo en un solo proceso
+
+Aloja el listener TLS (motor asyncio) y la API REST de distributed_api en
+el mismo event loop, con un solo reloj de Lamport y una sola capa de BD
+(node_state). Lo que llega por /push se difunde de inmediato a los
+clientes TLS locales.
+
+USO: python node.py --config config_a.json
+"""
+import asyncio
+import sys
+
+import uvicorn
+
+import server_tls
+import distributed_api
+from db import flush
+from logs import get_logger
+from node_state import config, db_conn, db_path, clock, SERVER_ID
+
+log = get_logger("node")
+
+
+async def run_node():
+    server_tls.start_background_threads()
+    tls_task = asyncio.create_task(server_tls.serve_async(server_tls.create_tls_context()))
+
+    debug = config.get("debug", False)
+    api = uvicorn.Server(uvicorn.Config(
+        distributed_api.app,
+        host=distributed_api.REST_HOST,
+        port=distributed_api.REST_PORT,
+        log_level="debug" if debug else "info",
+        access_log=debug,
+        # Los canales /replicate no terminan solos: no esperarlos al cerrar
+        timeout_graceful_shutdown=3
+    ))
+    api_task = asyncio.create_task(api.serve())
+    try:
+        # uvicorn atiende Ctrl+C y termina serve(); con él se cierra el nodo.
+        # Si el listener TLS termina antes (p. ej. el puerto está ocupado) se
+        # cierra también la API y el nodo sale con ese error
+        done, _ = await asyncio.wait({tls_task, api_task}, return_when=asyncio.FIRST_COMPLETED)
+        if tls_task in done:
+            api.should_exit = True
+            await api_task
+            tls_task.result()
+    finally:
+        tls_task.cancel()
+
+
+def main():
+    log.info("Iniciando nodo (TLS + REST en un proceso)", extra={
+        "server_id": SERVER_ID,
+        "db": db_path,
+        "lamport": clock.value,
+        "tls": f"{server_tls.HOST}:{server_tls.PORT}",
+        "rest": f"{distributed_api.REST_HOST}:{distributed_api.REST_PORT}",
+        "peers": [p.url for p in server_tls.PEERS],
+    })
+
+    server_tls.raise_fd_limit()
+    code = 0
+    try:
+        asyncio.run(run_node())
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        log.exception("El nodo terminó por un error")
+        code = 1
+    finally:
+        log.info("Cerrando...")
+        flush(db_conn, timeout=5)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
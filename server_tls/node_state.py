@@ -0,0 +1,97 @@
+"""
+node_state.py - Estado compartido de un nodo: config, BD y reloj de Lamport
+
+server_tls.py y distributed_api.py lo importan. Corriendo en procesos
+separados cada uno tiene su propia copia; alojados juntos por node.py
+comparten una sola capa de BD, un solo reloj y los listeners de mensajes
+(así lo que llega por /push se difunde al instante a los clientes TLS).
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+import logs
+import metrics
+from db import init_db, get_max_lamport
+
+
+# --- Configuración ---
+def load_config():
+    """
+    Acepta la ruta como `--config archivo.json` (server_tls.py, node.py)
+    o como primer argumento posicional (distributed_api.py).
+    """
+    parser = argparse.ArgumentParser(description="Nodo de chat distribuido")
+    parser.add_argument("config_path", nargs="?",
+                        help="Ruta al archivo de configuración JSON")
+    parser.add_argument("--config", type=str, dest="config_opt",
+                        help="Ruta al archivo de configuración JSON")
+    args, _ = parser.parse_known_args()
+
+    config_path = args.config_opt or args.config_path
+    if not config_path:
+        print("USO: python <script>.py --config config.json")
+        sys.exit(1)
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"El archivo de configuración '{config_path}' no existe")
+
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+config = load_config()
+logs.setup(config)
+SERVER_ID = config.get("server_id", "S")
+
+BASE_DIR = os.path.dirname(__file__)
+db_path = os.path.join(BASE_DIR, config.get("db_file", "messages.db"))
+db_conn = init_db(
+    db_path,
+    batch_size=int(config.get("db_batch_size", 256)),
+    flush_ms=float(config.get("db_flush_ms", 10)),
+    readers=int(config.get("db_readers", 4))
+)
+
+
+# --- Lamport Clock ---
+class LamportClock:
+    def __init__(self, value=0):
+        self.value = value
+        self._lock = threading.Lock()
+
+    def tick(self):
+        """Evento local: incrementa y retorna el valor."""
+        with self._lock:
+            self.value += 1
+            return self.value
+
+    def update(self, received):
+        """Recepción: value = max(local, remoto) + 1."""
+        with self._lock:
+            self.value = max(self.value, int(received)) + 1
+            return self.value
+
+
+# ✅ Inicializar lamport con el máximo de la BD
+clock = LamportClock(get_max_lamport(db_conn))
+metrics.gauge("chat_lamport_clock", "Valor actual del reloj de Lamport").set_function(
+    lambda: clock.value)
+
+
+# --- Listeners de mensajes remotos ---
+_message_listeners = []
+
+
+def add_message_listener(fn):
+    """Registra fn(payload) para cada mensaje remoto nuevo guardado en la BD."""
+    _message_listeners.append(fn)
+
+
+def notify_message(payload):
+    for fn in list(_message_listeners):
+        try:
+            fn(payload)
+        except Exception:
+            logs.get_logger("node").exception("Error en listener de mensajes")
@@ -0,0 +1,190 @@
+"""
+outbound.py - Colas de salida acotadas por cliente
+
+Cada cliente conectado tiene un "canal" con una cola de frames ya
+serializados y un escritor dedicado (thread o task) que la vacía.
+broadcast() solo encola: un cliente con la ventana TCP llena nunca
+bloquea al resto.
+"""
+import asyncio
+import queue
+import socket
+import threading
+
+import wire
+
+# Políticas para clientes lentos (cola llena)
+POLICY_DROP = "drop"    # se descarta el frame nuevo, el cliente sigue conectado
+POLICY_EVICT = "evict"  # se desconecta al cliente
+
+
+class OutboundStats:
+    """Contadores globales de las colas de salida."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.frames_enqueued = 0
+        self.dropped_frames = 0
+        self.evicted_clients = 0
+
+    def incr(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "frames_enqueued": self.frames_enqueued,
+                "dropped_frames": self.dropped_frames,
+                "evicted_clients": self.evicted_clients,
+            }
+
+
+stats = OutboundStats()
+
+
+class ThreadedChannel:
+    """Cola de salida + thread escritor para un socket TLS bloqueante."""
+
+    def __init__(self, sock, maxsize=256, policy=POLICY_DROP, encoding=wire.JSON):
+        self.sock = sock
+        self.policy = policy
+        # Codificación negociada por el cliente (ver wire.py)
+        self.encoding = encoding
+        self.closed = False
+        self.queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def send(self, data):
+        """
+        Encola data sin bloquear. Retorna False si el canal quedó cerrado
+        (el llamador debe olvidar al cliente).
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            return _overflow(self)
+        stats.incr("frames_enqueued")
+        return True
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None or self.closed:
+                break
+            try:
+                self.sock.sendall(data)
+            except Exception:
+                self.close()
+                break
+
+    def close(self, abort=False):
+        # shutdown ya corta de inmediato: abort no cambia nada acá
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+        # Despertar al escritor si está esperando en la cola
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class AsyncChannel:
+    """
+    Cola de salida + task escritor para un StreamWriter de asyncio.
+    send() y close() se pueden llamar desde cualquier thread.
+    """
+
+    def __init__(self, writer, loop, maxsize=256, policy=POLICY_DROP, encoding=wire.JSON):
+        self.writer = writer
+        self.loop = loop
+        self.policy = policy
+        self.encoding = encoding
+        self.closed = False
+        self.queue = asyncio.Queue(maxsize)
+        self._loop_thread = threading.get_ident()
+        self._task = loop.create_task(self._run())
+
+    def send(self, data):
+        if self.closed:
+            return False
+        if threading.get_ident() == self._loop_thread:
+            return self._put(data)
+        self.loop.call_soon_threadsafe(self._put, data)
+        return True
+
+    def _put(self, data):
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            return _overflow(self)
+        stats.incr("frames_enqueued")
+        return True
+
+    def depth(self):
+        return self.queue.qsize()
+
+    async def _run(self):
+        try:
+            while True:
+                data = await self.queue.get()
+                if data is None or self.closed:
+                    break
+                self.writer.write(data)
+                await self.writer.drain()
+        except Exception:
+            pass
+        finally:
+            self.close()
+
+    def close(self, abort=False):
+        """
+        Cierra el canal. Con abort=True descarta lo pendiente en el
+        transporte: writer.close() esperaría a vaciarlo hacia un cliente
+        que no lee y su handler nunca vería el fin de la conexión.
+        """
+        if threading.get_ident() != self._loop_thread:
+            self.closed = True
+            self.loop.call_soon_threadsafe(self._close_in_loop, abort)
+            return
+        self._close_in_loop(abort)
+
+    def _close_in_loop(self, abort=False):
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            self._task.cancel()
+        try:
+            if abort:
+                self.writer.transport.abort()
+            else:
+                self.writer.close()
+        except Exception:
+            pass
+
+
+def _overflow(channel):
+    """Aplica la política de cliente lento cuando su cola está llena."""
+    if channel.policy == POLICY_EVICT:
+        stats.incr("evicted_clients")
+        channel.close(abort=True)
+        return False
+    stats.incr("dropped_frames")
+    return True
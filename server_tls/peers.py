@@ -0,0 +1,66 @@
+"""
+peers.py - Estado por peer del clúster
+
+Cada nodo replica con todos los de su lista `peers`: por cada uno lleva
+su propia vida (heartbeat), su cola de push y el estado de su canal de
+replicación.
+
+Con `peer_token` (el mismo secreto en todos los nodos) las lecturas de
+replicación se autentican con la cabecera PEER_TOKEN_HEADER: solo así
+/sync, /replicate y /range incluyen los mensajes privados.
+"""
+import threading
+
+from push_sender import PushSender
+
+PEER_TOKEN_HEADER = "X-Peer-Token"
+
+
+class Peer:
+    def __init__(self, url, push_batch_size=200, push_max_backoff=30, push_max_attempts=8,
+                 private_recoverable=False):
+        self.url = url.rstrip("/")
+        # server_id del peer; se conoce con el primer heartbeat
+        self.server_id = None
+        # Watermark del propio origen del peer, también del heartbeat
+        self.origin_lamport = None
+        self._alive = True
+        self._lock = threading.Lock()
+        # Activo mientras el canal /replicate con este peer está conectado
+        self.replication_active = threading.Event()
+        self.push = PushSender(
+            self.url,
+            is_alive=self.is_alive,
+            batch_size=push_batch_size,
+            max_backoff=push_max_backoff,
+            max_attempts=push_max_attempts,
+            private_recoverable=private_recoverable
+        )
+
+    def is_alive(self):
+        with self._lock:
+            return self._alive
+
+    def set_alive(self, alive):
+        """Actualiza la vida del peer y retorna el valor anterior."""
+        with self._lock:
+            was_alive = self._alive
+            self._alive = alive
+            return was_alive
+
+    def __repr__(self):
+        return f"Peer({self.url}, server_id={self.server_id})"
+
+
+def peer_urls(config):
+    """Lista `peers` del config; `peer_url` se acepta como clúster de dos nodos."""
+    urls = list(config.get("peers") or [])
+    if not urls and config.get("peer_url"):
+        urls = [config["peer_url"]]
+    return urls
+
+
+def peer_headers(config):
+    """Cabeceras para las lecturas de replicación hacia los peers."""
+    token = config.get("peer_token") or ""
+    return {PEER_TOKEN_HEADER: token} if token else {}
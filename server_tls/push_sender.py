@@ -0,0 +1,127 @@
+"""
+push_sender.py - Envío de mensajes al peer en segundo plano
+
+push_to_peer() solo encola. Un thread agrupa lo pendiente en un único
+POST /push_batch sobre una sesión keep-alive y reintenta con backoff
+exponencial (tope max_backoff). Tras max_attempts intentos fallidos, o
+ante un 4xx (el peer rechazó el lote), se descartan solo los mensajes que
+el peer puede volver a traer por /sync, /replicate o /range: los públicos
+y, si el clúster tiene peer_token, también los privados. Sin peer_token
+un privado solo viaja por push, así que se sigue reintentando hasta que
+el peer lo acepte; la memoria la acota max_pending. La vida del peer la
+decide el heartbeat: mientras esté caído el sender espera en vez de
+reintentar, y esa espera no cuenta como intento.
+"""
+import queue
+import threading
+import time
+
+import requests
+
+import metrics
+from logs import get_logger
+
+log = get_logger("push")
+
+PUSH_SECONDS = metrics.histogram(
+    "chat_push_seconds", "Ida y vuelta de cada POST /push_batch aceptado", ("peer",))
+PUSH_BATCH_SIZE = metrics.histogram(
+    "chat_push_batch_size", "Mensajes por lote de push", ("peer",), buckets=metrics.SIZE_BUCKETS)
+PUSH_FAILURES = metrics.counter(
+    "chat_push_failures_total", "Intentos de push fallidos (se reintentan)", ("peer",))
+PUSH_DROPPED = metrics.counter(
+    "chat_push_dropped_total", "Mensajes descartados del push (el peer los trae por sincronización)", ("peer",))
+
+
+class PushSender:
+    def __init__(self, peer_url, is_alive=None, batch_size=200, timeout=5,
+                 max_backoff=30, max_attempts=8, max_pending=100000, private_recoverable=False):
+        self.peer_url = peer_url
+        self.is_alive = is_alive or (lambda: True)
+        self.batch_size = max(1, int(batch_size))
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.max_attempts = max(1, int(max_attempts))
+        # True con peer_token: los privados también se pueden volver a traer
+        self.private_recoverable = private_recoverable
+        # Cota de memoria: si se supera, lo que no entre lo recupera /sync
+        self.queue = queue.Queue(max_pending)
+        self.session = requests.Session()
+        self.sent = 0
+        self.overflow = 0
+        self._rtt = PUSH_SECONDS.labels(peer_url)
+        self._batch_size = PUSH_BATCH_SIZE.labels(peer_url)
+        self._failures = PUSH_FAILURES.labels(peer_url)
+        self._dropped = PUSH_DROPPED.labels(peer_url)
+        self.thread = threading.Thread(target=self._run, daemon=True, name="push-sender")
+        self.thread.start()
+
+    def enqueue(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            self.overflow += 1
+            log.debug("⚠️  Cola llena, el mensaje llegará por sincronización")
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _recoverable(self, payload):
+        """True si el peer puede recuperar el mensaje sin este push."""
+        return self.private_recoverable or payload.get("type") != "private"
+
+    def _send(self, batch):
+        """
+        Envía el lote. Retorna True si el peer aceptó todo y False si se
+        descartaron mensajes recuperables por sincronización; los que no lo
+        son se reintentan hasta que el peer los acepte.
+        """
+        url = f"{self.peer_url}/push_batch"
+        delay = 0.5
+        attempts = 0
+        dropped = False
+        while True:
+            if not self.is_alive():
+                time.sleep(1)
+                continue
+            attempts += 1
+            rejected = False
+            try:
+                started = time.perf_counter()
+                resp = self.session.post(url, json={"messages": batch}, timeout=self.timeout)
+                if resp.status_code == 200:
+                    self._rtt.observe(time.perf_counter() - started)
+                    self._batch_size.observe(len(batch))
+                    self.sent += len(batch)
+                    log.debug("✓ Lote de %d enviado -> %s", len(batch), url)
+                    return not dropped
+                error = f"status {resp.status_code}"
+                rejected = resp.status_code < 500
+            except requests.RequestException as e:
+                error = repr(e)[:80]
+
+            self._failures.inc()
+            if rejected or attempts >= self.max_attempts:
+                kept = [p for p in batch if not self._recoverable(p)]
+                if len(kept) < len(batch):
+                    dropped = True
+                    self._dropped.inc(len(batch) - len(kept))
+                    log.error("❌ %d mensaje(s) descartado(s) tras %d intento(s) (%s), quedan para /sync",
+                              len(batch) - len(kept), attempts, error, extra={"peer": self.peer_url})
+                    batch = kept
+                    if not batch:
+                        return False
+            log.warning("⚠️  Lote de %d falló (%s), reintento en %.1fs", len(batch), error, delay,
+                        extra={"peer": self.peer_url})
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
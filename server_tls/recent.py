@@ -0,0 +1,77 @@
+"""
+recent.py - Últimos mensajes en memoria para ponerse al día al conectar
+
+RecentMessages guarda los últimos `size` mensajes de chat ordenados por
+(lamport, server_id), sembrados desde la BD al arrancar. Lo que llega por
+push, sync o anti-entropía puede venir desordenado: se inserta en su lugar
+y, con el anillo lleno, se descarta el más antiguo. Cada mensaje se
+serializa a lo sumo una vez por codificación, así la reposición a un
+cliente nuevo es unir bytes ya armados y mandarlos en una sola escritura.
+
+El cliente puede pedir solo lo posterior a un cursor con la línea
+"/since <lamport>:<server_id>" antes del nickname (al reconectar).
+"""
+import threading
+from bisect import bisect_left, bisect_right
+
+import wire
+
+SINCE_COMMAND = "/since"
+
+
+def parse_since(line):
+    """
+    "/since <lamport>[:<server_id>]" -> (lamport, server_id), o None si la
+    línea no es ese comando. Un cursor inválido equivale a reponer todo.
+    """
+    parts = line.split(None, 1)
+    if not parts or parts[0].lower() != SINCE_COMMAND:
+        return None
+    lamport, _, server = (parts[1] if len(parts) > 1 else "").strip().partition(":")
+    try:
+        return int(lamport), server
+    except ValueError:
+        return (0, "")
+
+
+class RecentMessages:
+    def __init__(self, size=100):
+        self.size = max(0, int(size))
+        self._keys = []      # (lamport, server_id), crecientes
+        self._entries = []   # (payload, {codificación: bytes})
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, payload):
+        """Inserta un mensaje en su lugar (ignora duplicados)."""
+        if not self.size:
+            return
+        key = (int(payload["lamport"]), payload["server_id"])
+        with self._lock:
+            i = bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                return
+            if len(self._keys) >= self.size:
+                if i == 0:
+                    # Más antiguo que todo lo que ya hay en el anillo lleno
+                    return
+                del self._keys[0]
+                del self._entries[0]
+                i -= 1
+            self._keys.insert(i, key)
+            self._entries.insert(i, (payload, {}))
+
+    def replay(self, encoding=wire.JSON, since=None):
+        """Frames de los mensajes posteriores a `since` (todos si es None)."""
+        with self._lock:
+            start = bisect_right(self._keys, since) if since else 0
+            entries = self._entries[start:]
+        chunks = []
+        for payload, encoded in entries:
+            data = encoded.get(encoding)
+            if data is None:
+                data = encoded[encoding] = wire.encode(payload, encoding)
+            chunks.append(data)
+        return b"".join(chunks)
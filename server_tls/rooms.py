@@ -0,0 +1,79 @@
+"""
+rooms.py - Salas del servidor TLS
+
+Cada cliente puede estar en varias salas; lo que escribe va a su sala
+actual (la última a la que entró). Rooms indexa en los dos sentidos:
+sala -> canales, para que broadcast recorra solo a los miembros, y
+canal -> salas, para sacarlo de todas al desconectarse.
+
+No tiene lock propio: server_tls lo usa siempre bajo clients_lock, junto
+con el registro de clientes.
+"""
+import re
+
+from db import DEFAULT_ROOM
+
+JOIN_COMMAND = "/join"
+LEAVE_COMMAND = "/leave"
+ROOMS_COMMAND = "/rooms"
+
+_ROOM_NAME = re.compile(r"^[a-z0-9_-]{1,32}$")
+
+
+def normalize_room(name):
+    """Nombre de sala normalizado ("#Dev" -> "dev") o None si no es válido."""
+    room = (name or "").strip().lstrip("#").lower()
+    return room if _ROOM_NAME.match(room) else None
+
+
+class Rooms:
+    def __init__(self):
+        self.members = {}    # sala -> {canal}
+        self.joined = {}     # canal -> [salas, en orden de entrada]
+
+    def join(self, channel, room):
+        """Suma el canal a la sala y la deja como actual. True si no estaba."""
+        rooms = self.joined.setdefault(channel, [])
+        new = room not in rooms
+        if not new:
+            rooms.remove(room)
+        rooms.append(room)
+        self.members.setdefault(room, set()).add(channel)
+        return new
+
+    def leave(self, channel, room):
+        """Saca el canal de la sala. True si estaba."""
+        rooms = self.joined.get(channel)
+        if not rooms or room not in rooms:
+            return False
+        rooms.remove(room)
+        members = self.members.get(room)
+        members.discard(channel)
+        if not members:
+            del self.members[room]
+        return True
+
+    def remove(self, channel):
+        """Saca el canal de todas sus salas y las retorna."""
+        rooms = self.joined.pop(channel, [])
+        for room in rooms:
+            members = self.members.get(room)
+            members.discard(channel)
+            if not members:
+                del self.members[room]
+        return rooms
+
+    def current(self, channel):
+        """Sala a la que van los mensajes del canal (None si no está en ninguna)."""
+        rooms = self.joined.get(channel)
+        return rooms[-1] if rooms else None
+
+    def rooms_of(self, channel):
+        return list(self.joined.get(channel, ()))
+
+    def channels(self, room):
+        return self.members.get(room, ())
+
+    def counts(self):
+        return {room: len(members) for room, members in self.members.items()}
+
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+run_cluster.py - Levanta un clúster local de N nodos (node.py) y verifica
+que todos los mensajes lleguen a todos los nodos.
+
+1. Genera N configs con `peers` en malla completa y arranca N procesos.
+2. Conecta un cliente TLS por nodo y cada uno envía M mensajes.
+3. Verifica que el /history de cada nodo tenga los N*M mensajes y que cada
+   cliente haya recibido los (N-1)*M mensajes de los demás.
+4. Detiene el nodo 0, envía más mensajes en el resto, lo vuelve a arrancar
+   y verifica que se ponga al día.
+
+USO: python run_cluster.py [--nodes 3] [--messages 5]
+Sale con código 0 si el clúster converge, 1 si no.
+"""
+import argparse
+import json
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def write_configs(workdir, n, tls_base, rest_base, extra):
+    paths = []
+    for i in range(n):
+        peers = [f"http://127.0.0.1:{rest_base + j}" for j in range(n) if j != i]
+        cfg = {
+            "server_id": chr(ord("A") + i),
+            "host": "127.0.0.1",
+            "port": tls_base + i,
+            "rest_host": "127.0.0.1",
+            "rest_port": rest_base + i,
+            "db_file": os.path.join(workdir, f"node_{i}.db"),
+            "peers": peers,
+            "tls_cert": os.path.join(BASE_DIR, "server.crt"),
+            "tls_key": os.path.join(BASE_DIR, "server.key"),
+            "heartbeat_interval": 1,
+            "sync_interval": 1,
+            "replication_stream": True,
+            "replication_keepalive": 2,
+        }
+        cfg.update(extra)
+        path = os.path.join(workdir, f"node_{i}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(cfg, f, indent=2)
+        paths.append(path)
+    return paths
+
+
+def start_node(config_path, workdir, i):
+    log = open(os.path.join(workdir, f"node_{i}.log"), "a", encoding="utf-8")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, "node.py"), "--config", config_path],
+        cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT
+    )
+
+
+def wait_http(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+class Client:
+    """Cliente TLS mínimo: handshake de nickname y lectura de JSON lines."""
+
+    def __init__(self, port, nickname):
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        raw = socket.create_connection(("127.0.0.1", port), timeout=5)
+        self.sock = context.wrap_socket(raw, server_hostname="localhost")
+        self.sock.recv(1024)  # "Ingresa tu nickname:"
+        self.sock.sendall((nickname + "\n").encode("utf-8"))
+        self.buffer = b""
+        self.received = set()
+
+    def send(self, text):
+        self.sock.sendall((text + "\n").encode("utf-8"))
+
+    def poll(self):
+        self.sock.settimeout(0.05)
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                self.buffer += data
+        except (socket.timeout, ssl.SSLError, BlockingIOError):
+            pass
+        *lines, self.buffer = self.buffer.split(b"\n")
+        for line in lines:
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if msg.get("type") == "message":
+                self.received.add(msg["message"])
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def history(rest_port):
+    r = requests.get(f"http://127.0.0.1:{rest_port}/history", timeout=5)
+    return {m["message"] for m in r.json()["messages"]}
+
+
+def wait_until(check, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.5)
+    return check()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de clúster local de N nodos")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--tls-port", type=int, default=19100)
+    parser.add_argument("--rest-port", type=int, default=15100)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--workdir", type=str, default=None)
+    args = parser.parse_args()
+
+    n, m = args.nodes, args.messages
+    workdir = args.workdir or tempfile.mkdtemp(prefix="chat_cluster_")
+    os.makedirs(workdir, exist_ok=True)
+    configs = write_configs(workdir, n, args.tls_port, args.rest_port, {})
+    print(f"[CLUSTER] {n} nodos, configs y logs en {workdir}")
+
+    procs = [start_node(c, workdir, i) for i, c in enumerate(configs)]
+    clients = []
+    ok = True
+    try:
+        for i in range(n):
+            if not wait_http(f"http://127.0.0.1:{args.rest_port + i}/heartbeat"):
+                print(f"[CLUSTER] ✗ Nodo {i} no arrancó")
+                return 1
+
+        # Fase 1: todos conectados
+        clients = [Client(args.tls_port + i, f"bot{i}") for i in range(n)]
+        time.sleep(1)
+        expected = set()
+        for i, client in enumerate(clients):
+            for k in range(m):
+                text = f"n{i}-m{k}"
+                client.send(text)
+                expected.add(text)
+
+        def phase1():
+            for c in clients:
+                c.poll()
+            dbs_ok = all(history(args.rest_port + i) >= expected for i in range(n))
+            fanout_ok = all(
+                c.received >= {t for t in expected if not t.startswith(f"n{i}-")}
+                for i, c in enumerate(clients)
+            )
+            return dbs_ok and fanout_ok
+
+        if wait_until(phase1, args.timeout):
+            print(f"[CLUSTER] ✓ Fase 1: {len(expected)} mensajes en los {n} nodos y clientes")
+        else:
+            print("[CLUSTER] ✗ Fase 1: el clúster no convergió")
+            ok = False
+
+        # Fase 2: el nodo 0 cae, el resto sigue, el nodo 0 vuelve y se pone al día
+        clients[0].close()
+        procs[0].terminate()
+        procs[0].wait(10)
+        for i in range(1, n):
+            for k in range(m):
+                text = f"offline-n{i}-m{k}"
+                clients[i].send(text)
+                expected.add(text)
+        time.sleep(1)
+        procs[0] = start_node(configs[0], workdir, 0)
+        wait_http(f"http://127.0.0.1:{args.rest_port}/heartbeat")
+
+        if wait_until(lambda: all(history(args.rest_port + i) >= expected for i in range(n)),
+                      args.timeout):
+            print(f"[CLUSTER] ✓ Fase 2: el nodo 0 recuperó lo enviado mientras estaba caído")
+        else:
+            print("[CLUSTER] ✗ Fase 2: el nodo 0 no se puso al día")
+            ok = False
+    finally:
+        for c in clients:
+            c.close()
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,43 +2,35 @@
 """
 server_tls.py - Servidor TLS con sincronización distribuida
 """
+import asyncio
 import socket
 import ssl
 import threading
 import json
+import logging
+from collections import OrderedDict
 from datetime import datetime, timezone
-import os
 import time
-import argparse
 import requests
-import traceback
 import sys
 
+import metrics
+import outbound
+import wire
+from logs import get_logger
+from peers import Peer, peer_urls, peer_headers
+from framing import LineReader, LineTooLong
+from outbound import ThreadedChannel, AsyncChannel
+from recent import RecentMessages, parse_since
+from rooms import Rooms, normalize_room, JOIN_COMMAND, LEAVE_COMMAND, ROOMS_COMMAND
 from db import (
-    init_db, insert_message, get_max_lamport, 
-    get_last_message_position, DB_LOCK
+    submit_message, get_origin_positions, get_bucket_digests, flush,
+    get_recent_messages, get_max_message_id, get_private_messages_after_id,
+    DIGEST_BUCKET, DEFAULT_ROOM
+)
+from node_state import (
+    config, db_conn, db_path, clock, add_message_listener
 )
-
-# --- Configuración ---
-def load_config():
-    parser = argparse.ArgumentParser(description="Servidor TLS distribuido")
-    parser.add_argument("--config", type=str, required=True,
-                        help="Ruta al archivo de configuración JSON")
-    args = parser.parse_args()
-
-    config_path = args.config
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"El archivo de configuración '{config_path}' no existe")
-
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
-
-    return config
-
-config = load_config()
-BASE_DIR = os.path.dirname(__file__)
-db_path = os.path.join(BASE_DIR, config.get("db_file", "messages.db"))
-db_conn = init_db(db_path)
 
 HOST = config.get("host", "0.0.0.0")
 PORT = int(config.get("port", 9000))
@@ -47,366 +39,1132 @@ TLS_CERT = config.get("tls_cert", "server.crt")
 TLS_KEY = config.get("tls_key", "server.key")
 HEARTBEAT_INTERVAL = float(config.get("heartbeat_interval", 2))
 SYNC_INTERVAL = float(config.get("sync_interval", 3))
+SYNC_PAGE_SIZE = int(config.get("sync_page_size", 1000))
+SYNC_STREAM = config.get("sync_stream", False)  # consumir /sync como NDJSON
+
+# Replicación por canal /replicate del peer; el sondeo de /sync queda como respaldo
+REPLICATION_STREAM = config.get("replication_stream", False)
+REPLICATION_KEEPALIVE = float(config.get("replication_keepalive", 5))
+
+# Lecturas de replicación autenticadas con peer_token (traen también los privados)
+PEER_HEADERS = peer_headers(config)
+
+# Sin node.py, distributed_api corre en otro proceso y guarda en la BD los
+# privados que llegan por /push: este proceso los sigue desde la BD cada
+# private_poll_interval segundos (ver follow_private_messages)
+PRIVATE_POLL_INTERVAL = float(config.get("private_poll_interval", 0.5))
+PRIVATE_POLL_BATCH = 500
+follow_private = False
 
-# Control de logs (configurable)
-DEBUG = config.get("debug", False)  # False = logs mínimos
-VERBOSE_SYNC = config.get("verbose_sync", False)
-VERBOSE_PUSH = config.get("verbose_push", False)
-VERBOSE_HB = config.get("verbose_heartbeat", False)
+# Anti-entropía por digests (repara huecos por debajo de los watermarks)
+ANTI_ENTROPY_INTERVAL = float(config.get("anti_entropy_interval", 30))
+DIGEST_GROUP = int(config.get("digest_group", 64))
+
+# Motor de conexiones: "threads" (un hilo por cliente) o "asyncio" (event loop)
+ENGINE = config.get("engine", "threads")
+BACKLOG = int(config.get("backlog", 1024))
+MAX_LINE = int(config.get("max_line_bytes", 65536))
+
+# Colas de salida por cliente: tamaño y política para clientes lentos ("drop" | "evict")
+CLIENT_QUEUE_SIZE = int(config.get("client_queue_size", 256))
+SLOW_CLIENT_POLICY = config.get("slow_client_policy", outbound.POLICY_DROP)
+
+# Mensajes recientes que se reponen a cada cliente al conectarse (0 = ninguno)
+REPLAY_SIZE = int(config.get("replay_size", 100))
+# Salas con anillo de recientes en memoria (LRU)
+REPLAY_ROOMS = max(1, int(config.get("replay_rooms", 256)))
+
+# Logs por componente (niveles en log_level / log_levels, ver logs.py)
+log = get_logger("tls")
+log_msg = get_logger("messages")   # una línea por mensaje, con límite de tasa
+log_bc = get_logger("broadcast")
+log_hb = get_logger("hb")
+log_sync = get_logger("sync")
+log_repl = get_logger("repl")
+log_ae = get_logger("ae")
+
+# Puerto HTTP propio para GET /metrics (0 = no se abre; con distributed_api
+# en el mismo proceso ya está en su /metrics)
+METRICS_PORT = int(config.get("metrics_port", 0))
 
 # --- Estado ---
 clients = {}
 clients_lock = threading.Lock()
-lamport_lock = threading.Lock()
-peer_alive_lock = threading.Lock()
-peer_alive = True
+rooms = Rooms()   # salas de cada canal, también bajo clients_lock
+sessions = {}     # nick -> {canales}: índice inverso de clients para /msg
 
-# ✅ Inicializar lamport con el máximo de la BD
-lamport = get_max_lamport(db_conn)
-# No imprimir aquí, se imprimirá en start_server()
+# --- Métricas ---
+MESSAGES_RECEIVED = metrics.counter(
+    "chat_messages_received_total", "Mensajes recibidos de clientes TLS locales")
+DIRECT_MESSAGES = metrics.counter(
+    "chat_direct_messages_total", "Mensajes privados (/msg) de clientes TLS locales")
+REMOTE_MESSAGES = metrics.counter(
+    "chat_remote_messages_total", "Mensajes nuevos aplicados desde peers (sync, replicación, anti-entropía)")
+BROADCASTS = metrics.counter("chat_broadcasts_total", "Llamadas a broadcast")
+BROADCAST_SECONDS = metrics.histogram(
+    "chat_broadcast_seconds", "Duración de broadcast (serializar y encolar a todos)")
+SYNC_SECONDS = metrics.histogram(
+    "chat_sync_seconds", "Ida y vuelta de cada GET /sync a un peer", ("peer",))
 
-# --- Lamport Clock ---
+metrics.gauge("chat_clients_connected", "Clientes TLS conectados").set_function(
+    lambda: len(clients))
+metrics.gauge("chat_rooms_active", "Salas con al menos un cliente conectado").set_function(
+    lambda: len(rooms.members))
+metrics.gauge("chat_outbound_queue_depth", "Frames en las colas de salida de todos los clientes").set_function(
+    lambda: get_outbound_stats()["queue_depth_total"])
+metrics.counter("chat_outbound_frames_total", "Frames encolados a clientes").set_function(
+    lambda: outbound.stats.frames_enqueued)
+metrics.counter("chat_outbound_dropped_total", "Frames descartados por colas llenas").set_function(
+    lambda: outbound.stats.dropped_frames)
+metrics.counter("chat_outbound_evicted_total", "Clientes desconectados por lentos").set_function(
+    lambda: outbound.stats.evicted_clients)
+
+# --- Lamport Clock (compartido con distributed_api vía node_state) ---
 def increment_lamport():
-    global lamport
-    with lamport_lock:
-        lamport += 1
-        return lamport
+    return clock.tick()
 
 def update_lamport_on_receive(received_lamport):
-    global lamport
-    with lamport_lock:
-        lamport = max(lamport, int(received_lamport)) + 1
-        return lamport
+    return clock.update(received_lamport)
 
 # --- Broadcast ---
+def _drop_client(channel):
+    """
+    Saca el canal de clients, de sus salas y de las sesiones de su nick
+    (con clients_lock tomado). Retorna (nick, salas).
+    """
+    nickname = clients.pop(channel, None)
+    left_rooms = rooms.remove(channel)
+    channels = sessions.get(nickname)
+    if channels is not None:
+        channels.discard(channel)
+        if not channels:
+            del sessions[nickname]
+    return nickname, left_rooms
+
+
 def broadcast(payload_dict, sender_socket=None):
     """
-    Envía payload a todos los clientes excepto sender_socket.
+    Encola payload para los miembros de su sala (o para todos si no trae
+    "room") excepto sender_socket. Serializa una sola vez por codificación
+    en uso y no bloquea: cada canal tiene su propio escritor.
     """
-    data = json.dumps(payload_dict) + "\n"
-    encoded = data.encode("utf-8")
-    to_remove = []
-    
+    started = time.perf_counter()
+    encoded = {}
+
+    def frame(encoding):
+        data = encoded.get(encoding)
+        if data is None:
+            data = encoded[encoding] = wire.encode(payload_dict, encoding)
+        return data
+
+    room = payload_dict.get("room")
     with clients_lock:
-        num_clients = len(clients)
-        if DEBUG:
-            print(f"[BROADCAST] Enviando a {num_clients} clientes (excluye sender={sender_socket is not None})")
-        
-        for client in list(clients.keys()):
-            if client == sender_socket:
-                continue
-            try:
-                client.sendall(encoded)
-                if DEBUG:
-                    print(f"[BROADCAST] ✓ Enviado a {clients.get(client, 'unknown')}")
-            except Exception as e:
-                if DEBUG:
-                    print(f"[BROADCAST] ✗ Error enviando a {clients.get(client, 'unknown')}: {e}")
-                try:
-                    client.shutdown(socket.SHUT_RDWR)
-                except Exception:
-                    pass
-                try:
-                    client.close()
-                except Exception:
-                    pass
-                to_remove.append(client)
-        for r in to_remove:
-            clients.pop(r, None)
+        members = rooms.channels(room) if room else clients
+        targets = [c for c in members if c is not sender_socket]
+
+    log_bc.debug("Enviando a %d clientes (excluye sender=%s)", len(targets), sender_socket is not None)
+
+    # Un canal que rechaza el envío ya cerró su socket (expulsado por lento
+    # o caído): su handler sale del bucle de lectura y en el finally lo
+    # saca de clients y anuncia la salida
+    closed = sum(1 for c in targets if not c.send(frame(c.encoding)))
+    if closed:
+        log_bc.debug("✗ %d clientes cerrados (cola llena o desconectados)", closed)
+    BROADCASTS.inc()
+    BROADCAST_SECONDS.observe(time.perf_counter() - started)
+
+
+def get_outbound_stats():
+    """Contadores de las colas de salida más profundidad actual (total y máxima)."""
+    with clients_lock:
+        depths = [c.depth() for c in clients]
+    result = outbound.stats.snapshot()
+    result["queue_depth_total"] = sum(depths)
+    result["queue_depth_max"] = max(depths, default=0)
+    return result
+
+# --- Mensajes recientes (un anillo por sala) ---
+# LRU acotado a REPLAY_ROOMS: el anillo menos usado se descarta y, si la
+# sala vuelve a necesitarlo, se siembra otra vez desde la BD
+recent_rooms = OrderedDict()
+recent_seeding = {}   # sala -> Event, mientras su anillo se siembra
+recent_lock = threading.Lock()
+
+
+def _seed_ring(ring, room):
+    """
+    Suma al anillo los últimos mensajes de la sala (lectura bloqueante).
+    El anillo ya está publicado: lo que deliver() agregue mientras tanto se
+    mezcla por (lamport, server_id) sin duplicarse.
+    """
+    if not REPLAY_SIZE:
+        return
+    # Lo que se difundió antes de publicar el anillo puede seguir en la cola
+    # del escritor (write-behind): la barrera lo deja visible para la consulta
+    try:
+        flush(db_conn, timeout=5)
+    except Exception as e:
+        log.warning("Sin barrera del escritor al sembrar #%s: %s", room, e)
+    for user, text, lamport, server_id, ts, *_ in get_recent_messages(db_conn, REPLAY_SIZE, room):
+        ring.add({
+            "type": "message",
+            "user": user,
+            "message": text,
+            "lamport": lamport,
+            "server_id": server_id,
+            "timestamp": ts,
+            "room": room
+        })
+
+
+def recent_for(room):
+    """
+    Anillo de recientes de la sala; se siembra desde la BD la primera vez,
+    así que no debe llamarse desde el event loop. Si otro thread lo está
+    sembrando, espera a que termine.
+    """
+    with recent_lock:
+        ring = recent_rooms.get(room)
+        seeding = recent_seeding.get(room)
+        if ring is None:
+            # Se publica vacío antes de consultar para que deliver() ya lo llene
+            ring = recent_rooms[room] = RecentMessages(REPLAY_SIZE)
+            seeding = recent_seeding[room] = threading.Event()
+            seeder = True
+        else:
+            seeder = False
+        recent_rooms.move_to_end(room)
+        while len(recent_rooms) > REPLAY_ROOMS:
+            recent_rooms.popitem(last=False)
+
+    if not seeder:
+        if seeding is not None:
+            seeding.wait()
+        return ring
+
+    # La consulta va fuera del lock para no frenar al resto de salas
+    try:
+        _seed_ring(ring, room)
+    except Exception:
+        # Sin sembrar no sirve: el próximo que lo pida lo vuelve a intentar
+        with recent_lock:
+            if recent_rooms.get(room) is ring:
+                del recent_rooms[room]
+        raise
+    finally:
+        with recent_lock:
+            recent_seeding.pop(room, None)
+        seeding.set()
+    return ring
+
+
+def deliver_private(payload, sender_socket=None):
+    """
+    Entrega un mensaje privado a las sesiones locales del destinatario y a
+    las demás sesiones del remitente. Retorna cuántas sesiones del
+    destinatario hay en este nodo.
+    """
+    encoded = {}
+    with clients_lock:
+        recipients = sessions.get(payload["to"], ())
+        found = len(recipients)
+        targets = (set(recipients) | sessions.get(payload["user"], set())) - {sender_socket}
+
+    # Como en broadcast, los canales cerrados los saca su propio handler
+    for c in targets:
+        data = encoded.get(c.encoding)
+        if data is None:
+            data = encoded[c.encoding] = wire.encode(payload, c.encoding)
+        c.send(data)
+    return found
+
+
+def deliver(payload, sender_socket=None):
+    """
+    Agrega un mensaje de chat a los recientes de su sala y lo difunde; los
+    privados van solo a las sesiones de destinatario y remitente.
+    """
+    if payload.get("to"):
+        deliver_private(payload, sender_socket)
+        return
+    payload.setdefault("room", DEFAULT_ROOM)
+    # Sin anillo no se crea uno (deliver corre también en el event loop):
+    # quien entre luego a la sala lo siembra desde la BD, tras la barrera
+    # del escritor, así que este mensaje también queda en el anillo
+    with recent_lock:
+        ring = recent_rooms.get(payload["room"])
+    if ring is not None:
+        ring.add(payload)
+    broadcast(payload, sender_socket)
+
+
+def register_client(channel, nickname, since=None):
+    """
+    Registra el canal en la sala por defecto. Repone en una sola escritura
+    los mensajes recientes posteriores a `since` y recién entonces suma el
+    canal a la difusión, bajo el mismo lock: lo que entre a los recientes
+    después le llega por broadcast (a lo sumo alguno llega dos veces,
+    nunca se pierde).
+    """
+    ring = recent_for(DEFAULT_ROOM)
+    with clients_lock:
+        backlog = ring.replay(channel.encoding, since)
+        if backlog:
+            channel.send(backlog)
+        clients[channel] = nickname
+        rooms.join(channel, DEFAULT_ROOM)
+        sessions.setdefault(nickname, set()).add(channel)
+
+
+def join_room(channel, nickname, room):
+    """Suma el canal a la sala (reponiendo sus recientes) y la deja como actual."""
+    ring = recent_for(room)
+    with clients_lock:
+        new = rooms.join(channel, room)
+        if new:
+            backlog = ring.replay(channel.encoding)
+            if backlog:
+                channel.send(backlog)
+    if new:
+        announce_join(nickname, room)
+
+
+def leave_room(channel, nickname, room):
+    with clients_lock:
+        left = rooms.leave(channel, room)
+    if left:
+        announce_leave(nickname, room)
+    return left
+
+
+# Mensajes que distributed_api guarda (/push) se difunden al instante
+# cuando ambos corren en el mismo proceso (node.py)
+add_message_listener(deliver)
+
+# --- Lógica común a ambos motores ---
+def users_reply(channel):
+    """Usuarios de la sala actual del canal."""
+    with clients_lock:
+        room = rooms.current(channel)
+        users_list = ", ".join(clients[c] for c in rooms.channels(room) if c in clients)
+    if room is None:
+        return wire.encode_text("No estás en ninguna sala (usa /join <sala>)\n", channel.encoding)
+    return wire.encode_text(f"Usuarios en #{room}: {users_list}\n", channel.encoding)
+
+
+def rooms_reply(channel):
+    """Salas del canal (la actual marcada con *) y miembros conectados de cada una."""
+    with clients_lock:
+        current = rooms.current(channel)
+        counts = rooms.counts()
+        mine = rooms.rooms_of(channel)
+    listed = ", ".join(
+        f"{'*' if room == current else ''}#{room} ({counts.get(room, 0)})" for room in mine
+    )
+    return wire.encode_text(f"Tus salas: {listed or '-'}\n", channel.encoding)
+
+
+def handle_command(nickname, message, channel):
+    """
+    Comandos del cliente: /users, /rooms, /join <sala>, /leave [sala] y
+    /msg <nick> <texto>. Retorna False si la línea no es un comando (se
+    trata como mensaje).
+    """
+    command, _, arg = message.partition(" ")
+    command = command.lower()
+    arg = arg.strip()
+
+    if command == "/users":
+        reply = users_reply(channel)
+    elif command == ROOMS_COMMAND:
+        reply = rooms_reply(channel)
+    elif command == JOIN_COMMAND:
+        room = normalize_room(arg)
+        if room is None:
+            reply = wire.encode_text("Sala inválida: usa /join <sala> (a-z, 0-9, _ o -)\n", channel.encoding)
+        else:
+            join_room(channel, nickname, room)
+            reply = wire.encode_text(f"Ahora escribes en #{room}\n", channel.encoding)
+    elif command == "/msg":
+        target, _, text = arg.partition(" ")
+        text = text.strip()
+        if not target or not text:
+            reply = wire.encode_text("Uso: /msg <nick> <texto>\n", channel.encoding)
+        elif handle_direct_message(nickname, target, text, channel) or PEERS:
+            reply = None
+        else:
+            reply = wire.encode_text(f"{target} no está conectado\n", channel.encoding)
+    elif command == LEAVE_COMMAND:
+        with clients_lock:
+            room = normalize_room(arg) if arg else rooms.current(channel)
+        if room and leave_room(channel, nickname, room):
+            with clients_lock:
+                current = rooms.current(channel)
+            where = f"ahora escribes en #{current}" if current else "usa /join <sala> para volver a escribir"
+            reply = wire.encode_text(f"Saliste de #{room}; {where}\n", channel.encoding)
+        else:
+            reply = wire.encode_text(f"No estás en #{room or arg}\n", channel.encoding)
+    else:
+        return False
+
+    if reply:
+        channel.send(reply)
+    return True
+
+
+def announce_join(nickname, room=DEFAULT_ROOM):
+    broadcast({
+        "type": "system",
+        "text": f"{nickname} se ha unido a #{room}.",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "server_id": SERVER_ID,
+        "room": room
+    })
+
+
+def announce_leave(nickname, room=DEFAULT_ROOM):
+    broadcast({
+        "type": "system",
+        "text": f"{nickname} salió de #{room}.",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "server_id": SERVER_ID,
+        "room": room
+    })
+
+
+def handle_chat_message(nickname, message, sender):
+    """
+    Estampa con Lamport, persiste, difunde y replica un mensaje de un
+    cliente en su sala actual.
+    """
+    with clients_lock:
+        room = rooms.current(sender)
+    if room is None:
+        sender.send(wire.encode_text("No estás en ninguna sala (usa /join <sala>)\n", sender.encoding))
+        return
+
+    MESSAGES_RECEIVED.inc()
+    my_l = increment_lamport()
+    ts = datetime.now(timezone.utc).isoformat()
+
+    # Write-behind: el escritor de db.py lo persiste en el próximo lote
+    try:
+        submit_message(db_conn, nickname, message, my_l, SERVER_ID, ts, room)
+    except Exception:
+        log.exception("No se pudo encolar el mensaje en la BD")
+
+    payload = {
+        "type": "message",
+        "user": nickname,
+        "message": message,
+        "lamport": my_l,
+        "server_id": SERVER_ID,
+        "timestamp": ts,
+        "room": room
+    }
+
+    # Broadcast a clientes locales
+    deliver(payload, sender_socket=sender)
+
+    # Push al peer (con canal de replicación el peer trae los mensajes solo)
+    if not REPLICATION_STREAM:
+        push_to_peer(payload)
+
+    log_msg.info("[%s] #%s: %s", nickname, room, message,
+                 extra={"user": nickname, "lamport": my_l, "server_id": SERVER_ID, "room": room})
+
+
+def handle_direct_message(nickname, target, message, sender):
+    """
+    Estampa, persiste y entrega un mensaje privado de un cliente. Los nodos
+    no comparten quién está conectado: se empuja a todos los peers y cada
+    uno lo entrega a sus sesiones del destinatario. Siempre va por push,
+    también con canal de replicación: sin peer_token los peers no lo
+    pueden leer por /sync ni /replicate.
+    Retorna cuántas sesiones del destinatario hay en este nodo.
+    """
+    DIRECT_MESSAGES.inc()
+    my_l = increment_lamport()
+    ts = datetime.now(timezone.utc).isoformat()
+
+    try:
+        submit_message(db_conn, nickname, message, my_l, SERVER_ID, ts, recipient=target)
+    except Exception:
+        log.exception("No se pudo encolar el mensaje privado en la BD")
+
+    payload = {
+        "type": "private",
+        "user": nickname,
+        "to": target,
+        "message": message,
+        "lamport": my_l,
+        "server_id": SERVER_ID,
+        "timestamp": ts
+    }
+    found = deliver_private(payload, sender_socket=sender)
+    push_to_peer(payload)
+
+    # Sin el texto: los privados no van al log
+    log_msg.info("[%s] → %s (privado)", nickname, target,
+                 extra={"user": nickname, "to": target, "lamport": my_l, "server_id": SERVER_ID})
+    return found
+
 
 # --- Cliente TLS ---
 def handle_client(conn, addr):
-    buffer = ""
+    channel = None
     try:
         conn.sendall(b"Ingresa tu nickname:\n")
-        nickname = conn.recv(1024).decode('utf-8').strip() or "anon"
+        lines = LineReader(MAX_LINE).lines_from(conn)
+        line = (next(lines, None) or "").strip()
+
+        # Negociación opcional antes del nickname: formato de salida (/proto)
+        # y cursor de reposición (/since), en cualquier orden
+        encoding = since = None
+        while True:
+            proto = wire.parse_proto(line)
+            cursor = parse_since(line)
+            if proto:
+                encoding = proto
+                conn.sendall(wire.proto_ack(proto))
+            elif cursor is not None:
+                since = cursor
+            else:
+                break
+            line = (next(lines, None) or "").strip()
+        nickname = line or "anon"
+
+        channel = ThreadedChannel(conn, CLIENT_QUEUE_SIZE, SLOW_CLIENT_POLICY,
+                                  encoding or wire.JSON)
+        register_client(channel, nickname, since)
+
+        log.info("[%s] conectado desde %s", nickname, addr)
+        announce_join(nickname)
+
+        for line in lines:
+            message = line.strip()
+            if not message:
+                continue
+
+            # Comandos (/users, /rooms, /join, /leave)
+            if message.startswith("/") and handle_command(nickname, message, channel):
+                continue
 
+            # Mensaje normal
+            handle_chat_message(nickname, message, channel)
+
+    except LineTooLong:
+        # Línea más larga que MAX_LINE: se corta la conexión
+        log.warning("Cliente %s: línea demasiado larga, desconectando", addr)
+    except ConnectionResetError:
+        log.info("Cliente %s cerró la conexión", addr)
+    except Exception:
+        log.exception("Error atendiendo al cliente %s", addr)
+    finally:
         with clients_lock:
-            clients[conn] = nickname
+            left_nick, left_rooms = _drop_client(channel)
+        if left_nick:
+            for room in left_rooms:
+                announce_leave(left_nick, room)
+            log.info("[%s] desconectado.", left_nick)
+        if channel is not None:
+            channel.close()
+        else:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+# --- Cliente asyncio ---
+async def read_client_line(reader):
+    """
+    Siguiente línea del cliente (bytes, b"" al cerrar). StreamReader señala
+    con ValueError una línea más larga que MAX_LINE: se traduce a
+    LineTooLong, como en el lector del motor de threads.
+    """
+    try:
+        return await reader.readline()
+    except ValueError:
+        raise LineTooLong(f"línea de más de {MAX_LINE} bytes") from None
+
 
-        print(f"[{nickname}] conectado desde {addr}")
+async def handle_client_async(reader, writer):
+    loop = asyncio.get_running_loop()
+    addr = writer.get_extra_info("peername")
+    client = None
+    try:
+        writer.write(b"Ingresa tu nickname:\n")
+        await writer.drain()
+        line = (await read_client_line(reader)).decode('utf-8', errors='replace').strip()
+
+        # Negociación opcional antes del nickname: formato de salida (/proto)
+        # y cursor de reposición (/since), en cualquier orden
+        encoding = since = None
+        while True:
+            proto = wire.parse_proto(line)
+            cursor = parse_since(line)
+            if proto:
+                encoding = proto
+                writer.write(wire.proto_ack(proto))
+                await writer.drain()
+            elif cursor is not None:
+                since = cursor
+            else:
+                break
+            line = (await read_client_line(reader)).decode('utf-8', errors='replace').strip()
+        nickname = line or "anon"
+
+        client = AsyncChannel(writer, loop, CLIENT_QUEUE_SIZE, SLOW_CLIENT_POLICY,
+                              encoding or wire.JSON)
+        # register_client puede sembrar el anillo desde la BD: fuera del loop
+        await loop.run_in_executor(None, register_client, client, nickname, since)
 
-        join_payload = {
-            "type": "system",
-            "text": f"{nickname} se ha unido al chat.",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "server_id": SERVER_ID
-        }
-        broadcast(join_payload)
+        log.info("[%s] conectado desde %s", nickname, addr)
+        announce_join(nickname)
 
         while True:
-            data = conn.recv(4096)
-            if not data:
+            line = await read_client_line(reader)
+            if not line:
                 break
-            buffer += data.decode('utf-8', errors='replace')
-            while "\n" in buffer:
-                line, buffer = buffer.split("\n", 1)
-                message = line.strip()
-                if not message:
-                    continue
+            message = line.decode('utf-8', errors='replace').strip()
+            if not message:
+                continue
 
-                # Comando /users
-                if message.lower() == "/users":
-                    with clients_lock:
-                        users_list = ", ".join(clients.values())
-                    try:
-                        conn.sendall(f"Usuarios conectados: {users_list}\n".encode('utf-8'))
-                    except Exception:
-                        pass
+            # Comandos: solo /join toca la BD (siembra la sala), va al executor
+            if message.startswith("/"):
+                if message.split(None, 1)[0].lower() == JOIN_COMMAND:
+                    handled = await loop.run_in_executor(None, handle_command, nickname, message, client)
+                else:
+                    handled = handle_command(nickname, message, client)
+                if handled:
                     continue
 
-                # Mensaje normal
-                my_l = increment_lamport()
-                ts = datetime.now(timezone.utc).isoformat()
-                
-                try:
-                    insert_message(db_conn, nickname, message, my_l, SERVER_ID, ts)
-                except Exception:
-                    print("[DB ERROR]:", traceback.format_exc())
-
-                payload = {
-                    "type": "message",
-                    "user": nickname,
-                    "message": message,
-                    "lamport": my_l,
-                    "server_id": SERVER_ID,
-                    "timestamp": ts
-                }
-                
-                # Broadcast a clientes locales
-                broadcast(payload, sender_socket=conn)
-                
-                # Push al peer
-                push_to_peer(payload)
-                
-                if DEBUG:
-                    print(f"[{nickname}] ({my_l},{SERVER_ID}) {message}")
-                else:
-                    print(f"[{nickname}]: {message}")
+            # Mensaje normal: la BD es write-behind y el push va a una cola,
+            # así que no bloquea el loop
+            handle_chat_message(nickname, message, client)
 
-    except ConnectionResetError:
-        print(f"[Cliente {addr} cerró la conexión]")
+    except LineTooLong:
+        # Línea más larga que MAX_LINE: se corta la conexión
+        log.warning("Cliente %s: línea demasiado larga, desconectando", addr)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        log.info("Cliente %s cerró la conexión", addr)
     except Exception:
-        print("[CLIENT ERROR]:", traceback.format_exc())
+        log.exception("Error atendiendo al cliente %s", addr)
     finally:
         with clients_lock:
-            left_nick = clients.pop(conn, None)
+            left_nick, left_rooms = _drop_client(client)
         if left_nick:
-            leave_payload = {
-                "type": "system",
-                "text": f"{left_nick} salió del chat.",
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "server_id": SERVER_ID
-            }
-            broadcast(leave_payload)
-            print(f"[{left_nick}] desconectado.")
-        try:
-            conn.shutdown(socket.SHUT_RDWR)
-        except Exception:
-            pass
-        try:
-            conn.close()
-        except Exception:
-            pass
+            for room in left_rooms:
+                announce_leave(left_nick, room)
+            log.info("[%s] desconectado.", left_nick)
+        if client is not None:
+            client.close()
+        else:
+            try:
+                writer.close()
+            except Exception:
+                pass
 
-# --- Push to peer ---
-def push_to_peer(payload):
-    global peer_alive
-    peer_url = config.get("peer_url")
-    if not peer_url:
-        print("[PUSH] No hay peer_url configurado.")
-        return
+# --- Peers ---
+# Un Peer por cada nodo de `peers` (o el único `peer_url`)
+PEERS = [
+    Peer(
+        url,
+        push_batch_size=int(config.get("push_batch_size", 200)),
+        push_max_backoff=float(config.get("push_max_backoff", 30)),
+        push_max_attempts=int(config.get("push_max_attempts", 8)),
+        # Sin peer_token los privados solo llegan por push: no se descartan
+        private_recoverable=bool(PEER_HEADERS)
+    )
+    for url in peer_urls(config)
+]
 
-    with peer_alive_lock:
-        alive = peer_alive
 
-    if not alive:
-        print("[PUSH] Peer marcado como no-alive, saltando push.")
-        return
+def replication_lag(peer):
+    """
+    Lamports del origen del peer que él ya tiene y nosotros todavía no:
+    su propio watermark (informado en el heartbeat) menos el nuestro.
+    """
+    if peer.server_id is None or peer.origin_lamport is None:
+        return float("nan")
+    local = get_origin_positions(db_conn).get(peer.server_id, 0)
+    return max(0, peer.origin_lamport - local)
 
-    try:
-        url = f"{peer_url}/push"
-        print(f"[PUSH] POST -> {url} lamport={payload.get('lamport')} server_id={payload.get('server_id')}")
-        resp = requests.post(url, json=payload, timeout=2)
-        print(f"[PUSH] Respuesta: status={resp.status_code} body={resp.json()}")
-        
-        if resp.status_code != 200:
-            with peer_alive_lock:
-                peer_alive = False
-            print(f"[PUSH] ⚠️  Peer respondió {resp.status_code}, marcado como no-alive")
-    except Exception as e:
-        with peer_alive_lock:
-            peer_alive = False
-        print("[PUSH] ❌ Error:", repr(e))
 
-# --- Heartbeat ---
-def heartbeat_monitor():
-    global peer_alive
-    peer_url = config.get("peer_url")
-    if not peer_url:
+PEER_UP = metrics.gauge("chat_peer_up", "1 si el heartbeat del peer responde", ("peer",))
+REPLICATION_LAG = metrics.gauge(
+    "chat_replication_lag", "Lamports del peer aún no replicados aquí", ("peer",))
+PUSH_PENDING = metrics.gauge("chat_push_pending", "Mensajes en la cola de push", ("peer",))
+PUSH_SENT = metrics.counter("chat_push_sent_total", "Mensajes aceptados por el peer", ("peer",))
+PUSH_OVERFLOW = metrics.counter(
+    "chat_push_overflow_total", "Mensajes que no entraron en la cola de push", ("peer",))
+
+for _peer in PEERS:
+    PEER_UP.labels(_peer.url).set_function(lambda p=_peer: int(p.is_alive()))
+    REPLICATION_LAG.labels(_peer.url).set_function(lambda p=_peer: replication_lag(p))
+    PUSH_PENDING.labels(_peer.url).set_function(_peer.push.pending)
+    PUSH_SENT.labels(_peer.url).set_function(lambda p=_peer: p.push.sent)
+    PUSH_OVERFLOW.labels(_peer.url).set_function(lambda p=_peer: p.push.overflow)
+
+
+def push_to_peer(payload):
+    """Encola el payload para cada peer sin bloquear al cliente."""
+    if not PEERS:
         return
+    for peer in PEERS:
+        peer.push.enqueue(payload)
+
+# --- Heartbeat ---
+def heartbeat_monitor(peer):
+    log_hb.info("Monitor iniciado. Chequeando: %s/heartbeat", peer.url)
 
-    print(f"[HB] Monitor iniciado. Chequeando: {peer_url}/heartbeat")
-    
     # Esperar 3 segundos antes del primer check
-    print("[HB] Esperando 3s para que el peer arranque...")
+    log_hb.info("Esperando 3s para que el peer arranque...")
     time.sleep(3)
-    print("[HB] Comenzando monitoreo del peer")
-    
+    log_hb.info("Comenzando monitoreo de %s", peer.url)
+
     while True:
+        error = None
         try:
-            url = f"{peer_url}/heartbeat"
-            print(f"[HB] → GET {url}") if DEBUG else None
+            url = f"{peer.url}/heartbeat"
+            log_hb.debug("→ GET %s", url)
             r = requests.get(url, timeout=2)
-            print(f"[HB] ← Status: {r.status_code}") if DEBUG else None
-            
-            with peer_alive_lock:
-                was_dead = not peer_alive
-                if r.status_code == 200:
-                    peer_alive = True
-                    if was_dead:
-                        print("[HB] ✓ Peer recuperado")
-                else:
-                    peer_alive = False
-                    if not was_dead or DEBUG:
-                        print(f"[HB] ⚠️  Peer caído (status {r.status_code})")
+            log_hb.debug("← Status: %s", r.status_code)
+
+            if r.status_code == 200:
+                data = r.json()
+                peer.server_id = data.get("server_id", peer.server_id)
+                peer.origin_lamport = data.get("origin_lamport", peer.origin_lamport)
+                was_alive = peer.set_alive(True)
+                if not was_alive:
+                    log_hb.info("✓ Peer %s recuperado", peer.url)
+            else:
+                error = f"status {r.status_code}"
         except requests.exceptions.ConnectionError as e:
-            with peer_alive_lock:
-                was_alive = peer_alive
-                peer_alive = False
-                if was_alive or DEBUG:
-                    print(f"[HB] ⚠️  Peer caído (ConnectionError: {repr(e)[:80]})")
+            error = f"ConnectionError: {repr(e)[:80]}"
         except requests.exceptions.Timeout:
-            with peer_alive_lock:
-                was_alive = peer_alive
-                peer_alive = False
-                if was_alive or DEBUG:
-                    print("[HB] ⚠️  Peer caído (Timeout)")
+            error = "Timeout"
         except Exception as e:
-            with peer_alive_lock:
-                was_alive = peer_alive
-                peer_alive = False
-                if was_alive or DEBUG:
-                    print(f"[HB] ⚠️  Peer caído (Error: {repr(e)[:80]})")
-        
+            error = f"Error: {repr(e)[:80]}"
+
+        if error:
+            # Solo la transición a caído es un aviso; el resto, a nivel debug
+            was_alive = peer.set_alive(False)
+            log_hb.log(logging.WARNING if was_alive else logging.DEBUG,
+                       "⚠️  Peer %s caído (%s)", peer.url, error, extra={"peer": peer.url})
+
         time.sleep(HEARTBEAT_INTERVAL)
 
 # --- Sync ---
-def sync_with_peer():
-    global peer_alive
-    peer_url = config.get("peer_url")
-    if not peer_url:
-        return
+def apply_remote_messages(msgs):
+    """
+    Aplica un lote de mensajes remotos: ajusta Lamport, los encola en la BD
+    (un solo commit para el lote) y difunde a los clientes locales los nuevos.
+    """
+    # Encolar todo el lote y esperar una sola vez
+    pending = []
+    for m in msgs:
+        if isinstance(m, dict):
+            user = m.get("user")
+            text = m.get("message")
+            remote_l = m.get("lamport")
+            remote_server = m.get("server_id")
+            ts = m.get("timestamp")
+            room = m.get("room") or DEFAULT_ROOM
+            recipient = m.get("to")
+        else:
+            continue
+
+        # El texto de los privados no va al log
+        log_sync.debug("Procesando (%s, '%s'): %.40s", remote_l, remote_server,
+                       "(privado)" if recipient else text)
+
+        update_lamport_on_receive(remote_l)
+        fut = submit_message(db_conn, user, text, remote_l, remote_server, ts, room, recipient)
+        pending.append((user, text, remote_l, remote_server, ts, room, recipient, fut))
+
+    for user, text, remote_l, remote_server, ts, room, recipient, fut in pending:
+        try:
+            stored = fut.result()
+        except Exception as e:
+            log_sync.warning("✗ (%s,%s) no se pudo guardar: %s", remote_l, remote_server, e)
+            continue
+        if stored:
+            REMOTE_MESSAGES.inc()
+            payload = {
+                "type": "private" if recipient else "message",
+                "user": user,
+                "message": text,
+                "lamport": remote_l,
+                "server_id": remote_server,
+                "timestamp": ts
+            }
+            if recipient:
+                payload["to"] = recipient
+                log_msg.info("✓ [%s] → %s (%s,%s) (privado)", user, recipient, remote_l, remote_server,
+                             extra={"user": user, "to": recipient, "lamport": remote_l,
+                                    "server_id": remote_server})
+                if follow_private:
+                    # Lo entrega follow_private_messages, como a los de /push
+                    continue
+            else:
+                payload["room"] = room
+                log_msg.info("✓ [%s] (%s,%s): %s", user, remote_l, remote_server, text,
+                             extra={"user": user, "lamport": remote_l, "server_id": remote_server})
+            deliver(payload)
+        else:
+            log_sync.debug("⊘ Duplicado (%s,%s)", remote_l, remote_server)
+
+
+def format_vector(vector):
+    return ",".join(f"{origin}:{lamport}" for origin, lamport in vector.items())
+
+
+def advance_vector(vector, msgs):
+    for m in msgs:
+        origin = m.get("server_id")
+        vector[origin] = max(vector.get(origin, 0), int(m.get("lamport", 0)))
+
+
+def pull_paged(peer, vector):
+    """
+    Trae del peer, página a página, lo que tenga de cada origen posterior a
+    nuestro cursor vectorial (incluye lo que el peer recibió de terceros).
+    """
+    has_more = True
+    while has_more:
+        log_sync.debug("Consultando %s desde %s", peer.url, vector)
+
+        started = time.perf_counter()
+        r = requests.get(f"{peer.url}/sync", params={
+            "vector": format_vector(vector),
+            "limit": SYNC_PAGE_SIZE
+        }, headers=PEER_HEADERS, timeout=3)
+        SYNC_SECONDS.labels(peer.url).observe(time.perf_counter() - started)
+
+        if r.status_code != 200:
+            log_sync.warning("⚠️  Error %s en %s", r.status_code, peer.url)
+            return False
+
+        data = r.json()
+        msgs = data.get("messages", [])
+        has_more = bool(data.get("has_more")) and bool(msgs)
+
+        if msgs:
+            log_sync.info("← Recibidos %d mensajes de %s", len(msgs), peer.url)
+            apply_remote_messages(msgs)
+            advance_vector(vector, msgs)
+    return True
+
+
+def pull_stream(peer, vector):
+    """
+    Como pull_paged pero como NDJSON, aplicando a medida que llega en lotes
+    de SYNC_PAGE_SIZE (memoria constante).
+    """
+    log_sync.debug("Stream de %s desde %s", peer.url, vector)
+
+    started = time.perf_counter()
+    with requests.get(f"{peer.url}/sync", params={
+        "vector": format_vector(vector),
+        "stream": 1
+    }, headers=PEER_HEADERS, stream=True, timeout=(3, 30)) as r:
+        if r.status_code != 200:
+            log_sync.warning("⚠️  Error %s en %s", r.status_code, peer.url)
+            return False
+
+        batch = []
+        total = 0
+        for line in r.iter_lines():
+            if not line:
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= SYNC_PAGE_SIZE:
+                apply_remote_messages(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            apply_remote_messages(batch)
+            total += len(batch)
+    # Con stream la respuesta incluye aplicar lo recibido
+    SYNC_SECONDS.labels(peer.url).observe(time.perf_counter() - started)
+
+    if total:
+        log_sync.info("← Recibidos %d mensajes de %s (stream)", total, peer.url)
+    return True
+
+
+def sync_with_peer(peer):
+    log_sync.debug("Thread iniciado. peer=%s", peer.url)
 
-    if VERBOSE_SYNC or DEBUG:
-        print(f"[SYNC] Thread iniciado. peer_url={peer_url}")
-    
     # Esperar 5 segundos antes del primer sync
-    print("[SYNC] Esperando 5s antes del primer sync...")
+    log_sync.info("Esperando 5s antes del primer sync...")
     time.sleep(5)
-    print("[SYNC] Comenzando sincronización periódica")
+    log_sync.info("Comenzando sincronización periódica con %s", peer.url)
     
     while True:
         try:
-            with peer_alive_lock:
-                alive = peer_alive
-            
-            if not alive:
+            # Con un solo peer el canal /replicate basta; con varios el sondeo
+            # sigue siendo el gossip que trae lo de nodos que no vemos directo
+            skip = peer.replication_active.is_set() and len(PEERS) == 1
+            if not peer.is_alive() or skip:
                 time.sleep(SYNC_INTERVAL)
                 continue
 
-            # Obtener última posición
-            last_lamport, last_server = get_last_message_position(db_conn)
-            
-            url = f"{peer_url}/sync?since_lamport={last_lamport}&since_server={last_server}"
-            if VERBOSE_SYNC:
-                print(f"[SYNC] Consultando desde ({last_lamport}, '{last_server}')")
-            
-            r = requests.get(url, timeout=3)
-
-            if r.status_code != 200:
-                with peer_alive_lock:
-                    peer_alive = False
-                print(f"[SYNC] ⚠️  Error {r.status_code}")
-                time.sleep(SYNC_INTERVAL)
-                continue
+            # Cursor vectorial: lo que ya tenemos de cada origen
+            vector = get_origin_positions(db_conn)
+
+            if SYNC_STREAM:
+                ok = pull_stream(peer, vector)
+            else:
+                ok = pull_paged(peer, vector)
+
+            if not ok:
+                peer.set_alive(False)
+
+        except Exception as e:
+            log_sync.debug("Error: %r", e, exc_info=True)
+            peer.set_alive(False)
+
+        time.sleep(SYNC_INTERVAL)
+
+# --- Canal de replicación ---
+def replication_stream(peer):
+    """
+    Mantiene abierto GET /replicate del peer y aplica los lotes a medida que
+    llegan. Solo pide los mensajes originados en ese peer (lo de terceros
+    llega por su propio canal o por el sondeo). Si el canal se cae,
+    sync_with_peer vuelve a sondear hasta poder reconectar.
+    """
+    # Mismo margen de arranque que el heartbeat
+    time.sleep(3)
+    log_repl.info("Canal de replicación con %s iniciado", peer.url)
 
-            data = r.json()
-            msgs = data.get("messages", [])
-            
-            if msgs:
-                print(f"[SYNC] ← Recibidos {len(msgs)} mensajes")
-
-            for m in msgs:
-                if isinstance(m, dict):
-                    user = m.get("user")
-                    text = m.get("message")
-                    remote_l = m.get("lamport")
-                    remote_server = m.get("server_id")
-                    ts = m.get("timestamp")
+    while True:
+        # El server_id del peer lo informa el heartbeat
+        if not peer.is_alive() or peer.server_id is None:
+            time.sleep(SYNC_INTERVAL)
+            continue
+
+        try:
+            since = get_origin_positions(db_conn).get(peer.server_id, 0)
+            # Sin datos por más de 3 keepalives se considera el canal muerto
+            with requests.get(f"{peer.url}/replicate", params={
+                "since_lamport": since,
+                "since_server": peer.server_id,
+                "origin": peer.server_id
+            }, headers=PEER_HEADERS, stream=True, timeout=(3, REPLICATION_KEEPALIVE * 3)) as r:
+                if r.status_code != 200:
+                    log_repl.warning("⚠️  Error %s en %s", r.status_code, peer.url)
                 else:
-                    continue
+                    peer.replication_active.set()
+                    log_repl.info("✓ Conectado a %s desde (%s, '%s')", peer.url, since, peer.server_id)
+                    for line in r.iter_lines():
+                        if not line:
+                            continue
+                        msgs = json.loads(line).get("messages", [])
+                        if msgs:
+                            apply_remote_messages(msgs)
+        except Exception as e:
+            log_repl.debug("Error: %r", e)
+        finally:
+            if peer.replication_active.is_set():
+                log_repl.warning("⚠️  Canal con %s cerrado, usando sondeo de /sync", peer.url)
+            peer.replication_active.clear()
 
-                if VERBOSE_SYNC:
-                    print(f"[SYNC] Procesando ({remote_l}, '{remote_server}'): {text[:40]}")
-                
-                update_lamport_on_receive(remote_l)
-                was_inserted = insert_message(db_conn, user, text, remote_l, remote_server, ts)
-                
-                if was_inserted:
-                    broadcast({
-                        "type": "message",
+        time.sleep(SYNC_INTERVAL)
+
+# --- Privados guardados por la API en otro proceso ---
+def follow_private_messages():
+    """
+    Solo con server_tls.py y distributed_api.py en procesos separados: la
+    API guarda los privados que llegan por /push pero no tiene a quién
+    entregarlos, y el watermark ya avanzó, así que /sync no los vuelve a
+    traer. Este thread sigue la BD por id y entrega a las sesiones locales
+    los privados de otros orígenes; en este modo es la única vía de entrega
+    de privados remotos.
+    """
+    last_id = get_max_message_id(db_conn)
+    log.info("Siguiendo privados guardados por la API desde el id %d", last_id)
+    while True:
+        time.sleep(PRIVATE_POLL_INTERVAL)
+        try:
+            max_id = get_max_message_id(db_conn)
+            while last_id < max_id:
+                rows = get_private_messages_after_id(db_conn, last_id, max_id, PRIVATE_POLL_BATCH)
+                for _, user, text, lamport, server_id, ts, _, recipient in rows:
+                    if server_id == SERVER_ID:
+                        continue
+                    deliver_private({
+                        "type": "private",
                         "user": user,
+                        "to": recipient,
                         "message": text,
-                        "lamport": remote_l,
-                        "server_id": remote_server,
+                        "lamport": lamport,
+                        "server_id": server_id,
                         "timestamp": ts
                     })
-                    print(f"[SYNC] ✓ [{user}] ({remote_l},{remote_server}): {text}")
-                elif VERBOSE_SYNC:
-                    print(f"[SYNC] ⊘ Duplicado ({remote_l},{remote_server})")
+                # Sin más privados en el tramo se salta hasta max_id
+                last_id = rows[-1][0] if len(rows) == PRIVATE_POLL_BATCH else max_id
+        except Exception:
+            log.exception("Error siguiendo los privados de la BD")
 
-        except Exception as e:
-            if DEBUG:
-                print("[SYNC] Error:", repr(e))
-                traceback.print_exc()
-            with peer_alive_lock:
-                peer_alive = False
 
-        time.sleep(SYNC_INTERVAL)
+# --- Anti-entropía ---
+def differing_keys(local, remote):
+    """Claves cuyo digest remoto difiere del local y donde el peer tiene algo."""
+    return sorted(
+        int(k) for k, (count, h) in remote.items()
+        if count and tuple(local.get(int(k), (0, 0))) != (count, h)
+    )
+
+
+def reconcile_with_peer(peer):
+    """
+    Compara digests por grupos de buckets, baja a buckets individuales solo
+    en los grupos distintos y trae por /range los buckets que difieren.
+    Solo trae: lo que el peer no tenga lo pedirá él en su propia ronda.
+    Si el peer no nos autentica, sus digests y /range excluyen los
+    privados y se comparan contra los digests públicos locales.
+    """
+    r = requests.get(f"{peer.url}/digest", params={"group": DIGEST_GROUP},
+                     headers=PEER_HEADERS, timeout=5)
+    r.raise_for_status()
+    data = r.json()
+    if data.get("bucket_size") != DIGEST_BUCKET:
+        log_ae.warning("⚠️  %s usa buckets de %s, se omite", peer.url, data.get("bucket_size"))
+        return 0
+    private = data.get("private", True)
+
+    local_groups = get_bucket_digests(db_conn, DIGEST_GROUP, private=private)
+    fetched = 0
+    for g in differing_keys(local_groups, data["digests"]):
+        lo_b, hi_b = g * DIGEST_GROUP, (g + 1) * DIGEST_GROUP
+        r = requests.get(f"{peer.url}/digest", params={
+            "group": 1, "lo_bucket": lo_b, "hi_bucket": hi_b
+        }, headers=PEER_HEADERS, timeout=5)
+        r.raise_for_status()
+        local_buckets = get_bucket_digests(db_conn, 1, lo_b, hi_b, private)
+        for b in differing_keys(local_buckets, r.json()["digests"]):
+            r = requests.get(f"{peer.url}/range", params={
+                "lo": b * DIGEST_BUCKET, "hi": (b + 1) * DIGEST_BUCKET
+            }, headers=PEER_HEADERS, timeout=10)
+            r.raise_for_status()
+            msgs = r.json().get("messages", [])
+            apply_remote_messages(msgs)
+            fetched += len(msgs)
+    return fetched
+
+
+def anti_entropy(peer):
+    # Primera ronda después del arranque del sync
+    time.sleep(10)
+    while True:
+        if peer.is_alive():
+            try:
+                fetched = reconcile_with_peer(peer)
+                log_ae.log(logging.INFO if fetched else logging.DEBUG,
+                           "%s: %d mensajes revisados en buckets distintos", peer.url, fetched)
+            except Exception as e:
+                log_ae.debug("Error: %r", e)
+        time.sleep(ANTI_ENTROPY_INTERVAL)
 
 # --- Start server ---
-def start_server():
-    print(f"[TLS] ========================================")
-    print(f"[TLS] Iniciando servidor TLS")
-    print(f"[TLS] Server ID: {SERVER_ID}")
-    print(f"[TLS] Base de datos: {db_path}")
-    print(f"[TLS] Lamport inicial: {lamport}")
-    print(f"[TLS] Escuchando en {HOST}:{PORT}")
-    print(f"[TLS] Peer URL: {config.get('peer_url', 'No configurado')}")
-    print(f"[TLS] Debug: {DEBUG}")
-    print(f"[TLS] ========================================")
-    
-    # Threads de background
-    print("[TLS] Iniciando threads de sincronización...")
-    t_hb = threading.Thread(target=heartbeat_monitor, daemon=True)
-    t_hb.start()
-    print("[TLS] ✓ Heartbeat monitor iniciado")
-    
-    t_sync = threading.Thread(target=sync_with_peer, daemon=True)
-    t_sync.start()
-    print("[TLS] ✓ Sync monitor iniciado")
+def raise_fd_limit():
+    """Sube el límite de descriptores al máximo permitido (solo POSIX)."""
+    try:
+        import resource
+    except ImportError:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            target = hard if hard != resource.RLIM_INFINITY else 1048576
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except Exception as e:
+        log.warning("No se pudo subir RLIMIT_NOFILE: %r", e)
 
-    # TLS
+
+def create_tls_context():
     context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
     context.load_cert_chain(certfile=TLS_CERT, keyfile=TLS_KEY)
+    return context
+
+
+async def serve_async(context):
+    server = await asyncio.start_server(
+        handle_client_async, HOST, PORT,
+        ssl=context, backlog=BACKLOG, limit=MAX_LINE
+    )
+    log.info("✓ Listo para aceptar conexiones TLS (asyncio)")
+    async with server:
+        await server.serve_forever()
+
+
+def start_background_threads():
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT, HOST)
+        log.info("✓ Métricas en http://%s:%d/metrics", HOST, METRICS_PORT)
+
+    log.info("Iniciando threads de sincronización...")
+    for peer in PEERS:
+        t_hb = threading.Thread(target=heartbeat_monitor, args=(peer,), daemon=True)
+        t_hb.start()
+
+        t_sync = threading.Thread(target=sync_with_peer, args=(peer,), daemon=True)
+        t_sync.start()
+
+        if REPLICATION_STREAM:
+            t_repl = threading.Thread(target=replication_stream, args=(peer,), daemon=True)
+            t_repl.start()
+
+        if ANTI_ENTROPY_INTERVAL > 0:
+            t_ae = threading.Thread(target=anti_entropy, args=(peer,), daemon=True)
+            t_ae.start()
+    log.info("✓ Heartbeat, sync%s iniciados para %d peer(s)",
+             " y replicación" if REPLICATION_STREAM else "", len(PEERS))
+
+
+def start_server():
+    log.info("Iniciando servidor TLS", extra={
+        "server_id": SERVER_ID,
+        "db": db_path,
+        "lamport": clock.value,
+        "listen": f"{HOST}:{PORT}",
+        "peers": [p.url for p in PEERS],
+        "engine": ENGINE,
+    })
+
+    # Proceso propio (sin node.py): los privados de /push llegan por la BD
+    global follow_private
+    follow_private = True
+    threading.Thread(target=follow_private_messages, daemon=True).start()
+
+    start_background_threads()
+
+    # TLS
+    context = create_tls_context()
+
+    if ENGINE == "asyncio":
+        raise_fd_limit()
+        try:
+            asyncio.run(serve_async(context))
+        except KeyboardInterrupt:
+            log.info("Cerrando...")
+            flush(db_conn, timeout=5)
+            sys.exit(0)
+        return
 
     bind_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     bind_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     bind_socket.bind((HOST, PORT))
     bind_socket.listen(5)
 
-    print(f"[TLS] ✓ Listo para aceptar conexiones TLS\n")
+    log.info("✓ Listo para aceptar conexiones TLS")
 
     try:
         while True:
@@ -425,7 +1183,7 @@ def start_server():
                 t.start()
 
             except KeyboardInterrupt:
-                print("\n[SERVER] Cerrando...")
+                log.info("Cerrando...")
                 with clients_lock:
                     for c in list(clients.keys()):
                         try:
@@ -434,11 +1192,13 @@ def start_server():
                             pass
                     clients.clear()
                 bind_socket.close()
+                flush(db_conn, timeout=5)
                 sys.exit(0)
             except Exception:
-                print("[ACCEPT ERROR]:", traceback.format_exc())
+                log.exception("Error aceptando conexión")
     except KeyboardInterrupt:
         bind_socket.close()
+        flush(db_conn, timeout=5)
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+"""
+test_db.py - MessageWriter: resultados por fila, errores y cancelaciones
+
+    python -m unittest test_db
+"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import db
+
+
+class MessageWriterTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        # flush_ms alto: da tiempo a cancelar antes de que se escriba el lote
+        self.db = db.init_db(str(Path(tmp) / "test.db"), flush_ms=200)
+
+    def stored(self):
+        return [(row[2], row[3]) for row in db.get_full_history(self.db)]
+
+    def test_inserta_y_detecta_duplicados(self):
+        first = db.submit_message(self.db, "ana", "hola", 1, "A")
+        again = db.submit_message(self.db, "ana", "hola", 1, "A")
+        self.assertIs(first.result(5), True)
+        self.assertIs(again.result(5), False)
+        self.assertEqual(self.stored(), [(1, "A")])
+
+    def test_fila_invalida_no_arrastra_al_lote(self):
+        with self.assertLogs(db.log, "WARNING"):
+            good = db.submit_message(self.db, "ana", "hola", 1, "A")
+            bad = db.submit_message(self.db, "ana", {"no": "se puede"}, 2, "A")
+            other = db.submit_message(self.db, "bob", "chau", 3, "B")
+
+            self.assertIs(good.result(5), True)
+            with self.assertRaises(Exception):
+                bad.result(5)
+            self.assertIs(other.result(5), True)
+        self.assertEqual(self.stored(), [(1, "A"), (3, "B")])
+        self.assertEqual(db.get_origin_positions(self.db), {"A": 1, "B": 3})
+
+    def test_future_cancelado_no_detiene_al_escritor(self):
+        cancelled = db.submit_message(self.db, "ana", "hola", 1, "A")
+        self.assertTrue(cancelled.cancel())
+        later = db.submit_message(self.db, "ana", "sigue", 2, "A")
+
+        self.assertIs(later.result(5), True)
+        db.flush(self.db, 5)
+        self.assertTrue(self.db.writer.thread.is_alive())
+        # La fila del cancelado se escribe igual
+        self.assertEqual(self.stored(), [(1, "A"), (2, "A")])
+
+    def test_error_del_lote_falla_sus_futures_y_sigue(self):
+        writer = self.db.writer
+        flush_batch = writer._flush
+
+        def broken(batch):
+            writer._flush = flush_batch
+            raise RuntimeError("disco lleno")
+
+        writer._flush = broken
+        with self.assertLogs(db.log, "ERROR"):
+            failed = db.submit_message(self.db, "ana", "hola", 1, "A")
+            with self.assertRaises(RuntimeError):
+                failed.result(5)
+
+        self.assertTrue(writer.thread.is_alive())
+        self.assertIs(db.submit_message(self.db, "ana", "otra", 2, "A").result(5), True)
+
+
+if __name__ == "__main__":
+    unittest.main()
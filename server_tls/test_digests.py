@@ -0,0 +1,53 @@
+"""
+test_digests.py - Digests de anti-entropía con y sin mensajes privados
+
+    python -m unittest test_digests
+"""
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+import db
+
+
+class BucketDigestsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def open(self, name):
+        return db.init_db(str(self.tmp / name))
+
+    def test_privados_solo_en_los_digests_completos(self):
+        a, b = self.open("a.db"), self.open("b.db")
+        for node in (a, b):
+            db.submit_message(node, "ana", "hola", 1, "A").result(5)
+        db.submit_message(a, "bob", "psst", 2, "A", recipient="ana").result(5)
+
+        self.assertNotEqual(db.get_bucket_digests(a), db.get_bucket_digests(b))
+        # Sin peer_token /range no entrega el privado: los digests públicos
+        # tienen que coincidir o la anti-entropía no converge
+        self.assertEqual(db.get_bucket_digests(a, private=False),
+                         db.get_bucket_digests(b, private=False))
+
+    def test_bd_anterior_calcula_los_digests_publicos(self):
+        path = self.tmp / "a.db"
+        a = db.init_db(str(path))
+        db.submit_message(a, "ana", "hola", 1, "A").result(5)
+        db.submit_message(a, "bob", "psst", 2, "A", recipient="ana").result(5)
+        expected = db.get_bucket_digests(a, private=False)
+
+        conn = sqlite3.connect(path)
+        conn.execute(f"DROP TABLE {db.PUBLIC_BUCKETS_TABLE}")
+        conn.commit()
+        conn.close()
+
+        again = db.init_db(str(path))
+        self.assertEqual(db.get_bucket_digests(again, private=False), expected)
+        self.assertEqual(db.get_bucket_digests(again)[0][0], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
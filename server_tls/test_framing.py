@@ -0,0 +1,72 @@
+"""
+test_framing.py - LineReader: líneas a nivel de bytes
+
+    python -m unittest test_framing
+"""
+import socket
+import unittest
+
+from framing import LineReader, LineTooLong
+
+
+class LineReaderTest(unittest.TestCase):
+    def test_readline_espera_la_linea_completa(self):
+        reader = LineReader()
+        reader.feed(b"hola")
+        self.assertIsNone(reader.readline())
+        reader.feed(b" mundo\nsigue")
+        self.assertEqual(reader.readline(), "hola mundo")
+        self.assertIsNone(reader.readline())
+        reader.feed(b"\n")
+        self.assertEqual(reader.readline(), "sigue")
+
+    def test_iteracion_entrega_todas_las_lineas(self):
+        reader = LineReader()
+        reader.feed(b"a\nb\n\nc")
+        self.assertEqual(list(reader), ["a", "b", ""])
+        reader.feed(b"\n")
+        self.assertEqual(list(reader), ["c"])
+
+    def test_utf8_cortado_entre_lecturas(self):
+        data = "año ñandú\n".encode("utf-8")
+        reader = LineReader()
+        reader.feed(data[:2])   # corta la "ñ" a la mitad
+        self.assertEqual(list(reader), [])
+        reader.feed(data[2:])
+        self.assertEqual(list(reader), ["año ñandú"])
+
+    def test_linea_demasiado_larga_sin_fin(self):
+        reader = LineReader(max_line=8)
+        reader.feed(b"x" * 9)
+        with self.assertRaises(LineTooLong):
+            reader.readline()
+
+    def test_linea_demasiado_larga_completa(self):
+        reader = LineReader(max_line=8)
+        reader.feed(b"ok\n" + b"x" * 20 + b"\n")
+        with self.assertRaises(LineTooLong):
+            list(reader)
+
+        reader = LineReader(max_line=8)
+        reader.feed(b"x" * 20 + b"\n")
+        with self.assertRaises(LineTooLong):
+            reader.readline()
+
+    def test_detach_devuelve_lo_no_consumido(self):
+        reader = LineReader()
+        reader.feed(b"/proto bin\nresto")
+        self.assertEqual(reader.readline(), "/proto bin")
+        self.assertEqual(reader.detach(), b"resto")
+        self.assertIsNone(reader.readline())
+
+    def test_lines_from_lee_el_socket_hasta_que_cierra(self):
+        ours, theirs = socket.socketpair()
+        self.addCleanup(ours.close)
+        theirs.sendall(b"uno\ndo")
+        theirs.sendall(b"s\nsin fin")
+        theirs.close()
+        self.assertEqual(list(LineReader().lines_from(ours, bufsize=3)), ["uno", "dos"])
+
+
+if __name__ == "__main__":
+    unittest.main()
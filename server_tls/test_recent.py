@@ -0,0 +1,79 @@
+"""
+test_recent.py - Orden del anillo de mensajes recientes y cursor /since
+
+    python -m unittest test_recent
+"""
+import json
+import unittest
+
+import wire
+from recent import RecentMessages, parse_since
+
+
+def message(lamport, server_id="A", text=None):
+    return {"type": "message", "user": "ana", "message": text or f"m{lamport}{server_id}",
+            "lamport": lamport, "server_id": server_id,
+            "timestamp": "2024-05-01T12:00:00+00:00", "room": "general"}
+
+
+def replayed(ring, since=None):
+    return [(m["lamport"], m["server_id"])
+            for m in map(json.loads, ring.replay(wire.JSON, since).splitlines())]
+
+
+class RecentMessagesTest(unittest.TestCase):
+    def test_ordena_por_lamport_y_servidor(self):
+        ring = RecentMessages(10)
+        for lamport, server_id in [(3, "A"), (1, "B"), (2, "A"), (1, "A"), (3, "B")]:
+            ring.add(message(lamport, server_id))
+        self.assertEqual(replayed(ring), [(1, "A"), (1, "B"), (2, "A"), (3, "A"), (3, "B")])
+
+    def test_ignora_duplicados(self):
+        ring = RecentMessages(10)
+        ring.add(message(1))
+        ring.add(message(1, text="otra copia"))
+        self.assertEqual(len(ring), 1)
+
+    def test_lleno_descarta_el_mas_antiguo(self):
+        ring = RecentMessages(3)
+        for lamport in (1, 2, 3, 5):
+            ring.add(message(lamport))
+        self.assertEqual(replayed(ring), [(2, "A"), (3, "A"), (5, "A")])
+
+        # Uno tardío del medio entra; uno anterior a todo el anillo no
+        ring.add(message(4))
+        ring.add(message(1, "B"))
+        self.assertEqual(replayed(ring), [(3, "A"), (4, "A"), (5, "A")])
+
+    def test_replay_desde_cursor(self):
+        ring = RecentMessages(10)
+        for lamport in (1, 2, 3):
+            ring.add(message(lamport, "A"))
+            ring.add(message(lamport, "B"))
+        self.assertEqual(replayed(ring, (2, "A")), [(2, "B"), (3, "A"), (3, "B")])
+        self.assertEqual(replayed(ring, (3, "B")), [])
+
+    def test_replay_binario(self):
+        ring = RecentMessages(10)
+        ring.add(message(2))
+        ring.add(message(1))
+        bodies = wire.FrameReader().feed(ring.replay(wire.BINARY))
+        self.assertEqual([wire.decode_binary(b)["lamport"] for b in bodies], [1, 2])
+
+    def test_tamano_cero_no_guarda(self):
+        ring = RecentMessages(0)
+        ring.add(message(1))
+        self.assertEqual(len(ring), 0)
+        self.assertEqual(ring.replay(), b"")
+
+
+class ParseSinceTest(unittest.TestCase):
+    def test_cursor(self):
+        self.assertEqual(parse_since("/since 12:B"), (12, "B"))
+        self.assertEqual(parse_since("/since 12"), (12, ""))
+        self.assertEqual(parse_since("/since basura"), (0, ""))
+        self.assertIsNone(parse_since("ana"))
+
+
+if __name__ == "__main__":
+    unittest.main()
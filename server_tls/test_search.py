@@ -0,0 +1,52 @@
+"""
+test_search.py - search_messages: ventana de relevancia sin privados y fija entre páginas
+
+    python -m unittest test_search
+"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import db
+
+
+class SearchMessagesTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        self.db = db.init_db(str(Path(tmp) / "test.db"))
+        if not self.db.fts:
+            self.skipTest("SQLite sin FTS5")
+        self.lamport = 0
+
+    def add(self, message, recipient=None):
+        self.lamport += 1
+        db.submit_message(self.db, "ana", message, self.lamport, "A",
+                          recipient=recipient).result(5)
+
+    def search(self, **kwargs):
+        rows, bounds = db.search_messages(self.db, db.fts_query("hola"), **kwargs)
+        return [row[1] for row in rows], bounds
+
+    def test_ventana_cuenta_solo_publicos(self):
+        self.add("hola uno")
+        self.add("hola dos")
+        self.add("hola secreto", recipient="bob")
+
+        found, _ = self.search(window=2)
+        self.assertEqual(sorted(found), ["hola dos", "hola uno"])
+
+    def test_bounds_fijan_la_ventana_entre_paginas(self):
+        for i in range(4):
+            self.add(f"hola {i}")
+        first, bounds = self.search(limit=2, window=3)
+
+        self.add("hola nuevo")
+        second, again = self.search(limit=2, offset=2, window=3, bounds=bounds)
+        self.assertEqual(again, bounds)
+        self.assertEqual(sorted(first + second), ["hola 1", "hola 2", "hola 3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
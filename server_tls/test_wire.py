@@ -0,0 +1,69 @@
+"""
+test_wire.py - Protocolo de salida a clientes TLS: JSON por líneas y frames binarios
+
+    python -m unittest test_wire
+"""
+import json
+import unittest
+
+import wire
+from framing import LineReader
+
+
+def decode_all(data):
+    return [wire.decode_binary(body) for body in wire.FrameReader().feed(data)]
+
+
+class WireTest(unittest.TestCase):
+    message = {
+        "type": "message",
+        "user": "ana",
+        "message": "hola ñ",
+        "lamport": 42,
+        "server_id": "A",
+        "timestamp": "2024-05-01T12:00:00.123000+00:00",
+        "room": "general",
+    }
+
+    def test_mensaje_ida_y_vuelta(self):
+        (decoded,) = decode_all(wire.encode(self.message, wire.BINARY))
+        self.assertEqual(decoded, self.message)
+
+    def test_sistema_e_info(self):
+        system = {"type": "system", "text": "ana se ha unido a #general.",
+                  "timestamp": "2024-05-01T12:00:00+00:00", "server_id": "A",
+                  "room": "general"}
+        (decoded,) = decode_all(wire.encode(system, wire.BINARY))
+        self.assertEqual(decoded, system)
+
+        (decoded,) = decode_all(wire.encode_text("Usuarios: ana\n", wire.BINARY))
+        self.assertEqual(decoded, {"type": "info", "text": "Usuarios: ana"})
+
+    def test_otros_payloads_viajan_como_json(self):
+        private = {"type": "private", "user": "ana", "to": "bob", "message": "psst",
+                   "lamport": 7, "server_id": "A", "timestamp": None}
+        (decoded,) = decode_all(wire.encode(private, wire.BINARY))
+        self.assertEqual(decoded, private)
+
+    def test_frames_cortados_entre_lecturas(self):
+        data = wire.encode(self.message, wire.BINARY) * 2
+        reader = wire.FrameReader()
+        self.assertEqual(reader.feed(data[:3]), [])
+        self.assertEqual(len(reader.feed(data[3:-1])), 1)
+        (body,) = reader.feed(data[-1:])
+        self.assertEqual(wire.decode_binary(body), self.message)
+
+    def test_json_por_lineas(self):
+        data = wire.encode(self.message) + wire.encode(self.message)
+        reader = LineReader()
+        reader.feed(data)
+        self.assertEqual([json.loads(line) for line in reader], [self.message] * 2)
+
+    def test_negociacion(self):
+        self.assertEqual(wire.parse_proto("/proto BIN"), wire.BINARY)
+        self.assertIsNone(wire.parse_proto("/proto xml"))
+        self.assertEqual(wire.proto_ack(wire.BINARY), b"PROTO bin\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
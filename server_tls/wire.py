@@ -0,0 +1,182 @@
+"""
+wire.py - Codificación de lo que el servidor TLS envía a sus clientes
+
+Dos formatos, negociados por cliente antes del nickname:
+
+  json (por defecto)  una línea JSON por payload, terminada en "\\n".
+  bin                 frames con prefijo de longitud: u32 big-endian con el
+                      tamaño del cuerpo y luego el cuerpo:
+
+        B  tipo        (1 message, 2 system, 3 info, 0 json)
+        Q  lamport
+        q  timestamp   (milisegundos epoch UTC)
+        B + bytes      server_id
+        H + bytes      user
+        I + bytes      texto (message / text)
+        B + bytes      sala (opcional: los decodificadores anteriores la ignoran)
+
+      El tipo 0 lleva en el texto el payload JSON completo, para los
+      payloads que no encajan en la cabecera fija.
+
+Negociación: el cliente envía "/proto bin" como primera línea; el servidor
+responde "PROTO bin\\n" (todavía en texto) y a partir de ahí todo lo que
+envía son frames. Lo que envía el cliente sigue siendo texto por líneas.
+"""
+import json
+import struct
+from datetime import datetime, timezone
+
+JSON = "json"
+BINARY = "bin"
+ENCODINGS = (JSON, BINARY)
+
+PROTO_COMMAND = "/proto"
+
+TYPE_JSON = 0
+TYPE_MESSAGE = 1
+TYPE_SYSTEM = 2
+TYPE_INFO = 3
+
+_LENGTH = struct.Struct(">I")
+_HEADER = struct.Struct(">BQq")
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+
+
+def parse_proto(line):
+    """Retorna la codificación pedida por una línea "/proto X" o None."""
+    parts = line.split()
+    if len(parts) == 2 and parts[0].lower() == PROTO_COMMAND:
+        encoding = parts[1].lower()
+        if encoding in ENCODINGS:
+            return encoding
+    return None
+
+
+def proto_ack(encoding):
+    return f"PROTO {encoding}\n".encode("utf-8")
+
+
+# --- Timestamps ---
+def iso_to_ms(ts):
+    """ISO 8601 -> milisegundos epoch (0 si no se puede interpretar)."""
+    try:
+        dt = datetime.fromisoformat(ts)
+    except (TypeError, ValueError):
+        return 0
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def ms_to_iso(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat()
+
+
+# --- Codificación ---
+def encode_json(payload):
+    return (json.dumps(payload) + "\n").encode("utf-8")
+
+
+def _frame(type_code, lamport, ts_ms, server_id, user, text, room=""):
+    sid = server_id.encode("utf-8")
+    usr = user.encode("utf-8")
+    txt = text.encode("utf-8")
+    parts = [
+        _HEADER.pack(type_code, lamport, ts_ms),
+        _U8.pack(len(sid)), sid,
+        _U16.pack(len(usr)), usr,
+        _U32.pack(len(txt)), txt,
+    ]
+    if room:
+        rm = room.encode("utf-8")
+        parts += [_U8.pack(len(rm)), rm]
+    body = b"".join(parts)
+    return _LENGTH.pack(len(body)) + body
+
+
+def encode_binary(payload):
+    kind = payload.get("type")
+    try:
+        if kind == "message":
+            return _frame(TYPE_MESSAGE, int(payload["lamport"]),
+                          iso_to_ms(payload.get("timestamp")),
+                          payload.get("server_id") or "", payload.get("user") or "",
+                          payload.get("message") or "", payload.get("room") or "")
+        if kind == "system":
+            return _frame(TYPE_SYSTEM, 0, iso_to_ms(payload.get("timestamp")),
+                          payload.get("server_id") or "", "", payload.get("text") or "",
+                          payload.get("room") or "")
+    except (KeyError, TypeError, ValueError, struct.error):
+        pass
+    # Cualquier otro payload viaja como JSON dentro de un frame
+    return _frame(TYPE_JSON, 0, 0, "", "", json.dumps(payload))
+
+
+def encode(payload, encoding=JSON):
+    if encoding == BINARY:
+        return encode_binary(payload)
+    return encode_json(payload)
+
+
+def encode_text(text, encoding=JSON):
+    """Respuestas de texto a un solo cliente (p. ej. /users)."""
+    if encoding == BINARY:
+        return _frame(TYPE_INFO, 0, 0, "", "", text.rstrip("\n"))
+    return text.encode("utf-8")
+
+
+# --- Decodificación (clientes) ---
+def decode_binary(body):
+    """Cuerpo de un frame -> dict con la misma forma que el payload JSON."""
+    type_code, lamport, ts_ms = _HEADER.unpack_from(body, 0)
+    pos = _HEADER.size
+    (n,) = _U8.unpack_from(body, pos)
+    pos += _U8.size
+    server_id = body[pos:pos + n].decode("utf-8")
+    pos += n
+    (n,) = _U16.unpack_from(body, pos)
+    pos += _U16.size
+    user = body[pos:pos + n].decode("utf-8")
+    pos += n
+    (n,) = _U32.unpack_from(body, pos)
+    pos += _U32.size
+    text = body[pos:pos + n].decode("utf-8")
+    pos += n
+    extra = {}
+    if pos < len(body):
+        (n,) = _U8.unpack_from(body, pos)
+        pos += _U8.size
+        extra["room"] = body[pos:pos + n].decode("utf-8")
+
+    if type_code == TYPE_MESSAGE:
+        return {"type": "message", "user": user, "message": text, "lamport": lamport,
+                "server_id": server_id, "timestamp": ms_to_iso(ts_ms), **extra}
+    if type_code == TYPE_SYSTEM:
+        return {"type": "system", "text": text, "timestamp": ms_to_iso(ts_ms),
+                "server_id": server_id, **extra}
+    if type_code == TYPE_INFO:
+        return {"type": "info", "text": text}
+    return json.loads(text)
+
+
+class FrameReader:
+    """Acumula bytes del socket y entrega los cuerpos de frames completos."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        bodies = []
+        pos = 0
+        while len(self.buffer) - pos >= _LENGTH.size:
+            (size,) = _LENGTH.unpack_from(self.buffer, pos)
+            end = pos + _LENGTH.size + size
+            if len(self.buffer) < end:
+                break
+            bodies.append(bytes(self.buffer[pos + _LENGTH.size:end]))
+            pos = end
+        del self.buffer[:pos]
+        return bodies